@@ -1,17 +1,18 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from src.middleware.rate_limiter import RateLimiter
 from src.models.analysis import (
     NailAnalysisResult,
     ImageQualityMetrics,
     NutritionAdvice,
-    AnalysisHistory,
+    AnalysisDetails,
     ErrorResponse
 )
 import json
 import os
+import asyncio
 from dotenv import load_dotenv
 from datetime import datetime
 import time
@@ -20,7 +21,7 @@ import logging
 import sys
 import firebase_admin
 from firebase_admin import credentials
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 from slowapi import Limiter
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
@@ -34,6 +35,10 @@ import imghdr  # 画像ファイル形式を検証するために追加
 from src.services.vision_service import VisionService
 from src.services.gemini_service import GeminiService
 from src.services.firestore_service import FirestoreService
+from src.services.analysis_cache import AnalysisResultCache
+from src.services.duplicate_detector import NearDuplicateIndex, compute_dhash
+from src.utils.stage_runner import StageRunner, StageRunResult
+from src.utils.json_stream import IncrementalJSONExtractor
 
 # ロガーの設定
 logging.basicConfig(
@@ -132,11 +137,28 @@ async def lifespan(app: FastAPI):
     app.state.rate_limiter = rate_limiter
     print("レート制限が無効化されています (テスト環境)" if os.getenv("TEST_MODE", "False").lower() == "true" else "レート制限を初期化しました")
     
+    # 解析履歴の書き込みキュー（前回の異常終了でスプールに残った書き込みを再送）
+    await firestore_service.start()
+    
+    # 定番の入力に対するアドバイスをバックグラウンドで事前生成・定期更新
+    prewarm_task = None
+    if os.getenv("ADVICE_PREWARM_ENABLED", "false").lower() == "true":
+        prewarm_task = asyncio.create_task(
+            gemini_service.run_prewarm_loop(float(os.getenv("ADVICE_PREWARM_INTERVAL_SECONDS", "600")))
+        )
+    
     yield
     
     # シャットダウン処理
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+        await asyncio.gather(prewarm_task, return_exceptions=True)
     if hasattr(app.state, 'rate_limiter'):
         app.state.rate_limiter.reset()
+    analysis_cache.close()
+    await vision_service.close()
+    # 書き込みキューに残った解析履歴を書き込んでから閉じる
+    await firestore_service.close()
 
 # FastAPIアプリケーションの初期化
 app = FastAPI(
@@ -226,6 +248,24 @@ gemini_service = GeminiService(
 )
 firestore_service = FirestoreService()
 
+# 画像ハッシュをキーとする解析結果キャッシュ
+analysis_cache = AnalysisResultCache(
+    ttl_seconds=int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "3600")),
+    max_memory_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_MEMORY_BYTES", str(16 * 1024 * 1024))),
+    db_path=os.getenv("ANALYSIS_CACHE_DB_PATH") or None,
+    max_disk_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))
+)
+
+# リクエスト全体の期限（秒）。アドバイス生成は残り時間を超えると定型アドバイスで代替する
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
+
+# 連写などの近似重複画像を検出するインデックス
+duplicate_index = NearDuplicateIndex(
+    max_distance=int(os.getenv("DUPLICATE_MAX_DISTANCE", "6")),
+    window_seconds=float(os.getenv("DUPLICATE_WINDOW_SECONDS", "300")),
+    max_entries_per_user=int(os.getenv("DUPLICATE_MAX_ENTRIES_PER_USER", "1024"))
+)
+
 # カスタムミドルウェアでレート制限ヘッダーを追加
 @app.middleware("http")
 async def add_rate_limit_headers(request: Request, call_next):
@@ -249,6 +289,19 @@ async def health_check(request: Request):
         }
     }
 
+# キャッシュなどの統計情報エンドポイント
+@app.get("/metrics")
+async def metrics():
+    """内部コンポーネントの統計情報を返します"""
+    return {
+        "vision": vision_service.get_stats(),
+        "gemini_advice_cache": gemini_service.get_cache_stats(),
+        "gemini_generation": gemini_service.get_generation_stats(),
+        "analysis_cache": analysis_cache.get_stats(),
+        "duplicate_index": duplicate_index.get_stats(),
+        "persistence": firestore_service.get_write_stats()
+    }
+
 # カスタムミドルウェアでレート制限を実装
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
@@ -284,6 +337,8 @@ async def analyze_image(
     try:
         logger.info(f"画像解析リクエストを受信: filename={file.filename}, content_type={file.content_type}")
         
+        deadline = asyncio.get_event_loop().time() + REQUEST_TIMEOUT_SECONDS
+        
         # ファイルの検証
         contents = await file.read()
         image_format = imghdr.what(None, contents)
@@ -300,51 +355,38 @@ async def analyze_image(
         await file.seek(0)
         
         try:
-            # Vision AIによる画像解析
-            logger.info("Vision AI解析を開始")
-            vision_result = await vision_service.analyze_image(contents)
-            logger.info(f"Vision AI解析結果: {vision_result}")
+            # リクエストティアで必要なVision機能が変わるため、キャッシュキーはティアごとに分ける
+            tier = vision_service.resolve_tier("member" if user_id else "guest")
+            cache_key = f"{tier}:{analysis_cache.compute_key(contents)}"
             
-            # Gemini APIによる栄養アドバイス生成
-            logger.info("Gemini API解析を開始")
-            nutrition_advice = await gemini_service.generate_advice(vision_result)
-            logger.info(f"Gemini API解析結果: {nutrition_advice}")
+            # 直近の近似重複画像（連写など）があればその解析結果を再利用
+            # （共有IPの別人の結果を返さないよう、認証済みのユーザーに限る）
+            image_hash, pipeline_output = await _find_near_duplicate(user_id, contents, cache_key)
             
-            # 解析結果オブジェクトの作成
-            result = NailAnalysisResult(
-                risk_score=vision_result.get("risk_score", 0.5),
-                confidence_score=vision_result.get("confidence_score", 0.8),
-                risk_level=_calculate_risk_level(vision_result.get("risk_score", 0.5)),
-                detected_colors=vision_result.get("detected_colors", []),
-                quality_metrics=ImageQualityMetrics(
-                    is_blurry=vision_result.get("is_blurry", False),
-                    brightness_score=vision_result.get("brightness_score", 0.8),
-                    has_proper_lighting=vision_result.get("has_proper_lighting", True),
-                    has_detected_nail=vision_result.get("has_detected_nail", True)
-                ),
-                created_at=datetime.utcnow().isoformat(),
-                user_id=user_id
-            )
-            
-            # 認証されたユーザーの場合、結果を保存
-            if user_id:
-                logger.info(f"解析結果を保存: user_id={user_id}")
-                analysis_history = AnalysisHistory(
-                    history_id=str(int(time.time())),
-                    user_id=user_id,
-                    analysis_result=result,
-                    nutrition_advice=nutrition_advice,
-                    created_at=datetime.utcnow()
-                )
-                await firestore_service.save_analysis_result(
-                    user_id=user_id,
-                    analysis_result=analysis_history.dict()
+            # 同一画像の解析結果はキャッシュから再利用（同時リクエストは1回の解析を共有）
+            if pipeline_output is None:
+                # 期限切れで定型アドバイスに代替した結果はキャッシュしない
+                pipeline_output = await analysis_cache.get_or_compute(
+                    cache_key,
+                    lambda: _run_analysis_pipeline(contents, tier, deadline=deadline),
+                    request_bytes=len(contents),
+                    should_cache=lambda output: not output.get("degraded")
                 )
+                if image_hash is not None:
+                    duplicate_index.add(user_id, image_hash, cache_key)
+            
+            # 解析結果オブジェクトの作成（リクエストごとの情報を付与）
+            result, nutrition_advice = _build_response_models(pipeline_output, user_id)
+            
+            # 認証されたユーザーの場合、結果を保存（画質チェックで除外・警告された結果は保存しない）
+            if user_id and _is_persistable(pipeline_output):
+                await _save_analysis_history(user_id, result, nutrition_advice)
             
             return JSONResponse(
                 content={
                     "analysis": result.dict(),
-                    "nutrition_advice": nutrition_advice.dict() if nutrition_advice else None
+                    "nutrition_advice": nutrition_advice.dict() if nutrition_advice else None,
+                    "quality_warnings": pipeline_output.get("quality_warnings", [])
                 },
                 status_code=200
             )
@@ -376,6 +418,260 @@ async def analyze_image(
             status_code=500
         )
 
+# 段階的な解析結果のストリーミングエンドポイント（NDJSON）
+@app.post("/analyze/stream")
+async def analyze_image_stream(
+    file: UploadFile = File(...),
+    user_id: str = None
+):
+    """
+    各ステージの完了ごとにイベントを1行のJSONとして送信します
+    quality_gate → risk → advice_chunk / advice_field（生成中のテキストと閉じたフィールド）
+    → analysis → advice → saved → done
+    """
+    logger.info(f"ストリーミング解析リクエストを受信: filename={file.filename}")
+    deadline = asyncio.get_event_loop().time() + REQUEST_TIMEOUT_SECONDS
+    contents = await file.read()
+    if not imghdr.what(None, contents):
+        return JSONResponse(
+            content=ErrorResponse(
+                summary="無効なファイル形式です。JPEG、PNG、GIF形式の画像ファイルを使用してください。",
+                error_type="VALIDATION_ERROR"
+            ).dict(),
+            status_code=400
+        )
+    
+    tier = vision_service.resolve_tier("member" if user_id else "guest")
+    cache_key = f"{tier}:{analysis_cache.compute_key(contents)}"
+    return StreamingResponse(
+        _stream_analysis(contents, tier, cache_key, user_id, deadline),
+        media_type="application/x-ndjson"
+    )
+
+def _ndjson_event(event: str, data: Any = None) -> bytes:
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+async def _stream_analysis(
+    contents: bytes,
+    tier: str,
+    cache_key: str,
+    user_id: Optional[str],
+    deadline: Optional[float] = None
+):
+    """解析パイプラインを実行しながらステージごとのイベントを生成します"""
+    task = None
+    try:
+        # 認証済みのユーザーの直近の近似重複画像（連写など）があればその解析結果を再利用
+        image_hash, pipeline_output = await _find_near_duplicate(user_id, contents, cache_key)
+        if pipeline_output is None:
+            queue: asyncio.Queue = asyncio.Queue()
+        
+            def on_stage_complete(name: str, value: Any):
+                if name == "quality_gate":
+                    queue.put_nowait(_ndjson_event("quality_gate", {
+                        "passed": value is None or value.is_usable,
+                        "warnings": value.reasons if value is not None else []
+                    }))
+                elif name == "risk":
+                    queue.put_nowait(_ndjson_event("risk", {
+                        **value,
+                        "risk_level": _calculate_risk_level(value["risk_score"])
+                    }))
+        
+            # 生成中のアドバイスは閉じたフィールドから順に送信する
+            extractor = IncrementalJSONExtractor()
+        
+            def on_advice_chunk(text: str):
+                nonlocal extractor
+                queue.put_nowait(_ndjson_event("advice_chunk", {"text": text}))
+                if extractor is None:
+                    return
+                try:
+                    for name, value in extractor.feed(text):
+                        queue.put_nowait(_ndjson_event("advice_field", {"name": name, "value": value}))
+                except ValueError as e:
+                    logger.warning(f"アドバイスの逐次解析を中止: {str(e)}")
+                    extractor = None
+        
+            async def compute() -> Dict[str, Any]:
+                runner = _build_analysis_runner(
+                    contents, tier, on_advice_chunk=on_advice_chunk, deadline=deadline
+                )
+                run_result = await runner.run(on_stage_complete)
+                logger.info(f"解析パイプラインのステージ別実行時間: {run_result.timings_dict()}")
+                return _build_pipeline_output(run_result)
+        
+            # /analyze と同じくキャッシュと同時リクエストの共有を経由する
+            # （パイプラインを実行したリクエストだけが途中のイベントを送信し、
+            #   キャッシュヒットや共有した待機者は最終結果だけを送信する）
+            task = asyncio.ensure_future(analysis_cache.get_or_compute(
+                cache_key,
+                compute,
+                request_bytes=len(contents),
+                should_cache=lambda output: not output.get("degraded")
+            ))
+            task.add_done_callback(lambda _: queue.put_nowait(None))
+            while (line := await queue.get()) is not None:
+                yield line
+            pipeline_output = task.result()
+            if image_hash is not None:
+                duplicate_index.add(user_id, image_hash, cache_key)
+        
+        result, nutrition_advice = _build_response_models(pipeline_output, user_id)
+        yield _ndjson_event("analysis", {
+            "analysis": result.dict(),
+            "quality_warnings": pipeline_output.get("quality_warnings", [])
+        })
+        yield _ndjson_event("advice", nutrition_advice.dict() if nutrition_advice else None)
+        
+        if user_id and _is_persistable(pipeline_output):
+            history_id = await _save_analysis_history(user_id, result, nutrition_advice)
+            yield _ndjson_event("saved", {"history_id": history_id})
+        yield _ndjson_event("done")
+    
+    except Exception as e:
+        logger.error(f"ストリーミング解析中にエラーが発生: {str(e)}", exc_info=True)
+        yield _ndjson_event("error", ErrorResponse(
+            summary="画像の解析中に問題が発生しました。後ほど再度お試しください。",
+            error_type="SYSTEM_ERROR",
+            warnings=[f"エラーの詳細: {str(e)}"]
+        ).dict())
+    finally:
+        # クライアントが切断した場合は実行中のステージをキャンセル
+        if task is not None and not task.done():
+            task.cancel()
+
+async def _find_near_duplicate(owner: Optional[str], contents: bytes, cache_key: str):
+    """
+    知覚ハッシュで直近の近似重複画像を探し、キャッシュ済みの解析結果を返します
+    匿名のリクエスト（owner が None）は対象外です
+    Returns:
+        Tuple: (画像の知覚ハッシュ, 再利用できる解析結果またはNone)
+    """
+    if owner is None:
+        return None, None
+    try:
+        loop = asyncio.get_event_loop()
+        image_hash = await loop.run_in_executor(None, compute_dhash, contents)
+    except Exception as e:
+        logger.warning(f"知覚ハッシュの計算に失敗: {str(e)}")
+        return None, None
+    
+    duplicate_key = duplicate_index.find(owner, image_hash)
+    if duplicate_key is None or duplicate_key == cache_key:
+        return image_hash, None
+    
+    pipeline_output = await analysis_cache.get(duplicate_key)
+    if pipeline_output is not None:
+        logger.info(f"近似重複画像の解析結果を再利用: owner={owner}")
+    return image_hash, pipeline_output
+
+def _build_analysis_runner(
+    contents: bytes,
+    tier: str = "default",
+    on_advice_chunk: Optional[Callable[[str], None]] = None,
+    deadline: Optional[float] = None
+) -> StageRunner:
+    """Vision AIの各ステージとアドバイス生成をDAGとして登録したランナーを返します"""
+    # アドバイス生成はリスクスコアだけに依存するため、顔・オブジェクト検出と並行して実行される
+    runner = StageRunner()
+    vision_service.add_stages(runner, contents, tier)
+    
+    async def advice(results):
+        risk_score = results["risk"]["risk_score"]
+        logger.info("Gemini API解析を開始")
+        return await gemini_service.generate_advice(
+            risk_level=_calculate_risk_level(risk_score),
+            on_chunk=on_advice_chunk,
+            deadline=deadline
+        )
+    
+    runner.add_stage("advice", advice, depends_on=["risk"])
+    return runner
+
+def _build_pipeline_output(run_result: StageRunResult) -> Dict[str, Any]:
+    """ランナーの実行結果をキャッシュ可能な形式に変換します"""
+    # 画質判定で打ち切られた場合はアドバイス生成も行われない
+    vision_result = vision_service.build_result(run_result)
+    nutrition_advice = None if run_result.aborted else run_result.results["advice"]
+    logger.info(f"Vision AI解析結果: {vision_result}")
+    logger.info(f"Gemini API解析結果: {nutrition_advice}")
+    
+    analysis = NailAnalysisResult(
+        risk_score=vision_result.get("risk_score", 0.5),
+        confidence_score=vision_result.get("confidence_score", 0.8),
+        risk_level=_calculate_risk_level(vision_result.get("risk_score", 0.5)),
+        detected_colors=vision_result.get("detected_colors", []),
+        quality_metrics=ImageQualityMetrics(
+            is_blurry=vision_result.get("is_blurry", False),
+            brightness_score=vision_result.get("brightness_score", 0.8),
+            has_proper_lighting=vision_result.get("has_proper_lighting", True),
+            has_detected_nail=vision_result.get("has_detected_nail", True)
+        )
+    )
+    
+    return {
+        "analysis": analysis.dict(exclude={"created_at", "user_id"}),
+        "nutrition_advice": nutrition_advice.dict() if nutrition_advice else None,
+        "quality_warnings": vision_result.get("quality_warnings", []),
+        # 画質チェックで除外された場合（リスクスコアは解析結果ではなく既定値）
+        "quality_gate_rejected": bool(vision_result.get("quality_gate_rejected")),
+        # 期限切れなどで定型アドバイスに代替した場合
+        "degraded": bool(nutrition_advice and nutrition_advice.error_type)
+    }
+
+async def _run_analysis_pipeline(
+    contents: bytes,
+    tier: str = "default",
+    deadline: Optional[float] = None
+) -> Dict[str, Any]:
+    """Vision AIとGemini APIによる解析を実行し、キャッシュ可能な形式で返します"""
+    logger.info(f"解析パイプラインを開始: tier={tier}")
+    run_result = await _build_analysis_runner(contents, tier, deadline=deadline).run()
+    logger.info(f"解析パイプラインのステージ別実行時間: {run_result.timings_dict()}")
+    return _build_pipeline_output(run_result)
+
+def _build_response_models(pipeline_output: Dict[str, Any], user_id: Optional[str]):
+    """キャッシュ可能な解析結果からリクエストごとのレスポンスモデルを作成します"""
+    result = NailAnalysisResult(
+        **{
+            **pipeline_output["analysis"],
+            "created_at": datetime.utcnow().isoformat(),
+            "user_id": user_id
+        }
+    )
+    nutrition_advice = (
+        NutritionAdvice(**pipeline_output["nutrition_advice"])
+        if pipeline_output["nutrition_advice"] else None
+    )
+    return result, nutrition_advice
+
+def _is_persistable(pipeline_output: Dict[str, Any]) -> bool:
+    """解析履歴に保存できる結果か（画質チェックで除外・警告された結果は実際のリスクではないため保存しない）"""
+    return not (pipeline_output.get("quality_gate_rejected") or pipeline_output.get("quality_warnings"))
+
+async def _save_analysis_history(
+    user_id: str,
+    result: NailAnalysisResult,
+    nutrition_advice: Optional[NutritionAdvice]
+) -> str:
+    """解析結果を履歴の書き込みキューに積み、保存先のドキュメントIDを返します（書き込みは待たない）"""
+    logger.info(f"解析結果を保存: user_id={user_id}")
+    details = AnalysisDetails(
+        confidence_score=result.confidence_score,
+        detected_colors=result.detected_colors,
+        quality_metrics=result.quality_metrics,
+        warnings=nutrition_advice.warnings if nutrition_advice else [],
+        nutrition_advice=nutrition_advice
+    )
+    return await firestore_service.enqueue_analysis_result(
+        user_id=user_id,
+        risk_score=result.risk_score,
+        risk_level=result.risk_level,
+        advice=nutrition_advice.summary if nutrition_advice else "",
+        details=details.model_dump()
+    )
+
 def _calculate_risk_level(risk_score: float) -> str:
     if risk_score < 0.3:
         return "low"
@@ -0,0 +1,287 @@
+"""解析履歴の移行ツール（1回限り）
+
+旧 FirebaseService が書き込んでいた analysis_results/{id} を、統一した形式の
+users/{uid}/analysis_history/{id} へ同じIDで移し、ユーザーごとの履歴ビュー
+（analysis_histories/{uid}、最新の解析結果のサマリー）と解析回数を作り直します。
+旧 FirestoreService が users/{uid}/analysis_history に書き込んでいた details のない
+ドキュメントは、details を追加し、サーバーのローカル時刻で保存された created_at をUTCに直します。
+リスクレベルはすべての解析履歴で大文字（"LOW"・"MEDIUM"・"HIGH"）に揃えます。
+
+ドキュメントはドキュメントIDなどの順にページ単位で読み込み（読み込みごとにタイムアウトを設定し、
+全体の所要時間には上限を設けない）、書き込みは最大500件のバッチにまとめます。
+同じIDへの上書きで、変換済みのドキュメントは読み飛ばすため、途中で失敗しても再実行できます。
+
+使い方:
+    python migrate_analysis_history.py --legacy-utc-offset-hours 9 [--dry-run] [--batch-size 500] [--delete-source]
+"""
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import logging
+import os
+
+import firebase_admin
+from firebase_admin import credentials
+from pydantic import ValidationError
+
+from src.models.analysis import AnalysisDetails, NutritionAdvice
+from src.repositories.analysis_history_store import (
+    SUMMARY_FIELDS,
+    build_record,
+    build_view,
+    history_collection,
+    history_view_document,
+    normalize_risk_level,
+    summarize
+)
+from src.repositories.firestore_repository import DOCUMENT_ID, FirestoreRepository
+
+# ロギングの設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Firestoreの1回のコミットに含められる書き込みの上限
+MAX_BATCH_SIZE = 500
+
+
+def convert_legacy_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    """analysis_results のドキュメントを統一した形式の解析履歴に変換します"""
+    created_at = data.get("created_at")
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    advice = data.get("nutrition_advice")
+    try:
+        nutrition_advice = NutritionAdvice(**advice) if isinstance(advice, dict) else None
+    except ValidationError:
+        nutrition_advice = None
+    details = AnalysisDetails(
+        confidence_score=data.get("confidence_score"),
+        image_quality_score=data.get("image_quality_score"),
+        warnings=data.get("warnings") or [],
+        nutrition_advice=nutrition_advice
+    )
+    return build_record(
+        user_id=data["user_id"],
+        risk_score=data.get("risk_score", 0.0),
+        risk_level=data.get("risk_level", ""),
+        advice=nutrition_advice.summary if nutrition_advice else "",
+        details=details.model_dump(),
+        created_at=created_at
+    )
+
+
+def convert_legacy_history(user_id: str, data: Dict[str, Any], utc_offset: timedelta) -> Dict[str, Any]:
+    """
+    旧 FirestoreService が書き込んだ users/{uid}/analysis_history のドキュメントを統一した形式に変換します
+    created_at はサーバーのローカル時刻（タイムゾーンなし）をUTCとして保存していたため、utc_offset だけ戻します
+    """
+    created_at = data.get("created_at")
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if isinstance(created_at, datetime):
+        created_at = created_at.replace(tzinfo=None) - utc_offset
+    return build_record(
+        user_id=data.get("user_id") or user_id,
+        risk_score=data.get("risk_score", 0.0),
+        risk_level=data.get("risk_level", ""),
+        advice=data.get("advice", ""),
+        details=AnalysisDetails().model_dump(),
+        created_at=created_at
+    )
+
+
+class HistoryMigration:
+    """analysis_results と旧形式の users/{uid}/analysis_history から統一した形式への移行"""
+
+    def __init__(
+        self,
+        repository: FirestoreRepository,
+        batch_size: int = MAX_BATCH_SIZE,
+        dry_run: bool = False,
+        delete_source: bool = False,
+        legacy_utc_offset: timedelta = timedelta(0),
+        page_size: int = MAX_BATCH_SIZE
+    ):
+        """
+        Args:
+            repository: Firestoreへの読み書き
+            batch_size (int): 1回のコミットにまとめる書き込みの件数（最大500）
+            dry_run (bool): 書き込まずに件数だけを数える
+            delete_source (bool): 移行したドキュメントを同じバッチで analysis_results から削除する
+            legacy_utc_offset (timedelta): 旧 FirestoreService が動いていたサーバーのUTCからの時差
+            page_size (int): 1回の読み込みで取得するドキュメントの件数
+        """
+        self.repository = repository
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.dry_run = dry_run
+        self.delete_source = delete_source
+        self.legacy_utc_offset = legacy_utc_offset
+        self.page_size = page_size
+        self.view_size = int(os.getenv("ANALYSIS_HISTORY_VIEW_SIZE", "50"))
+        self._batch = None
+        self._pending = 0
+        self.stats = {"migrated": 0, "converted": 0, "skipped": 0, "users": 0, "commits": 0}
+
+    async def run(self) -> Dict[str, int]:
+        await self.migrate_results()
+        await self.convert_legacy_histories()
+        await self.rebuild_views()
+        return self.stats
+
+    async def _scan(
+        self,
+        collection_path: str,
+        order_by: List[str],
+        descending: bool = False,
+        select: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        コレクションを order_by の順にページ単位で読み込みます
+        最後のフィールドはドキュメントID（DOCUMENT_ID）にして、各ページの最後の要素の直後から続きを読みます
+        """
+        start_after = None
+        while True:
+            docs = await self.repository.query(
+                collection_path,
+                order_by=order_by,
+                descending=descending,
+                limit=self.page_size,
+                start_after=start_after,
+                select=select
+            )
+            for doc_id, data in docs:
+                yield doc_id, data
+            if len(docs) < self.page_size:
+                return
+            last_id, last = docs[-1]
+            start_after = {**{field: last.get(field) for field in order_by[:-1]}, DOCUMENT_ID: last_id}
+
+    async def _user_refs(self):
+        # 親ドキュメントのないユーザー（解析履歴だけがある）も含めて列挙する
+        async for user_ref in self.repository.client.collection("users").list_documents():
+            yield user_ref
+
+    async def migrate_results(self):
+        """analysis_results を読み、同じIDで解析履歴に書き込みます"""
+        async for doc_id, data in self._scan("analysis_results", order_by=[DOCUMENT_ID]):
+            if not data.get("user_id"):
+                logger.warning(f"user_idのないドキュメントをスキップ: {doc_id}")
+                self.stats["skipped"] += 1
+                continue
+            record = convert_legacy_result(data)
+            target = self.repository.document(f"{history_collection(record['user_id'])}/{doc_id}")
+            await self._write(lambda batch: batch.set(target, record))
+            if self.delete_source:
+                source = self.repository.document(f"analysis_results/{doc_id}")
+                await self._write(lambda batch: batch.delete(source))
+            self.stats["migrated"] += 1
+        await self._flush()
+
+    async def convert_legacy_histories(self):
+        """
+        旧 FirestoreService が書き込んだ details のない解析履歴を、同じIDのまま統一した形式に書き直します
+        /analyze が小文字で書き込んでいたリスクレベルも大文字に揃えます
+        """
+        async for user_ref in self._user_refs():
+            collection_path = history_collection(user_ref.id)
+            async for doc_id, data in self._scan(collection_path, order_by=[DOCUMENT_ID]):
+                # details があるドキュメントは変換済み（created_at を2回ずらさず、リスクレベルの表記だけを揃える）
+                if "details" in data:
+                    risk_level = normalize_risk_level(data.get("risk_level", ""))
+                    if risk_level != data.get("risk_level"):
+                        target = self.repository.document(f"{collection_path}/{doc_id}")
+                        await self._write(lambda batch: batch.update(target, {"risk_level": risk_level}))
+                        self.stats["converted"] += 1
+                    continue
+                record = convert_legacy_history(user_ref.id, data, self.legacy_utc_offset)
+                target = self.repository.document(f"{collection_path}/{doc_id}")
+                await self._write(lambda batch: batch.set(target, record))
+                self.stats["converted"] += 1
+        await self._flush()
+
+    async def rebuild_views(self):
+        """ユーザーごとに解析履歴を新しい順に読み、履歴ビューと解析回数を書き直します"""
+        async for user_ref in self._user_refs():
+            entries: List[Dict[str, Any]] = []
+            count = 0
+            # 履歴ビューにはサマリーだけを保存するため、必要なフィールドだけを読む
+            async for doc_id, data in self._scan(
+                history_collection(user_ref.id),
+                order_by=["created_at", DOCUMENT_ID],
+                descending=True,
+                select=list(SUMMARY_FIELDS)
+            ):
+                count += 1
+                if len(entries) < self.view_size:
+                    entries.append(summarize({**data, "id": doc_id}))
+            if count == 0:
+                continue
+
+            view_ref = self.repository.document(history_view_document(user_ref.id))
+            await self._write(lambda batch: batch.set(view_ref, build_view(user_ref.id, entries)))
+            await self._write(lambda batch: batch.set(user_ref, {"analysis_count": count}, merge=True))
+            self.stats["users"] += 1
+        await self._flush()
+
+    async def _write(self, add):
+        if self._batch is None:
+            self._batch = self.repository.batch()
+        add(self._batch)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        if self._batch is None:
+            return
+        if not self.dry_run:
+            await self.repository.commit(self._batch)
+        self.stats["commits"] += 1
+        logger.info(f"{self._pending}件の書き込みをコミット{'（dry-run）' if self.dry_run else ''}: {self.stats}")
+        self._batch = None
+        self._pending = 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="analysis_results を users/{uid}/analysis_history へ移行します")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="1回のコミットにまとめる書き込みの件数（最大500）")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに件数だけを表示する")
+    parser.add_argument("--delete-source", action="store_true", help="移行したドキュメントを analysis_results から削除する")
+    parser.add_argument(
+        "--legacy-utc-offset-hours",
+        type=float,
+        required=True,
+        help="旧 FirestoreService が動いていたサーバーのUTCからの時差（時間、例: JSTなら9、UTCなら0）"
+    )
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if not firebase_admin._apps:
+        cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
+        if not cred_path:
+            raise ValueError("FIREBASE_CREDENTIALS_PATH environment variable is not set")
+        firebase_admin.initialize_app(credentials.Certificate(cred_path))
+
+    repository = FirestoreRepository()
+    try:
+        migration = HistoryMigration(
+            repository,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            delete_source=args.delete_source,
+            legacy_utc_offset=timedelta(hours=args.legacy_utc_offset_hours)
+        )
+        stats = await migration.run()
+        logger.info(f"移行が完了しました: {stats}")
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -63,6 +63,66 @@ class AnalysisHistory(BaseModel):
     nutrition_advice: Optional[NutritionAdvice] = None
     created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
 
+class AnalysisDetails(BaseModel):
+    """解析履歴の details に保存する解析結果の全体（/analyze と /analysis/save で共通の形式）
+
+    リスクスコア・リスクレベル・作成日時は解析履歴のドキュメント自体に保存するため含めません。
+    """
+    confidence_score: Optional[float] = None
+    image_quality_score: Optional[float] = None
+    detected_colors: List[Dict[str, Any]] = []
+    quality_metrics: Optional[ImageQualityMetrics] = None
+    warnings: List[str] = []
+    nutrition_advice: Optional[NutritionAdvice] = None
+
+class AnalysisResult(BaseModel):
+    """保存APIで受け取り、詳細APIで返す解析結果"""
+    user_id: str
+    risk_level: str
+    risk_score: float = 0.0
+    confidence_score: Optional[float] = None
+    image_quality_score: Optional[float] = None
+    warnings: List[str] = []
+    nutrition_advice: Dict[str, Any] = {}
+    created_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+
+    def to_details(self) -> AnalysisDetails:
+        """解析履歴の details の形式に変換"""
+        return AnalysisDetails(
+            confidence_score=self.confidence_score,
+            image_quality_score=self.image_quality_score,
+            warnings=self.warnings,
+            nutrition_advice=NutritionAdvice(**self.nutrition_advice) if self.nutrition_advice else None
+        )
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'AnalysisResult':
+        """解析履歴のドキュメント（details を含む）からインスタンスを生成"""
+        details = AnalysisDetails(**(record.get("details") or {}))
+        return cls(
+            user_id=record["user_id"],
+            risk_level=record["risk_level"],
+            risk_score=record.get("risk_score", 0.0),
+            confidence_score=details.confidence_score,
+            image_quality_score=details.image_quality_score,
+            warnings=details.warnings,
+            nutrition_advice=details.nutrition_advice.model_dump() if details.nutrition_advice else {},
+            created_at=record["created_at"]
+        )
+
+class AnalysisSummary(BaseModel):
+    """履歴一覧に表示する解析結果のサマリー"""
+    id: str
+    created_at: str
+    risk_level: str
+    risk_score: float
+
+class AnalysisHistoryPage(BaseModel):
+    """解析履歴のサマリーの1ページ"""
+    user_id: str
+    items: List[AnalysisSummary]
+    next_cursor: Optional[str] = None  # 次のページを取得する不透明なカーソル（最後のページではNone）
+
 class ErrorResponse(BaseModel):
     """エラーレスポンス"""
     summary: str = "システムエラーが発生しました。"
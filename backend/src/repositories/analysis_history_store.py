@@ -0,0 +1,262 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import binascii
+import json
+import os
+
+from google.api_core import exceptions as google_exceptions
+
+from src.repositories.firestore_repository import DOCUMENT_ID, FirestoreRepository
+
+# 履歴の一覧（サマリー）に含めるフィールド（id はドキュメントID）
+SUMMARY_FIELDS = ("created_at", "risk_level", "risk_score")
+
+
+def history_collection(user_id: str) -> str:
+    """解析履歴の正規の保存先（users/{user_id}/analysis_history）"""
+    return f"users/{user_id}/analysis_history"
+
+
+def history_view_document(user_id: str) -> str:
+    """ユーザーごとの最新の解析履歴を保持する履歴ビュー"""
+    return f"analysis_histories/{user_id}"
+
+
+def normalize_risk_level(risk_level: str) -> str:
+    """リスクレベルを履歴の表記（"LOW"・"MEDIUM"・"HIGH" の大文字）に揃えます"""
+    return (risk_level or "").strip().upper()
+
+
+def build_record(
+    user_id: str,
+    risk_score: float,
+    risk_level: str,
+    advice: str,
+    details: Optional[Dict[str, Any]] = None,
+    created_at: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    解析履歴の1件を統一した形式で組み立てます
+    Args:
+        user_id (str): ユーザーID
+        risk_score (float): リスクスコア
+        risk_level (str): リスクレベル（大文字・小文字を問わず、大文字に揃えて保存）
+        advice (str): アドバイスの要約
+        details (Dict): 解析結果とアドバイスの全体（呼び出し元のモデルをそのまま保存）
+        created_at (datetime): 作成日時（省略時は現在時刻）
+    """
+    return {
+        "user_id": user_id,
+        "created_at": created_at or datetime.utcnow(),
+        "risk_score": risk_score,
+        "risk_level": normalize_risk_level(risk_level),
+        "advice": advice,
+        "details": details or {}
+    }
+
+
+def summarize(record: Dict[str, Any]) -> Dict[str, Any]:
+    """解析履歴から一覧に表示するフィールド（id・日時・リスクレベル・スコア）だけを取り出します"""
+    return {"id": record["id"], **{field: record.get(field) for field in SUMMARY_FIELDS}}
+
+
+def encode_cursor(created_at: Any, record_id: str) -> str:
+    """一覧の最後の要素の位置を、クライアントにそのまま返す不透明な文字列にします"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    payload = json.dumps({"c": created_at, "i": record_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """encode_cursor の文字列から (作成日時, ドキュメントID) を取り出します（不正な場合はValueError）"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(payload["c"]), str(payload["i"])
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise ValueError(f"invalid cursor: {cursor}")
+
+
+def build_view(user_id: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """履歴ビューのドキュメントを組み立てます（entries は新しい順のサマリー）"""
+    return {
+        "user_id": user_id,
+        "results": entries,
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+
+class AnalysisHistoryStore:
+    """解析履歴の読み書きを1つの形式にまとめたストア
+
+    書き込みは users/{uid}/analysis_history への作成・ユーザーの解析回数の加算・
+    履歴ビュー（analysis_histories/{uid}）への追加をユーザーごとに1回のバッチでコミットします。
+    一覧はサマリー（SUMMARY_FIELDS）だけを返し、最初のページは履歴ビューの1ドキュメント、
+    以降のページはカーソルの直後からフィールドを絞ったクエリで読み込みます。
+    解析結果の全体は get でIDを指定して取得します。
+    """
+
+    def __init__(self, repository: Optional[FirestoreRepository] = None):
+        self.repository = repository or FirestoreRepository()
+        self.view_size = int(os.getenv("ANALYSIS_HISTORY_VIEW_SIZE", "50"))
+        self._max_save_attempts = int(os.getenv("ANALYSIS_SAVE_MAX_ATTEMPTS", "3"))
+        # 直近に読み書きした履歴ビューと更新時刻（更新時刻を条件に読み直さずに書き込む）
+        self._views: "OrderedDict[str, Tuple[List[Dict[str, Any]], Any]]" = OrderedDict()
+        self._view_cache_size = int(os.getenv("ANALYSIS_HISTORY_VIEW_CACHE_SIZE", "1024"))
+
+    def new_id(self, user_id: str) -> str:
+        """解析履歴のドキュメントIDを採番します（書き込みは行わない）"""
+        return self.repository.new_document(history_collection(user_id)).id
+
+    async def save(
+        self,
+        user_id: str,
+        risk_score: float,
+        risk_level: str,
+        advice: str,
+        details: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """解析結果を保存し、ドキュメントIDを返します"""
+        record = build_record(user_id, risk_score, risk_level, advice, details)
+        record["id"] = self.new_id(user_id)
+        await self.save_many([record])
+        return record["id"]
+
+    async def save_many(self, records: List[Dict[str, Any]]):
+        """
+        ID採番済みの解析履歴（古い順）をユーザーごとに1回のバッチでまとめて保存します
+        再試行などで既に保存済みのIDは書き込みません
+        """
+        by_user: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for record in records:
+            by_user.setdefault(record["user_id"], []).append(record)
+        await asyncio.gather(*(
+            self._save_user_records(user_id, user_records)
+            for user_id, user_records in by_user.items()
+        ))
+
+    async def _save_user_records(self, user_id: str, records: List[Dict[str, Any]]):
+        """他のリクエストが先に履歴ビューを更新していた場合は読み直して再試行します"""
+        for _ in range(self._max_save_attempts):
+            view = self._views.get(user_id)
+            if view is None:
+                view = await self._read_view(user_id)
+            entries, update_time = view
+            saved_ids = {entry.get("id") for entry in entries}
+            pending = [record for record in records if record["id"] not in saved_ids]
+            if not pending:
+                return
+            try:
+                await self._commit(user_id, pending, entries, update_time)
+                return
+            except (google_exceptions.FailedPrecondition, google_exceptions.AlreadyExists, google_exceptions.NotFound):
+                self._views.pop(user_id, None)
+        raise RuntimeError(f"analysis history was updated concurrently: user_id={user_id}")
+
+    async def list_summaries(
+        self,
+        user_id: str,
+        limit: int = 10,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        解析履歴のサマリーを新しい順に1ページ分取得します
+        Args:
+            user_id (str): ユーザーID
+            limit (int): 1ページの件数
+            cursor (str): 前のページの next_cursor（省略時は最初のページ）
+        Returns:
+            Tuple[List[Dict], Optional[str]]: サマリー（created_atはISO形式の文字列）と次のページのカーソル
+        """
+        if cursor is None:
+            entries, _ = await self._read_view(user_id)
+            # 履歴ビューに収まる範囲は1ドキュメントの読み込みで返す
+            if limit <= len(entries) or len(entries) < self.view_size:
+                has_more = len(entries) > limit or len(entries) >= self.view_size
+                return self._page([summarize(entry) for entry in entries[:limit]], has_more)
+            start_after = None
+        else:
+            created_at, record_id = decode_cursor(cursor)
+            start_after = {"created_at": created_at, DOCUMENT_ID: record_id}
+
+        # 次のページの有無を判定するため1件多く読む（読み飛ばす件数によらずページの件数分だけ読み込む）
+        docs = await self.repository.query(
+            history_collection(user_id),
+            order_by=["created_at", DOCUMENT_ID],
+            descending=True,
+            limit=limit + 1,
+            start_after=start_after,
+            select=SUMMARY_FIELDS
+        )
+        summaries = [summarize({**data, "id": doc_id}) for doc_id, data in docs]
+        return self._page(summaries[:limit], len(summaries) > limit)
+
+    @staticmethod
+    def _page(summaries: List[Dict[str, Any]], has_more: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        next_cursor = None
+        if has_more and summaries:
+            next_cursor = encode_cursor(summaries[-1]["created_at"], summaries[-1]["id"])
+        for summary in summaries:
+            if isinstance(summary["created_at"], datetime):
+                summary["created_at"] = summary["created_at"].isoformat()
+        return summaries, next_cursor
+
+    async def get(self, user_id: str, record_id: str) -> Optional[Dict[str, Any]]:
+        """IDを指定して解析履歴の全体（details を含む）を取得します（存在しない場合はNone）"""
+        data = await self.repository.get(f"{history_collection(user_id)}/{record_id}")
+        if data is None:
+            return None
+        if isinstance(data.get("created_at"), datetime):
+            data["created_at"] = data["created_at"].isoformat()
+        return {**data, "id": record_id}
+
+    async def _commit(
+        self,
+        user_id: str,
+        records: List[Dict[str, Any]],
+        entries: List[Dict[str, Any]],
+        update_time: Optional[Any]
+    ):
+        """読み込んだ時点から履歴ビューが変わっていない場合だけ、解析履歴・解析回数・履歴ビューをアトミックにコミット"""
+        batch = self.repository.batch()
+        for record in records:
+            data = {key: value for key, value in record.items() if key != "id"}
+            batch.create(self.repository.document(f"{history_collection(user_id)}/{record['id']}"), data)
+        batch.set(self.repository.document(f"users/{user_id}"), {
+            "analysis_count": self.repository.increment(len(records))
+        }, merge=True)
+
+        # 新しい結果を先頭に追加し、上限を超えた古い結果を落とす
+        entries = [*(summarize(record) for record in reversed(records)), *entries][:self.view_size]
+        view_ref = self.repository.document(history_view_document(user_id))
+        view_data = build_view(user_id, entries)
+        if update_time is None:
+            batch.create(view_ref, view_data)
+        else:
+            batch.update(view_ref, view_data, option=self.repository.precondition(update_time))
+
+        update_times = await self.repository.commit(batch)
+        self._remember_view(user_id, entries, update_times[-1])
+
+    async def _read_view(self, user_id: str) -> Tuple[List[Dict[str, Any]], Optional[Any]]:
+        """履歴ビューを1回のドキュメント読み込みで取得（存在しない場合は空）"""
+        data, update_time = await self.repository.get_versioned(history_view_document(user_id))
+        # 旧 FirebaseService が書き込んだ要素（解析結果の全体でIDを持たない）は参照できないため読み飛ばし、
+        # 次に履歴ビューを書き込む時点で取り除く
+        entries = [entry for entry in (data.get("results", []) if data else []) if entry.get("id")]
+        if update_time is not None:
+            self._remember_view(user_id, entries, update_time)
+        return entries, update_time
+
+    def _remember_view(self, user_id: str, entries: List[Dict[str, Any]], update_time: Any):
+        self._views[user_id] = (entries, update_time)
+        self._views.move_to_end(user_id)
+        while len(self._views) > self._view_cache_size:
+            self._views.popitem(last=False)
+
+    async def close(self):
+        await self.repository.close()
+
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import logging
+import os
+
+from firebase_admin import firestore_async
+from google.cloud import firestore
+
+logger = logging.getLogger(__name__)
+
+# order_by / start_after でドキュメントIDを指すフィールドパス
+DOCUMENT_ID = "__name__"
+
+
+class FirestoreRepository:
+    """google.cloud.firestore.AsyncClient を使うFirestoreへの読み書き
+
+    クライアントは初期化済みのFirebaseアプリごとに1つを共有し（gRPCチャネルを再利用）、
+    各呼び出しにタイムアウトを設定します。イベントループ上で同期APIを呼び出さないよう、
+    サービスからのFirestoreへのアクセスはすべてこのクラスを経由します。
+    パスは "users/{user_id}/analysis_history" のようなスラッシュ区切りで指定します。
+    """
+
+    def __init__(self, client: Optional[firestore.AsyncClient] = None, timeout: Optional[float] = None):
+        """
+        Args:
+            client: 使用するAsyncClient（省略時は初回の呼び出しでFirebaseアプリのクライアントを取得）
+            timeout (float): 1回の呼び出しのタイムアウト（秒）
+        """
+        self._client = client
+        self.timeout = timeout if timeout is not None else float(os.getenv("FIRESTORE_TIMEOUT_SECONDS", "5.0"))
+        # 呼び出しの種類ごとの回数（1回の呼び出しが1往復）
+        self._stats: Dict[str, int] = {}
+
+    @property
+    def client(self) -> firestore.AsyncClient:
+        if self._client is None:
+            self._client = firestore_async.client()
+        return self._client
+
+    @staticmethod
+    def increment(value: int = 1) -> Any:
+        """数値フィールドを加算する更新値を返します"""
+        return firestore.Increment(value)
+
+    def new_document(self, collection_path: str) -> firestore.AsyncDocumentReference:
+        """自動採番のIDを持つドキュメントの参照を返します（書き込みは行わない）"""
+        return self.client.collection(collection_path).document()
+
+    def document(self, document_path: str) -> firestore.AsyncDocumentReference:
+        return self.client.document(document_path)
+
+    def batch(self) -> firestore.AsyncWriteBatch:
+        """複数の書き込みを1回のコミットにまとめるバッチを返します"""
+        return self.client.batch()
+
+    def precondition(self, update_time: Optional[Any]) -> Any:
+        """更新時刻が一致する場合だけ書き込む条件を返します"""
+        return self.client.write_option(last_update_time=update_time)
+
+    async def commit(self, batch: firestore.AsyncWriteBatch) -> List[Any]:
+        """
+        バッチの書き込みをアトミックにコミットします
+        Returns:
+            List: 書き込みごとの更新時刻（追加した順）
+        """
+        self._count("commit")
+        results = await batch.commit(timeout=self.timeout)
+        return [result.update_time for result in results]
+
+    async def create(self, collection_path: str, data: Dict[str, Any]) -> str:
+        """自動採番のIDでドキュメントを作成し、IDを返します"""
+        self._count("create")
+        doc_ref = self.client.collection(collection_path).document()
+        await doc_ref.set(data, timeout=self.timeout)
+        return doc_ref.id
+
+    async def set(self, document_path: str, data: Dict[str, Any], merge: bool = False):
+        """ドキュメントを作成または上書きします"""
+        self._count("set")
+        await self.client.document(document_path).set(data, merge=merge, timeout=self.timeout)
+
+    async def update(self, document_path: str, data: Dict[str, Any]):
+        """既存のドキュメントのフィールドを更新します"""
+        self._count("update")
+        await self.client.document(document_path).update(data, timeout=self.timeout)
+
+    async def get(self, document_path: str) -> Optional[Dict[str, Any]]:
+        """ドキュメントを取得します（存在しない場合はNone）"""
+        data, _ = await self.get_versioned(document_path)
+        return data
+
+    async def get_versioned(self, document_path: str) -> Tuple[Optional[Dict[str, Any]], Optional[Any]]:
+        """ドキュメントとその更新時刻を取得します（存在しない場合は (None, None)）"""
+        self._count("get")
+        snapshot = await self.client.document(document_path).get(timeout=self.timeout)
+        if not snapshot.exists:
+            return None, None
+        return snapshot.to_dict(), snapshot.update_time
+
+    async def query(
+        self,
+        collection_path: str,
+        filters: Iterable[Tuple[str, str, Any]] = (),
+        order_by: Union[str, Sequence[str], None] = None,
+        descending: bool = False,
+        limit: Optional[int] = None,
+        start_after: Optional[Dict[str, Any]] = None,
+        select: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        コレクションを検索します
+        Args:
+            collection_path (str): コレクションのパス
+            filters: (フィールド, 演算子, 値) の条件
+            order_by: 並べ替えるフィールド（複数の場合は優先順、ドキュメントIDは DOCUMENT_ID）
+            descending (bool): 降順にするかどうか
+            limit (int): 取得する最大件数
+            start_after (Dict): 並べ替えるフィールドの値。この位置の直後から取得する（カーソル）
+            select (Sequence[str]): 取得するフィールド（省略時はドキュメント全体）
+        Returns:
+            List[Tuple[str, Dict]]: (ドキュメントID, データ) のリスト
+        """
+        self._count("query")
+        query = self.client.collection(collection_path)
+        for field_path, op, value in filters:
+            query = query.where(filter=firestore.FieldFilter(field_path, op, value))
+        if select is not None:
+            query = query.select(list(select))
+        if order_by:
+            direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+            for field_path in ([order_by] if isinstance(order_by, str) else order_by):
+                query = query.order_by(field_path, direction=direction)
+        if start_after is not None:
+            query = query.start_after(start_after)
+        if limit is not None:
+            query = query.limit(limit)
+        snapshots = await query.get(timeout=self.timeout)
+        return [(snapshot.id, snapshot.to_dict()) for snapshot in snapshots]
+
+    def _count(self, operation: str):
+        self._stats[operation] = self._stats.get(operation, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """呼び出しの種類ごとの回数を返します"""
+        return {"operations": dict(self._stats), "total": sum(self._stats.values())}
+
+    async def close(self):
+        """クライアントのチャネルを閉じます"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from typing import List, Optional
 from ..services.firebase_service import FirebaseService
-from ..models.analysis import AnalysisResult, AnalysisHistory
+from ..models.analysis import AnalysisResult, AnalysisHistoryPage
 from ..models.auth import UserData
 from .auth import get_current_user
 from datetime import datetime
@@ -32,14 +32,14 @@ async def save_analysis_result(
             )
         
         # 信頼度スコアの検証
-        if not 0 <= result.confidence_score <= 1.0:
+        if result.confidence_score is None or not 0 <= result.confidence_score <= 1.0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="信頼度スコアは0から1の間である必要があります"
             )
         
         # 画像品質スコアの検証
-        if not 0 <= result.image_quality_score <= 1.0:
+        if result.image_quality_score is None or not 0 <= result.image_quality_score <= 1.0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="画像品質スコアは0から1の間である必要があります"
@@ -69,23 +69,54 @@ async def save_analysis_result(
             detail=f"解析結果の保存に失敗しました: {str(e)}"
         )
 
-@router.get("/history", response_model=AnalysisHistory)
+@router.get("/history", response_model=AnalysisHistoryPage)
 async def get_analysis_history(
-    limit: Optional[int] = 10,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserData = Depends(get_current_user)
-) -> AnalysisHistory:
-    """ユーザーの解析履歴を取得"""
+) -> AnalysisHistoryPage:
+    """ユーザーの解析履歴のサマリーを取得（続きは next_cursor を cursor に指定）"""
     try:
-        # 履歴の取得（デフォルトで最新10件）
+        # 履歴の取得（デフォルトで最新20件、1ページ最大100件まで）
         history = await firebase_service.get_analysis_history(
             user_id=current_user.user_id,
-            limit=min(limit, 50)  # 最大50件まで
+            limit=limit,
+            cursor=cursor
         )
         
         return history
         
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="無効なカーソルです"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"解析履歴の取得に失敗しました: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+@router.get("/history/{result_id}", response_model=AnalysisResult)
+async def get_analysis_result(
+    result_id: str,
+    current_user: UserData = Depends(get_current_user)
+) -> AnalysisResult:
+    """解析結果の詳細を取得"""
+    try:
+        result = await firebase_service.get_analysis_result(
+            user_id=current_user.user_id,
+            result_id=result_id
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"解析結果の取得に失敗しました: {str(e)}"
+        )
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="解析結果が見つかりません"
+        )
+    return result
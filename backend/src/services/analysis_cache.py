@@ -0,0 +1,274 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisResultCache:
+    """画像のSHA-256をキーとする解析結果キャッシュ
+
+    メモリ上のLRU（1層目）とSQLiteのディスクストア（2層目）の2層構成です。
+    エントリはTTLとサイズ上限で追い出され、同一ハッシュへの同時リクエストは
+    1回の計算結果を共有します。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 3600,
+        max_memory_bytes: int = 16 * 1024 * 1024,
+        db_path: Optional[str] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        Args:
+            ttl_seconds (int): エントリの有効期限（秒）
+            max_memory_bytes (int): メモリ層に保持する値の合計サイズ上限
+            db_path (str): ディスク層のSQLiteファイルパス（未指定の場合はメモリ層のみ）
+            max_disk_bytes (int): ディスク層に保持する値の合計サイズ上限
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        # key -> (シリアライズ済みの値, 有効期限)
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed_at)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_analysis_cache_expires ON analysis_cache (expires_at)"
+            )
+            self._db.commit()
+        # ディスク層の値の合計サイズ（書き込みのたびに全体を集計しないよう増減で管理）
+        self._disk_bytes = self._disk_total() if self._db is not None else 0
+
+        self._stats = {
+            "requests": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "coalesced": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "evictions": 0
+        }
+
+    @staticmethod
+    def compute_key(content: bytes) -> str:
+        """アップロードされたバイト列からキャッシュキーを生成します"""
+        return hashlib.sha256(content).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """キャッシュから値を取得します（メモリ層→ディスク層の順）"""
+        self._stats["requests"] += 1
+        serialized = await self._get_serialized(key)
+        if serialized is None:
+            self._stats["misses"] += 1
+            return None
+        return json.loads(serialized)
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        """値を両方の層に保存します"""
+        await self._set_serialized(key, json.dumps(value, ensure_ascii=False, default=str))
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+        request_bytes: int = 0,
+        should_cache: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Dict[str, Any]:
+        """
+        キャッシュを参照し、なければ計算して保存します
+        同一キーの計算が実行中の場合は、その結果を待って共有します
+        Args:
+            key (str): キャッシュキー
+            compute: 値を計算するコルーチン関数
+            request_bytes (int): ヒット時に節約できたアップロードサイズ（統計用）
+            should_cache: 計算結果を保存するかどうかを判定する関数（Falseの場合は待機者とだけ共有）
+        """
+        self._stats["requests"] += 1
+
+        serialized = await self._get_serialized(key)
+        if serialized is not None:
+            self._stats["bytes_saved"] += request_bytes
+            return json.loads(serialized)
+
+        while (inflight := self._inflight.get(key)) is not None:
+            try:
+                serialized = await asyncio.shield(inflight)
+                self._stats["coalesced"] += 1
+                self._stats["bytes_saved"] += request_bytes
+                return json.loads(serialized)
+            except asyncio.CancelledError:
+                # 計算中のリクエストが切断などでキャンセルされた場合は、自分で計算するか次の計算を待つ
+                if not inflight.cancelled():
+                    raise
+
+        self._stats["misses"] += 1
+        future = asyncio.get_event_loop().create_future()
+        # 待機者がいない場合の "exception was never retrieved" 警告を抑止
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            serialized = json.dumps(value, ensure_ascii=False, default=str)
+            if should_cache is None or should_cache(value):
+                await self._set_serialized(key, serialized)
+            future.set_result(serialized)
+            return json.loads(serialized)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計情報を返します"""
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["coalesced"]
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            "hit_rate": hits / requests if requests else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "inflight": len(self._inflight),
+            "disk_bytes": self._disk_bytes,
+            "disk_enabled": self._db is not None
+        }
+
+    def close(self):
+        """ディスク層の接続を閉じます"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    async def _get_serialized(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            serialized, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return serialized
+            self._remove_from_memory(key)
+
+        if self._db is None:
+            return None
+
+        row = await asyncio.get_event_loop().run_in_executor(None, self._disk_get, key, now)
+        if row is None:
+            return None
+        serialized, expires_at = row
+        self._stats["disk_hits"] += 1
+        self._put_in_memory(key, serialized, expires_at)
+        return serialized
+
+    async def _set_serialized(self, key: str, serialized: str):
+        expires_at = time.time() + self.ttl_seconds
+        self._put_in_memory(key, serialized, expires_at)
+        if self._db is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._disk_set, key, serialized, expires_at
+            )
+
+    def _put_in_memory(self, key: str, serialized: str, expires_at: float):
+        size = len(serialized.encode("utf-8"))
+        if size > self.max_memory_bytes:
+            return
+        self._remove_from_memory(key)
+        self._memory[key] = (serialized, expires_at)
+        self._memory_bytes += size
+
+        # サイズ上限を超えた分を古い順に追い出す
+        while self._memory_bytes > self.max_memory_bytes:
+            oldest_key = next(iter(self._memory))
+            self._remove_from_memory(oldest_key)
+            self._stats["evictions"] += 1
+
+    def _remove_from_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0].encode("utf-8"))
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at, size FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._db.commit()
+                self._disk_bytes -= row[2]
+                return None
+            self._db.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return row[0], row[1]
+
+    def _disk_set(self, key: str, serialized: str, expires_at: float):
+        now = time.time()
+        size = len(serialized.encode("utf-8"))
+        with self._db_lock:
+            try:
+                replaced = self._db.execute(
+                    "SELECT size FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, serialized, size, expires_at, now)
+                )
+                # 期限切れのエントリは expires_at の索引で探して削除する
+                expired = self._db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM analysis_cache WHERE expires_at <= ?", (now,)
+                ).fetchone()[0]
+                self._db.execute("DELETE FROM analysis_cache WHERE expires_at <= ?", (now,))
+                total = self._disk_bytes + size - (replaced[0] if replaced else 0) - expired
+
+                # サイズ上限を超えた分をアクセスの古い順に追い出す
+                if total > self.max_disk_bytes:
+                    rows = self._db.execute(
+                        "SELECT key, size FROM analysis_cache ORDER BY accessed_at ASC"
+                    ).fetchall()
+                    evicted = []
+                    for evict_key, evict_size in rows:
+                        if total <= self.max_disk_bytes:
+                            break
+                        evicted.append((evict_key,))
+                        total -= evict_size
+                    self._db.executemany("DELETE FROM analysis_cache WHERE key = ?", evicted)
+                    self._stats["evictions"] += len(evicted)
+                self._db.commit()
+                self._disk_bytes = total
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.error(f"解析結果キャッシュのディスク書き込みに失敗: {str(e)}")
+
+    def _disk_total(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from io import BytesIO
+import time
+import numpy as np
+from PIL import Image
+
+# ビット数の参照テーブル（np.bitwise_count が使えない環境向け）
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def compute_dhash(image_content: bytes, hash_size: int = 8) -> int:
+    """
+    画像の差分ハッシュ（dHash）を計算します
+    Args:
+        image_content (bytes): 画像のバイトデータ
+        hash_size (int): ハッシュの一辺のサイズ（8の場合は64ビット）
+    Returns:
+        int: 64ビットの知覚ハッシュ
+    """
+    with Image.open(BytesIO(image_content)) as image:
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """uint64配列の各要素の立っているビット数を返します"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class _UserHashRing:
+    """1ユーザー分の直近ハッシュを保持するリングバッファ
+
+    ほとんどのユーザーは数件しか登録しないため、配列は小さく確保して
+    埋まるたびに倍に拡張し、上限（capacity）に達してから古い順に上書きします。
+    """
+
+    INITIAL_CAPACITY = 8
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        initial = min(self.INITIAL_CAPACITY, capacity)
+        self.hashes = np.zeros(initial, dtype=np.uint64)
+        self.timestamps = np.zeros(initial, dtype=np.float64)
+        self.result_keys: List[Optional[str]] = [None] * initial
+        self.size = 0
+        self.position = 0
+
+    def add(self, image_hash: int, result_key: str, timestamp: float):
+        if self.size == len(self.hashes) < self.capacity:
+            self._grow()
+        self.hashes[self.position] = image_hash
+        self.timestamps[self.position] = timestamp
+        self.result_keys[self.position] = result_key
+        self.position = (self.position + 1) % len(self.hashes)
+        self.size = min(self.size + 1, len(self.hashes))
+
+    def _grow(self):
+        """配列を倍（上限は capacity）に拡張します（上書きが始まる前だけ呼ばれる）"""
+        new_capacity = min(len(self.hashes) * 2, self.capacity)
+        extra = new_capacity - len(self.hashes)
+        self.hashes = np.concatenate([self.hashes, np.zeros(extra, dtype=np.uint64)])
+        self.timestamps = np.concatenate([self.timestamps, np.zeros(extra, dtype=np.float64)])
+        self.result_keys.extend([None] * extra)
+        self.position = self.size
+
+
+class NearDuplicateIndex:
+    """ユーザーごとの直近アップロード画像の知覚ハッシュインデックス
+
+    ハッシュは64ビット整数の配列に詰めて保持し、XORとpopcountを一括計算して
+    ハミング距離がしきい値以内の画像を探します。
+    別の人の解析結果を返さないよう、認証済みのユーザーIDだけを対象とし、
+    owner が None（匿名のリクエスト）の場合は登録も検索も行いません。
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 6,
+        window_seconds: float = 300,
+        max_entries_per_user: int = 1024,
+        max_users: int = 10000
+    ):
+        """
+        Args:
+            max_distance (int): 同一画像とみなすハミング距離の上限
+            window_seconds (float): 再利用の対象とする直近の時間幅（秒）
+            max_entries_per_user (int): ユーザーごとに保持するハッシュ数
+            max_users (int): インデックスに保持するユーザー数
+        """
+        self.max_distance = max_distance
+        self.window_seconds = window_seconds
+        self.max_entries_per_user = max_entries_per_user
+        self.max_users = max_users
+        self._rings: "OrderedDict[str, _UserHashRing]" = OrderedDict()
+        self._stats = {"lookups": 0, "matches": 0}
+
+    def find(self, owner: Optional[str], image_hash: int, now: Optional[float] = None) -> Optional[str]:
+        """
+        近似重複する直近の画像を探します
+        Returns:
+            Optional[str]: 見つかった場合はその解析結果のキー（匿名の場合は常にNone）
+        """
+        if owner is None:
+            return None
+        self._stats["lookups"] += 1
+        ring = self._rings.get(owner)
+        if ring is None or ring.size == 0:
+            return None
+        self._rings.move_to_end(owner)
+
+        now = now if now is not None else time.time()
+        hashes = ring.hashes[:ring.size]
+        distances = _popcount(hashes ^ np.uint64(image_hash)).astype(np.int64)
+        # 時間幅の外にあるエントリは候補から除外
+        distances[ring.timestamps[:ring.size] < now - self.window_seconds] = self.max_distance + 1
+
+        best = int(distances.argmin())
+        if distances[best] > self.max_distance:
+            return None
+        self._stats["matches"] += 1
+        return ring.result_keys[best]
+
+    def add(self, owner: Optional[str], image_hash: int, result_key: str, now: Optional[float] = None):
+        """画像のハッシュと解析結果のキーを登録します（匿名の場合は登録しない）"""
+        if owner is None:
+            return
+        ring = self._rings.get(owner)
+        if ring is None:
+            ring = _UserHashRing(self.max_entries_per_user)
+            self._rings[owner] = ring
+            if len(self._rings) > self.max_users:
+                self._rings.popitem(last=False)
+        self._rings.move_to_end(owner)
+        ring.add(image_hash, result_key, now if now is not None else time.time())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """統計情報を返します"""
+        return {
+            **self._stats,
+            "users": len(self._rings),
+            "entries": sum(ring.size for ring in self._rings.values())
+        }
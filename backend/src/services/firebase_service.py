@@ -1,14 +1,16 @@
-from typing import List, Optional
+from typing import Optional
 from datetime import datetime
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 import os
-from ..models.analysis import AnalysisResult, UserProfile, AnalysisHistory
+from ..models.analysis import AnalysisResult, UserProfile, AnalysisSummary, AnalysisHistoryPage
+from ..repositories.analysis_history_store import AnalysisHistoryStore
+from ..repositories.firestore_repository import FirestoreRepository
 
 class FirebaseService:
     """Firestore操作を担当するサービスクラス"""
     
-    def __init__(self):
+    def __init__(self, repository: Optional[FirestoreRepository] = None):
         # Firebase初期化（未初期化の場合のみ）
         if not firebase_admin._apps:
             cred_path = os.getenv('FIREBASE_CREDENTIALS_PATH')
@@ -17,35 +19,29 @@ class FirebaseService:
             cred = credentials.Certificate(cred_path)
             firebase_admin.initialize_app(cred)
         
-        self.db = firestore.client()
+        self.repository = repository or FirestoreRepository()
+        # 解析履歴は main.py の FirestoreService と同じストア・同じ形式で読み書きする
+        self.history_store = AnalysisHistoryStore(self.repository)
         
     async def save_analysis_result(self, result: AnalysisResult) -> str:
-        """解析結果を保存"""
+        """解析結果を保存（履歴のドキュメントにないフィールドは AnalysisDetails の形式で details に保存）"""
         try:
-            # 解析結果をFirestoreに保存
-            doc_ref = self.db.collection('analysis_results').document()
-            doc_ref.set(result.to_dict())
-            
-            # ユーザーの解析カウントを更新
-            user_ref = self.db.collection('users').document(result.user_id)
-            user_ref.update({
-                'analysis_count': firestore.Increment(1)
-            })
-            
-            # 解析履歴を更新
-            await self._update_analysis_history(result)
-            
-            return doc_ref.id
+            return await self.history_store.save(
+                user_id=result.user_id,
+                risk_score=result.risk_score,
+                risk_level=result.risk_level,
+                advice=result.nutrition_advice.get('summary', ''),
+                details=result.to_details().model_dump()
+            )
         except Exception as e:
             raise Exception(f"Failed to save analysis result: {str(e)}")
     
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         """ユーザープロファイルを取得"""
         try:
-            doc_ref = self.db.collection('users').document(user_id)
-            doc = doc_ref.get()
-            if doc.exists:
-                return UserProfile.from_dict(doc.to_dict())
+            data = await self.repository.get(f"users/{user_id}")
+            if data is not None:
+                return UserProfile.from_dict(data)
             return None
         except Exception as e:
             raise Exception(f"Failed to get user profile: {str(e)}")
@@ -61,8 +57,7 @@ class FirebaseService:
                 last_login=now
             )
             
-            doc_ref = self.db.collection('users').document(user_id)
-            doc_ref.set(profile.to_dict())
+            await self.repository.set(f"users/{user_id}", profile.to_dict())
             
             return profile
         except Exception as e:
@@ -71,60 +66,37 @@ class FirebaseService:
     async def update_last_login(self, user_id: str):
         """最終ログイン日時を更新"""
         try:
-            doc_ref = self.db.collection('users').document(user_id)
-            doc_ref.update({
+            await self.repository.update(f"users/{user_id}", {
                 'last_login': datetime.utcnow().isoformat()
             })
         except Exception as e:
             raise Exception(f"Failed to update last login: {str(e)}")
     
-    async def get_analysis_history(self, user_id: str, limit: int = 10) -> AnalysisHistory:
-        """ユーザーの解析履歴を取得"""
+    async def get_analysis_history(
+        self,
+        user_id: str,
+        limit: int = 10,
+        cursor: Optional[str] = None
+    ) -> AnalysisHistoryPage:
+        """ユーザーの解析履歴のサマリーを1ページ分取得（カーソルが不正な場合はValueError）"""
         try:
-            # 最新のN件の解析結果を取得
-            results_ref = self.db.collection('analysis_results')\
-                .where('user_id', '==', user_id)\
-                .order_by('created_at', direction=firestore.Query.DESCENDING)\
-                .limit(limit)
-            
-            results = []
-            for doc in results_ref.stream():
-                result_data = doc.to_dict()
-                results.append(AnalysisResult.from_dict(result_data))
-            
-            return AnalysisHistory(
+            items, next_cursor = await self.history_store.list_summaries(user_id, limit, cursor)
+            return AnalysisHistoryPage(
                 user_id=user_id,
-                results=results,
-                last_updated=datetime.utcnow().isoformat()
+                items=[AnalysisSummary(**item) for item in items],
+                next_cursor=next_cursor
             )
+        except ValueError:
+            raise
         except Exception as e:
             raise Exception(f"Failed to get analysis history: {str(e)}")
     
-    async def _update_analysis_history(self, result: AnalysisResult):
-        """解析履歴を更新（内部メソッド）"""
+    async def get_analysis_result(self, user_id: str, result_id: str) -> Optional[AnalysisResult]:
+        """IDを指定して解析結果の全体を取得（存在しない場合はNone）"""
         try:
-            history_ref = self.db.collection('analysis_histories').document(result.user_id)
-            history_doc = history_ref.get()
-            
-            if history_doc.exists:
-                # 既存の履歴を更新
-                history_data = history_doc.to_dict()
-                history = AnalysisHistory.from_dict(history_data)
-                history.results.insert(0, result)  # 新しい結果を先頭に追加
-                history.last_updated = datetime.utcnow().isoformat()
-                
-                # 最新の10件のみ保持
-                if len(history.results) > 10:
-                    history.results = history.results[:10]
-                
-                history_ref.set(history.to_dict())
-            else:
-                # 新規履歴を作成
-                history = AnalysisHistory(
-                    user_id=result.user_id,
-                    results=[result],
-                    last_updated=datetime.utcnow().isoformat()
-                )
-                history_ref.set(history.to_dict())
+            record = await self.history_store.get(user_id, result_id)
+            if record is None:
+                return None
+            return AnalysisResult.from_record(record)
         except Exception as e:
-            raise Exception(f"Failed to update analysis history: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Failed to get analysis result: {str(e)}")
@@ -1,71 +1,129 @@
-from firebase_admin import firestore
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import os
+from src.repositories.analysis_history_store import AnalysisHistoryStore, build_record
+from src.repositories.firestore_repository import FirestoreRepository
+from src.utils.write_behind_queue import WriteBehindQueue
 
 class FirestoreService:
-    def __init__(self):
-        self.db = firestore.client()
-        
-    def save_analysis_result(
+    def __init__(self, repository: Optional[FirestoreRepository] = None):
+        self.repository = repository or FirestoreRepository()
+        self.history_store = AnalysisHistoryStore(self.repository)
+
+        # 解析履歴の書き込みをレスポンスの後にまとめて行うキュー
+        self.write_behind_enabled = os.getenv("FIRESTORE_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+        self._flush_timeout = float(os.getenv("FIRESTORE_WRITE_FLUSH_TIMEOUT_SECONDS", "10.0"))
+        self.write_queue = WriteBehindQueue(
+            self._write_history_batch,
+            max_size=int(os.getenv("FIRESTORE_WRITE_QUEUE_SIZE", "1000")),
+            batch_size=int(os.getenv("FIRESTORE_WRITE_BATCH_SIZE", "20")),
+            workers=int(os.getenv("FIRESTORE_WRITE_WORKERS", "2")),
+            max_attempts=int(os.getenv("FIRESTORE_WRITE_MAX_ATTEMPTS", "5")),
+            spool_path=os.getenv("FIRESTORE_WRITE_SPOOL_PATH") or None,
+            spool_compact_lines=int(os.getenv("FIRESTORE_WRITE_SPOOL_COMPACT_LINES", "10000"))
+        )
+
+    async def start(self):
+        """書き込みキューのワーカーを起動します（スプールに残った書き込みを再送）"""
+        if self.write_behind_enabled:
+            await self.write_queue.start()
+
+    async def save_analysis_result(
         self,
         user_id: str,
         risk_score: float,
         risk_level: str,
-        advice: str
+        advice: str,
+        details: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         解析結果をFirestoreに保存
-        
+
         Args:
             user_id: ユーザーID
             risk_score: リスクスコア（0.0 ~ 1.0）
             risk_level: リスクレベル（"LOW", "MEDIUM", "HIGH"）
             advice: 生成されたアドバイス文
-            
+            details: 解析結果とアドバイスの全体（任意）
+
         Returns:
             str: 保存されたドキュメントのID
         """
-        # 保存するデータの構築
-        data = {
-            "user_id": user_id,
-            "risk_score": risk_score,
-            "risk_level": risk_level,
-            "advice": advice,
-            "created_at": datetime.now()
-        }
-        
-        # Firestoreに保存
-        doc_ref = self.db.collection("users").document(user_id)\
-            .collection("analysis_history").document()
-        doc_ref.set(data)
-        
-        return doc_ref.id
-        
-    def get_user_history(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return await self.history_store.save(user_id, risk_score, risk_level, advice, details)
+
+    async def enqueue_analysis_result(
+        self,
+        user_id: str,
+        risk_score: float,
+        risk_level: str,
+        advice: str,
+        details: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        解析結果を書き込みキューに積み、書き込みを待たずにドキュメントIDを返します
+        キューが無効・満杯の場合はその場で保存します（引数は save_analysis_result と同じ）
+        """
+        record = build_record(user_id, risk_score, risk_level, advice, details)
+        record["id"] = self.history_store.new_id(user_id)
+        if not self.write_queue.offer(record):
+            await self.history_store.save_many([record])
+        return record["id"]
+
+    async def _write_history_batch(self, records: List[Dict[str, Any]]):
+        # スプールから積み直した要素の日時はISO形式の文字列になっている
+        records = [
+            {**record, "created_at": datetime.fromisoformat(record["created_at"])}
+            if isinstance(record["created_at"], str) else record
+            for record in records
+        ]
+        await self.history_store.save_many(records)
+
+    async def get_user_history(
+        self,
+        user_id: str,
+        limit: int = 10,
+        cursor: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        ユーザーの解析履歴の一覧を取得
+
+        Args:
+            user_id: ユーザーID
+            limit: 1ページの件数
+            cursor: 前のページの next_cursor（省略時は最新から）
+
+        Returns:
+            Dict: items（id・created_at・risk_level・risk_scoreだけのサマリー、新しい順）と
+                  next_cursor（次のページがない場合はNone）
+
+        Raises:
+            ValueError: カーソルが不正な場合
+        """
+        items, next_cursor = await self.history_store.list_summaries(user_id, limit, cursor)
+        return {"items": items, "next_cursor": next_cursor}
+
+    async def get_analysis_detail(self, user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
         """
-        ユーザーの解析履歴を取得
-        
+        解析履歴の1件を details を含めて取得
+
         Args:
             user_id: ユーザーID
-            limit: 取得する履歴の最大数
-            
+            history_id: 解析履歴のドキュメントID
+
         Returns:
-            List[Dict]: 解析履歴のリスト（新しい順）
+            Optional[Dict]: 解析履歴（存在しない場合はNone）
         """
-        # 履歴を取得（created_atの降順）
-        docs = self.db.collection("users").document(user_id)\
-            .collection("analysis_history")\
-            .order_by("created_at", direction=firestore.Query.DESCENDING)\
-            .limit(limit)\
-            .stream()
-            
-        # ドキュメントをリストに変換
-        history = []
-        for doc in docs:
-            data = doc.to_dict()
-            # datetime型をISO形式の文字列に変換
-            data["created_at"] = data["created_at"].isoformat()
-            data["id"] = doc.id
-            history.append(data)
-            
-        return history 
\ No newline at end of file
+        return await self.history_store.get(user_id, history_id)
+
+    def get_write_stats(self) -> Dict[str, Any]:
+        """書き込みキューの深さ・書き込みまでの遅れとFirestoreの呼び出し回数を返します"""
+        return {
+            "write_behind_enabled": self.write_behind_enabled,
+            "queue": self.write_queue.get_stats(),
+            "repository": self.repository.get_stats()
+        }
+
+    async def close(self):
+        """書き込みキューに残った解析結果を書き込んでから、Firestoreクライアントのチャネルを閉じます"""
+        await self.write_queue.close(self._flush_timeout)
+        await self.repository.close()
@@ -1,20 +1,28 @@
 from google.cloud import aiplatform
-from typing import Optional, List, Dict, Union, Any
+from typing import Optional, List, Dict, Union, Any, Callable
 import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from collections import OrderedDict
 import vertexai
 from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
 import os
 from dotenv import load_dotenv
-from functools import lru_cache
+from functools import partial
 import time
 import hashlib
 import logging
 from src.models.error_response import ErrorResponse
-from pydantic import BaseModel
-from asyncio import Lock, Semaphore
+from src.utils.json_stream import extract_json_array, extract_json_object
+from src.utils.retry_budget import RetryBudget
+from src.utils.adaptive_limiter import AdaptiveConcurrencyLimiter
+from src.utils.latency_histogram import LatencyHistogram
+from src.utils.micro_batcher import MicroBatcher
+from src.services.model_router import ModelRouter
+from src.services.local_advice import LocalAdviceEngine
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel, Field
+from asyncio import Lock
 from datetime import datetime, timedelta
 from vertexai.language_models import TextGenerationModel
 
@@ -28,13 +36,27 @@ class CacheKey:
     """キャッシュのキーとして使用するデータクラス"""
     risk_level: str
     warnings_hash: str
+    confidence_bucket: Optional[int] = None
     
     @classmethod
-    def create(cls, risk_level: str, warnings: List[str]) -> 'CacheKey':
-        """警告リストのハッシュ値を含むキーを生成"""
-        warnings_str = ','.join(sorted(warnings)) if warnings else ''
-        warnings_hash = hashlib.md5(warnings_str.encode()).hexdigest()
-        return cls(risk_level=risk_level, warnings_hash=warnings_hash)
+    def create(
+        cls,
+        risk_level: str,
+        warnings: List[str],
+        confidence: Optional[float] = None,
+        confidence_step: float = 0.1
+    ) -> 'CacheKey':
+        """リスクレベル・量子化した信頼度・正規化した警告リストのハッシュ値からキーを生成"""
+        normalized = sorted({warning.strip() for warning in warnings if warning.strip()}) if warnings else []
+        warnings_hash = hashlib.md5(','.join(normalized).encode()).hexdigest()
+        confidence_bucket = None
+        if confidence is not None:
+            confidence_bucket = int(min(max(confidence, 0.0), 1.0) / confidence_step + 1e-9)
+        return cls(
+            risk_level=risk_level.lower(),
+            warnings_hash=warnings_hash,
+            confidence_bucket=confidence_bucket
+        )
 
 @dataclass
 class BaseResponse:
@@ -44,7 +66,7 @@ class BaseResponse:
     meal_suggestions: List[str]
     lifestyle_tips: List[str]
     warnings: List[str]
-    timestamp: float = time.time()
+    timestamp: float = field(default_factory=time.time)
     cached: bool = False
 
 class NutritionAdvice(BaseModel):
@@ -54,8 +76,77 @@ class NutritionAdvice(BaseModel):
     meal_suggestions: List[str]
     lifestyle_tips: List[str]
     warnings: List[str] = []
-    timestamp: float = time.time()
+    timestamp: float = Field(default_factory=time.time)
     cached: bool = False
+    error_type: Optional[str] = None  # ローカル生成のアドバイスで代替した場合の理由
+
+def _is_overload_error(error: BaseException) -> bool:
+    """クォータ超過・一時的な過負荷のエラーかどうかを判定します"""
+    return isinstance(error, (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServiceUnavailable
+    ))
+
+# Geminiに生成させるフィールド（warnings・timestamp・cached はサービス側で設定）
+ADVICE_FIELDS = ("summary", "iron_rich_foods", "meal_suggestions", "lifestyle_tips")
+
+def build_advice_response_schema() -> Dict[str, Any]:
+    """NutritionAdviceモデルからGeminiのresponse_schemaを生成します"""
+    model_schema = NutritionAdvice.model_json_schema()
+    properties = {}
+    for name in ADVICE_FIELDS:
+        field_schema = model_schema["properties"][name]
+        properties[name] = {"type": field_schema["type"]}
+        if "items" in field_schema:
+            properties[name]["items"] = {"type": field_schema["items"]["type"]}
+    return {"type": "object", "properties": properties, "required": list(ADVICE_FIELDS)}
+
+# アドバイス1件のJSONの形式（プロンプトで指示する）
+ADVICE_JSON_FORMAT = """{
+    "summary": "全体的なアドバイスの要約（100文字程度）",
+    "iron_rich_foods": [
+        "鉄分が豊富な食材1",
+        "鉄分が豊富な食材2",
+        "鉄分が豊富な食材3",
+        "鉄分が豊富な食材4",
+        "鉄分が豊富な食材5"
+    ],
+    "meal_suggestions": [
+        "具体的な食事メニュー1",
+        "具体的な食事メニュー2",
+        "具体的な食事メニュー3"
+    ],
+    "lifestyle_tips": [
+        "生活習慣に関するアドバイス1",
+        "生活習慣に関するアドバイス2",
+        "生活習慣に関するアドバイス3"
+    ]
+}
+"""
+
+# アドバイス生成時に考慮する点と出力形式の注意
+ADVICE_GUIDELINES = """
+アドバイス生成の際は以下の点を考慮してください：
+1. 鉄分の吸収を促進する食材の組み合わせ
+   - ビタミンCとの組み合わせ
+   - タンニンを含む飲み物は避ける
+2. 季節性と入手のしやすさ
+   - 旬の食材を優先
+   - スーパーで一般的に手に入る食材
+3. 調理の手軽さ
+   - 15-30分程度で作れるメニュー
+   - 特別な調理器具を必要としない
+4. 日本の食文化との親和性
+   - 和食中心のメニュー
+   - 日常的に取り入れやすい食材
+
+注意：
+- 必ず上記のJSON形式のみで回答してください
+- 追加のテキストや説明は一切不要です
+- Markdown形式は使用しないでください
+- コードブロックは使用しないでください
+"""
 
 @dataclass
 class ErrorResponse(BaseResponse):
@@ -65,6 +156,8 @@ class ErrorResponse(BaseResponse):
 class GeminiService:
     """Gemini APIを使用したアドバイス生成サービス"""
     
+    GENERATION_MODES = ("schema", "prompt")
+    
     def __init__(self, project_id: str, location: str):
         """
         GeminiServiceの初期化
@@ -73,14 +166,86 @@ class GeminiService:
             location (str): Vertex AI のロケーション
         """
         vertexai.init(project=project_id, location=location)
-        self.model = GenerativeModel("gemini-1.5-pro")
-        self._executor = ThreadPoolExecutor()
-        self._advice_cache: Dict[CacheKey, NutritionAdvice] = {}
+        # リスクレベルとモデルごとの観測レイテンシで生成に使うモデルを選ぶ
+        self._router = ModelRouter(
+            fast_model=os.getenv("GEMINI_FAST_MODEL", "gemini-1.5-flash"),
+            large_model=os.getenv("GEMINI_LARGE_MODEL", "gemini-1.5-pro"),
+            escalate_risk_levels=os.getenv("GEMINI_ESCALATE_RISK_LEVELS", "high").split(","),
+            latency_slo=float(os.getenv("GEMINI_LATENCY_SLO_SECONDS", "3.0")),
+            min_samples=int(os.getenv("GEMINI_ROUTER_MIN_SAMPLES", "10"))
+        )
+        self._models = {name: GenerativeModel(name) for name in self._router.models}
+        self.model = self._models[self._router.large_model]
+
+        # Gemini呼び出しの同時実行数をAIMDで調整（クォータ超過やp95の悪化で減速）
+        self._limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=int(os.getenv("GEMINI_LIMIT_INITIAL", "8")),
+            min_limit=int(os.getenv("GEMINI_LIMIT_MIN", "1")),
+            max_limit=int(os.getenv("GEMINI_LIMIT_MAX", "32")),
+            latency_tolerance=float(os.getenv("GEMINI_LIMIT_LATENCY_TOLERANCE", "2.0")),
+            is_overload=_is_overload_error
+        )
+        self._advice_cache: "OrderedDict[CacheKey, NutritionAdvice]" = OrderedDict()
         self._cache_lock = Lock()
-        self._cache_ttl = 300  # 5分
+        self._cache_ttl = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "300"))  # 5分
+        self._cache_max_entries = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "256"))
+        self._confidence_step = float(os.getenv("GEMINI_CACHE_CONFIDENCE_STEP", "0.1"))
         self._last_cache_cleanup = time.time()
         self._cleanup_interval = 60  # 1分
-        self._request_semaphore = Semaphore(10)
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._cache_stats = {
+            "hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0, "prewarmed_hits": 0
+        }
+
+        # 警告のない入力について事前生成しておくアドバイスのテーブル
+        self._prewarmed: Dict[CacheKey, List[NutritionAdvice]] = {}
+        self._prewarm_rotation: Dict[CacheKey, int] = {}
+        self._prewarm_variants = int(os.getenv("ADVICE_PREWARM_VARIANTS", "3"))
+        self._prewarm_confidences = [
+            None if value.strip().lower() == "none" else float(value)
+            for value in os.getenv("ADVICE_PREWARM_CONFIDENCES", "none").split(",")
+            if value.strip()
+        ]
+        self._prewarm_stats = {"refreshes": 0, "failures": 0, "last_refresh_at": None}
+
+        # 生成方式（"schema": response_schemaでJSONを強制, "prompt": プロンプトの指示のみ）
+        self.generation_mode = os.getenv("GEMINI_GENERATION_MODE", "schema").lower()
+        if self.generation_mode not in self.GENERATION_MODES:
+            raise ValueError(f"不明な生成方式です: {self.generation_mode}")
+        self._response_schema = build_advice_response_schema()
+        self._max_attempts = int(os.getenv("GEMINI_MAX_ATTEMPTS", "2"))
+        self._retry_budget = RetryBudget(ratio=float(os.getenv("GEMINI_RETRY_BUDGET_RATIO", "0.2")))
+        self._generation_stats = {"generations": 0, "parse_failures": 0, "failures": 0}
+
+        # 期限とヘッジ（直近のp90を超えた呼び出しに2本目を投げる）
+        timeout_seconds = os.getenv("GEMINI_TIMEOUT_SECONDS", "4.0")
+        self._timeout_seconds = float(timeout_seconds) if timeout_seconds else None
+        self._latency = LatencyHistogram()
+        self._hedge_enabled = os.getenv("GEMINI_HEDGE_ENABLED", "true").lower() == "true"
+        self._hedge_quantile = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.9"))
+        self._hedge_min_samples = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+        self._hedge_budget = RetryBudget(
+            ratio=float(os.getenv("GEMINI_HEDGE_BUDGET_RATIO", "0.1")), min_tokens=1.0
+        )
+        self._hedge_stats = {"hedged": 0, "hedge_wins": 0, "primary_wins": 0, "timeouts": 0}
+
+        # 食品表から組み立てるローカルのアドバイス（低リスクの応答と、遅延・障害・過負荷時の代替）
+        self._local_engine = LocalAdviceEngine()
+        self._local_risk_levels = {
+            level.strip().lower()
+            for level in os.getenv("LOCAL_ADVICE_RISK_LEVELS", "low").split(",")
+            if level.strip()
+        }
+        self._local_fallback_queue_depth = int(os.getenv("LOCAL_ADVICE_FALLBACK_QUEUE_DEPTH", "16"))
+        self._local_stats: Dict[str, int] = {"served": 0}
+
+        # 短い時間窓に届いたアドバイス生成をまとめて1回の呼び出しで生成する（モデルごと）
+        self._batch_enabled = os.getenv("GEMINI_BATCH_ENABLED", "false").lower() == "true"
+        self._batch_max_size = int(os.getenv("GEMINI_BATCH_MAX_SIZE", "8"))
+        self._batch_window = float(os.getenv("GEMINI_BATCH_WINDOW_MS", "10")) / 1000
+        # 1回の呼び出しで出力できるトークン数の上限（バッチの件数はこの範囲に収める）
+        self._max_output_tokens_limit = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS_LIMIT", "8192"))
+        self._batchers: Dict[str, MicroBatcher] = {}
         
         # 生成パラメータの設定
         self.temperature = 0.7
@@ -88,58 +253,258 @@ class GeminiService:
         self.top_p = 0.8
         self.top_k = 40
 
-    async def generate_advice(self, analysis_result: Dict[str, Any]) -> Optional[NutritionAdvice]:
-        """解析結果に基づいて栄養アドバイスを生成します"""
+    async def generate_advice(
+        self,
+        analysis_result: Optional[Dict[str, Any]] = None,
+        risk_level: Optional[str] = None,
+        confidence_score: Optional[float] = None,
+        warnings: Optional[List[str]] = None,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        deadline: Optional[float] = None
+    ) -> NutritionAdvice:
+        """
+        解析結果に基づいて栄養アドバイスを生成します
+        同じ入力（リスクレベル・信頼度の区間・警告）のアドバイスはキャッシュから返し、
+        同時に発生した同一入力のキャッシュミスは1回のGemini呼び出しを共有します
+        ローカル生成の対象のリスクレベルはGeminiを呼び出さずに食品表から生成し、
+        期限切れ・生成の失敗・過負荷の場合もローカル生成のアドバイスで代替します
+        Args:
+            analysis_result (Dict): 解析結果（risk_level / confidence_score を参照）
+            risk_level (str): リスクレベル（analysis_resultより優先）
+            confidence_score (float): 信頼度スコア（analysis_resultより優先）
+            warnings (List[str]): 警告メッセージのリスト
+            on_chunk: 指定した場合はストリーミングで生成し、受信したテキストごとに呼び出す
+                      （キャッシュから返す場合は呼び出されない）
+            deadline (float): リクエスト全体の期限（イベントループの時刻）
+        Returns:
+            NutritionAdvice: 代替した場合は error_type に理由を設定（キャッシュしない）
+        """
+        analysis_result = analysis_result or {}
+        risk_level = (risk_level or analysis_result.get("risk_level") or "medium").lower()
+        if confidence_score is None:
+            confidence_score = analysis_result.get("confidence_score")
+        warnings = warnings or []
+
+        if risk_level in self._local_risk_levels:
+            self._local_stats["served"] += 1
+            return self._local_advice(risk_level, confidence_score, warnings)
+
+        cache_key = CacheKey.create(risk_level, warnings, confidence_score, self._confidence_step)
+
+        # 事前生成済みのテーブルにあればバリエーションを順に返す
+        prewarmed = self._get_prewarmed(cache_key)
+        if prewarmed is not None:
+            self._cache_stats["prewarmed_hits"] += 1
+            return prewarmed
+
+        await self._cleanup_cache()
+
+        cached = await self._get_from_cache(cache_key)
+        if cached is not None:
+            self._cache_stats["hits"] += 1
+            return cached.model_copy(update={"cached": True})
+
+        timeout = self._remaining_time(deadline)
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            self._cache_stats["coalesced"] += 1
+            try:
+                advice = await asyncio.wait_for(asyncio.shield(inflight), timeout)
+            except asyncio.TimeoutError:
+                return self._timeout_advice(risk_level, confidence_score, warnings)
+            if advice is None:
+                return self._fallback_advice(risk_level, confidence_score, warnings, "GENERATION_ERROR")
+            return advice.model_copy(update={"cached": True})
+
+        # Gemini呼び出しの待ち行列が長い場合は待たずにローカル生成で応答する
+        if self._limiter.queue_depth >= self._local_fallback_queue_depth:
+            return self._fallback_advice(risk_level, confidence_score, warnings, "OVERLOADED")
+
+        self._cache_stats["misses"] += 1
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[cache_key] = future
         try:
-            # 非同期でGemini APIを呼び出すためにループを取得
-            loop = asyncio.get_event_loop()
-            
-            # リスクレベルに基づいてプロンプトを生成
-            risk_level = analysis_result.get("risk_level", "medium")
-            risk_score = analysis_result.get("risk_score", 0.5)
-            
-            prompt = f"""
-            貧血リスク評価結果に基づいて、具体的な栄養アドバイスを提供してください。
-            
-            リスクレベル: {risk_level}
-            リスクスコア: {risk_score}
-            
-            以下の形式で回答してください：
-            1. 鉄分を多く含む食材の推奨（3つ）
-            2. 具体的な食事の提案（3つ）
-            3. 生活習慣のアドバイス（3つ）
-            """
-            
-            # 非同期でGemini APIを呼び出し
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.model.generate_content(
-                    prompt,
-                    generation_config=GenerationConfig(
-                        temperature=0.7,
-                        max_output_tokens=200,
-                        top_p=0.8,
-                        top_k=40
-                    )
+            # 量子化した信頼度でプロンプトを作成し、キーとアドバイスの内容を対応させる
+            try:
+                result = await asyncio.wait_for(
+                    self._generate_hedged(
+                        risk_level, self._bucket_confidence(cache_key), warnings, on_chunk=on_chunk
+                    ),
+                    timeout
                 )
-            )
-            
-            # レスポンスのパース（サンプル実装）
-            return NutritionAdvice(
-                summary="貧血予防のための栄養アドバイス",
-                iron_rich_foods=["ひじき", "レバー", "ほうれん草"],
-                meal_suggestions=["レバーの生姜焼き", "ほうれん草の白和え", "ひじきの煮物"],
-                lifestyle_tips=[
-                    "規則正しい食事を心がけましょう",
-                    "十分な睡眠を取りましょう",
-                    "適度な運動を行いましょう"
-                ],
-                warnings=[]
-            )
-            
-        except Exception as e:
+            except asyncio.TimeoutError:
+                future.set_result(None)
+                return self._timeout_advice(risk_level, confidence_score, warnings)
+            if not isinstance(result, NutritionAdvice):
+                future.set_result(None)
+                return self._fallback_advice(risk_level, confidence_score, warnings, result.error_type)
+            await self._save_to_cache(cache_key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
             logger.error(f"Gemini API呼び出し中にエラーが発生: {str(e)}", exc_info=True)
+            if not future.done():
+                future.set_result(None)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return self._fallback_advice(risk_level, confidence_score, warnings, "SYSTEM_ERROR")
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    def _remaining_time(self, deadline: Optional[float]) -> Optional[float]:
+        """リクエストの期限とアドバイス生成の上限時間のうち短い方の残り時間を返します"""
+        timeouts = []
+        if self._timeout_seconds is not None:
+            timeouts.append(self._timeout_seconds)
+        if deadline is not None:
+            timeouts.append(max(0.0, deadline - asyncio.get_event_loop().time()))
+        return min(timeouts) if timeouts else None
+
+    def _local_advice(
+        self,
+        risk_level: str,
+        confidence_score: Optional[float],
+        warnings: List[str],
+        error_type: Optional[str] = None
+    ) -> NutritionAdvice:
+        """食品表からアドバイスを生成します"""
+        return NutritionAdvice(
+            **self._local_engine.generate(risk_level, confidence_score),
+            warnings=list(warnings),
+            error_type=error_type
+        )
+
+    def _fallback_advice(
+        self,
+        risk_level: str,
+        confidence_score: Optional[float],
+        warnings: List[str],
+        error_type: str
+    ) -> NutritionAdvice:
+        """Geminiで生成できなかった場合のローカル生成のアドバイスを返します（キャッシュしない）"""
+        self._local_stats[error_type] = self._local_stats.get(error_type, 0) + 1
+        logger.warning(f"ローカル生成のアドバイスで代替します: {error_type}")
+        return self._local_advice(risk_level, confidence_score, warnings, error_type)
+
+    def _timeout_advice(
+        self,
+        risk_level: str,
+        confidence_score: Optional[float],
+        warnings: List[str]
+    ) -> NutritionAdvice:
+        self._hedge_stats["timeouts"] += 1
+        return self._fallback_advice(risk_level, confidence_score, warnings, "TIMEOUT_ERROR")
+
+    async def _generate_hedged(
+        self,
+        risk_level: str,
+        confidence_score: Optional[float],
+        warnings: List[str],
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> Union[NutritionAdvice, ErrorResponse]:
+        """
+        最初の呼び出しが直近のp90を超えた場合に2本目の呼び出しを投げ、先に成功した方を返します
+        （ストリーミング時と、ヘッジの予算がない場合は投げない）
+        """
+        primary = asyncio.ensure_future(
+            self._generate_advice_internal(risk_level, confidence_score, warnings, on_chunk=on_chunk)
+        )
+        hedge_delay = self._hedge_delay() if on_chunk is None else None
+        if hedge_delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+            if not self._hedge_budget.try_acquire():
+                return await primary
+
+            self._hedge_stats["hedged"] += 1
+            hedge = asyncio.ensure_future(
+                self._generate_advice_internal(risk_level, confidence_score, warnings)
+            )
+            pending.add(hedge)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if isinstance(result, NutritionAdvice):
+                        self._hedge_stats["hedge_wins" if task is hedge else "primary_wins"] += 1
+                        return result
+            # 両方失敗した場合は最後のエラーレスポンスを返す
+            return result
+        finally:
+            # 負けた方の呼び出しはキャンセル
+            for task in pending:
+                task.cancel()
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self._hedge_enabled or self._latency.recent_count < self._hedge_min_samples:
             return None
+        self._hedge_budget.record_request()
+        return self._latency.quantile(self._hedge_quantile)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """アドバイスキャッシュのヒット率などの統計情報を返します"""
+        stats = self._cache_stats
+        hits = stats["hits"] + stats["coalesced"] + stats["prewarmed_hits"]
+        requests = hits + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": hits / requests if requests else 0.0,
+            "entries": len(self._advice_cache),
+            "inflight": len(self._inflight),
+            "prewarmed_entries": len(self._prewarmed),
+            "prewarm": dict(self._prewarm_stats)
+        }
+
+    def _bucket_confidence(self, cache_key: CacheKey) -> Optional[float]:
+        """キャッシュキーの信頼度の区間を代表値に戻します"""
+        if cache_key.confidence_bucket is None:
+            return None
+        return cache_key.confidence_bucket * self._confidence_step
+
+    def _get_prewarmed(self, cache_key: CacheKey) -> Optional[NutritionAdvice]:
+        variants = self._prewarmed.get(cache_key)
+        if not variants:
+            return None
+        index = self._prewarm_rotation.get(cache_key, 0)
+        self._prewarm_rotation[cache_key] = (index + 1) % len(variants)
+        return variants[index % len(variants)].model_copy(update={"cached": True})
+
+    async def prewarm_advice_table(self):
+        """
+        リスクレベル×信頼度の区間ごとに、警告のない入力のアドバイスを複数パターン生成して
+        テーブルを入れ替えます（生成に失敗した組み合わせは既存のパターンを残します）
+        """
+        # ローカル生成で応答するリスクレベルは事前生成しない
+        risk_levels = [level for level in ("low", "medium", "high") if level not in self._local_risk_levels]
+        for risk_level in risk_levels:
+            for confidence in self._prewarm_confidences:
+                cache_key = CacheKey.create(risk_level, [], confidence, self._confidence_step)
+                results = await asyncio.gather(*[
+                    self._generate_advice_internal(risk_level, self._bucket_confidence(cache_key), [])
+                    for _ in range(self._prewarm_variants)
+                ])
+                variants = [result for result in results if isinstance(result, NutritionAdvice)]
+                self._prewarm_stats["failures"] += len(results) - len(variants)
+                if variants:
+                    self._prewarmed[cache_key] = variants
+        self._prewarm_stats["refreshes"] += 1
+        self._prewarm_stats["last_refresh_at"] = time.time()
+        logger.info(f"アドバイステーブルを更新: {len(self._prewarmed)}件")
+
+    async def run_prewarm_loop(self, interval_seconds: float = 600):
+        """アドバイステーブルを定期的に再生成します（キャンセルされるまで継続）"""
+        while True:
+            try:
+                await self.prewarm_advice_table()
+            except Exception as e:
+                logger.error(f"アドバイステーブルの更新に失敗: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval_seconds)
 
     async def generate_advice_async(
         self,
@@ -156,72 +521,149 @@ class GeminiService:
             warnings=warnings
         )
 
-    def _create_prompt(self, risk_level: str, confidence: float, warnings: List[str]) -> str:
+    def _create_prompt(self, risk_level: str, confidence: Optional[float], warnings: List[str]) -> str:
         """
         Geminiへのプロンプトを生成
         Args:
             risk_level (str): リスクレベル
-            confidence (float): 信頼度スコア
+            confidence (float): 信頼度スコア（Noneの場合は記載しない）
             warnings (List[str]): 警告メッセージのリスト
         Returns:
             str: 生成されたプロンプト
         """
-        base_context = """
+        base_context = f"""
 あなたは貧血予防の専門家として、爪の色解析結果に基づいて栄養アドバイスを提供します。
 Markdownやその他の形式は使用せず、必ず以下の形式の厳密なJSONのみを返してください。
 
-{
-    "summary": "全体的なアドバイスの要約（100文字程度）",
-    "iron_rich_foods": [
-        "鉄分が豊富な食材1",
-        "鉄分が豊富な食材2",
-        "鉄分が豊富な食材3",
-        "鉄分が豊富な食材4",
-        "鉄分が豊富な食材5"
-    ],
-    "meal_suggestions": [
-        "具体的な食事メニュー1",
-        "具体的な食事メニュー2",
-        "具体的な食事メニュー3"
-    ],
-    "lifestyle_tips": [
-        "生活習慣に関するアドバイス1",
-        "生活習慣に関するアドバイス2",
-        "生活習慣に関するアドバイス3"
-    ]
-}
-
-アドバイス生成の際は以下の点を考慮してください：
-1. 鉄分の吸収を促進する食材の組み合わせ
-   - ビタミンCとの組み合わせ
-   - タンニンを含む飲み物は避ける
-2. 季節性と入手のしやすさ
-   - 旬の食材を優先
-   - スーパーで一般的に手に入る食材
-3. 調理の手軽さ
-   - 15-30分程度で作れるメニュー
-   - 特別な調理器具を必要としない
-4. 日本の食文化との親和性
-   - 和食中心のメニュー
-   - 日常的に取り入れやすい食材
-
-注意：
-- 必ず上記のJSON形式のみで回答してください
-- 追加のテキストや説明は一切不要です
-- Markdown形式は使用しないでください
-- コードブロックは使用しないでください
-"""
+{ADVICE_JSON_FORMAT}{ADVICE_GUIDELINES}"""
         
+        return f"{base_context}\n\n入力情報:\n{self._describe_input(risk_level, confidence, warnings)}"
+
+    def _describe_input(self, risk_level: str, confidence: Optional[float], warnings: List[str]) -> str:
+        """プロンプトの入力情報（リスクレベル・信頼度・注意事項）を生成"""
         risk_text = {
             "low": "貧血リスクは低めです",
             "medium": "貧血リスクは中程度です",
             "high": "貧血リスクは高めです"
         }.get(risk_level.lower(), "貧血リスクは中程度です")
         
-        confidence_text = f"（信頼度: {int(confidence * 100)}%）"
+        confidence_text = f"（信頼度: {int(confidence * 100)}%）" if confidence is not None else ""
         warnings_text = "注意事項:\n" + "\n".join(warnings) if warnings else ""
         
-        return f"{base_context}\n\n入力情報:\n{risk_text}{confidence_text}\n{warnings_text}"
+        return f"{risk_text}{confidence_text}\n{warnings_text}"
+
+    def _create_batch_prompt(self, items: List[tuple]) -> str:
+        """
+        複数の入力のアドバイスをJSON配列でまとめて生成するプロンプトを生成
+        Args:
+            items: (リスクレベル, 信頼度, 警告) のリスト
+        """
+        inputs = "\n".join(
+            f"[{index}] {self._describe_input(*item)}" for index, item in enumerate(items, 1)
+        )
+        return f"""
+あなたは貧血予防の専門家として、複数の爪の色解析結果それぞれに栄養アドバイスを提供します。
+Markdownやその他の形式は使用せず、入力と同じ順序で{len(items)}件のアドバイスを並べたJSON配列のみを返してください。
+配列の各要素は以下の形式の厳密なJSONオブジェクトです。
+
+{ADVICE_JSON_FORMAT}{ADVICE_GUIDELINES}
+
+入力情報:
+{inputs}"""
+
+    def _get_batcher(self, model_name: str) -> MicroBatcher:
+        batcher = self._batchers.get(model_name)
+        if batcher is None:
+            batcher = MicroBatcher(
+                partial(self._generate_batch, model_name),
+                max_batch_size=self._batch_size_limit(),
+                max_wait_seconds=self._batch_window
+            )
+            self._batchers[model_name] = batcher
+        return batcher
+
+    def _batch_size_limit(self) -> int:
+        """1件あたり max_tokens の出力が上限に収まる範囲で、1回にまとめる最大件数を返します"""
+        return max(1, min(self._batch_max_size, self._max_output_tokens_limit // self.max_tokens))
+
+    async def _generate_batch(self, model_name: str, items: List[tuple]) -> List[Any]:
+        """
+        まとめたリクエストのアドバイスを1回の呼び出しで生成します
+        Returns:
+            List: 入力と同じ順序のNutritionAdvice（検証に失敗した要素はValueError）
+        """
+        if len(items) == 1:
+            risk_level, confidence_score, warnings = items[0]
+            response_text = await self._call_gemini_api(
+                self._create_prompt(risk_level, confidence_score, warnings), model_name=model_name
+            )
+            try:
+                return [self._parse_advice(response_text, warnings)]
+            except ValueError as e:
+                return [e]
+
+        # 出力は件数分のアドバイスの配列になるため、出力トークンの上限も件数に比例させる
+        response_text = await self._call_gemini_api(
+            self._create_batch_prompt(items),
+            model_name=model_name,
+            response_schema={"type": "array", "items": self._response_schema},
+            max_output_tokens=min(self.max_tokens * len(items), self._max_output_tokens_limit)
+        )
+        try:
+            data = json.loads(response_text) if self.generation_mode == "schema" else extract_json_array(response_text)
+        except ValueError as e:
+            raise ValueError(f"バッチのレスポンスのパースに失敗しました: {str(e)}") from e
+        if not isinstance(data, list) or len(data) != len(items):
+            raise ValueError(f"バッチのレスポンスの件数が一致しません: {len(items)}件中 {len(data) if isinstance(data, list) else 0}件")
+
+        results = []
+        for element, (_, _, warnings) in zip(data, items):
+            try:
+                results.append(self._parse_advice(json.dumps(element, ensure_ascii=False), warnings))
+            except ValueError as e:
+                results.append(e)
+        return results
+
+    def _parse_advice(self, response_text: str, warnings: List[str]) -> NutritionAdvice:
+        """
+        Geminiのレスポンスを検証してNutritionAdviceに変換します
+        schemaモードではJSONのみが返るため、前処理なしでモデルに直接検証します
+        Raises:
+            ValueError: 検証に失敗した場合
+        """
+        if self.generation_mode == "schema":
+            advice = NutritionAdvice.model_validate_json(response_text)
+            empty = [name for name in ADVICE_FIELDS if name != "summary" and not getattr(advice, name)]
+            if empty:
+                raise ValueError(f"リストが空です: {empty}")
+            return advice.model_copy(update={"warnings": warnings})
+
+        response_data = self._parse_response(response_text)
+        return NutritionAdvice(
+            **{name: response_data[name] for name in ADVICE_FIELDS},
+            warnings=warnings
+        )
+
+    def get_generation_stats(self) -> Dict[str, Any]:
+        """生成回数・パース失敗・リトライ予算・同時実行数・モデル選択・バッチの統計情報を返します"""
+        return {
+            **self._generation_stats,
+            "mode": self.generation_mode,
+            "retry_budget": self._retry_budget.get_stats(),
+            "concurrency": self._limiter.get_stats(),
+            "latency": self._latency.to_dict(),
+            "hedging": {**self._hedge_stats, "budget": self._hedge_budget.get_stats()},
+            "routing": self._router.get_stats(),
+            "local": {
+                **self._local_stats,
+                "risk_levels": sorted(self._local_risk_levels),
+                "fallback_queue_depth": self._local_fallback_queue_depth
+            },
+            "batching": {
+                "enabled": self._batch_enabled,
+                "models": {name: batcher.get_stats() for name, batcher in self._batchers.items()}
+            }
+        }
 
     def _parse_response(self, response_text: str) -> Dict:
         """
@@ -232,36 +674,8 @@ Markdownやその他の形式は使用せず、必ず以下の形式の厳密な
             Dict: パースされたレスポンス
         """
         try:
-            # レスポンステキストの前処理
-            text = response_text.strip()
-            
-            # コードブロックの削除
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0]
-            elif "```" in text:
-                text = text.split("```")[1]
-            text = text.strip()
-            
-            # JSONブロックの抽出（余分なテキストを除去）
-            lines = text.split("\n")
-            json_lines = []
-            in_json = False
-            
-            for line in lines:
-                if line.strip().startswith("{"):
-                    in_json = True
-                if in_json:
-                    json_lines.append(line)
-                if line.strip().endswith("}"):
-                    break
-            
-            if not json_lines:
-                raise ValueError("JSONブロックが見つかりません")
-                
-            json_str = "\n".join(json_lines)
-            
-            # JSONのパース
-            data = json.loads(json_str)
+            # コードブロックや前置きを読み飛ばして最初のJSONオブジェクトを取り出す
+            data = extract_json_object(response_text)
             
             # 必須フィールドの確認と型の検証
             required_fields = {
@@ -301,6 +715,7 @@ Markdownやその他の形式は使用せず、必ず以下の形式の厳密な
                 
                 for key in expired_keys:
                     del self._advice_cache[key]
+                self._cache_stats["expired"] += len(expired_keys)
                     
                 self._last_cache_cleanup = current_time
                 
@@ -316,53 +731,67 @@ Markdownやその他の形式は使用せず、必ず以下の形式の厳密な
             if cache_key in self._advice_cache:
                 advice = self._advice_cache[cache_key]
                 if time.time() - advice.timestamp <= self._cache_ttl:
+                    self._advice_cache.move_to_end(cache_key)
                     return advice
                 else:
                     del self._advice_cache[cache_key]
+                    self._cache_stats["expired"] += 1
         return None
 
     async def _save_to_cache(self, cache_key: CacheKey, advice: NutritionAdvice):
-        """キャッシュにアドバイスを保存（スレッドセーフ）"""
+        """キャッシュにアドバイスを保存し、上限を超えた分を古い順に追い出す（スレッドセーフ）"""
         async with self._cache_lock:
             self._advice_cache[cache_key] = advice
+            self._advice_cache.move_to_end(cache_key)
+            while len(self._advice_cache) > self._cache_max_entries:
+                self._advice_cache.popitem(last=False)
+                self._cache_stats["evictions"] += 1
             
     async def _generate_advice_internal(
         self,
         risk_level: str,
-        confidence_score: float,
-        warnings: List[str]
+        confidence_score: Optional[float],
+        warnings: List[str],
+        on_chunk: Optional[Callable[[str], None]] = None
     ) -> Union[NutritionAdvice, ErrorResponse]:
-        """アドバイスを生成する内部メソッド"""
+        """アドバイスを生成する内部メソッド（パースに失敗した場合はリトライ予算の範囲で再生成）"""
         try:
             # プロンプトの生成
             prompt = self._create_prompt(risk_level, confidence_score, warnings)
+            self._retry_budget.record_request()
+            model_name = self._router.route(risk_level)
             
-            # Gemini APIの呼び出し
-            response = await asyncio.get_event_loop().run_in_executor(
-                self._executor,
-                lambda: self.model.generate_content(
-                    prompt,
-                    generation_config=GenerationConfig(
-                        temperature=self.temperature,
-                        max_output_tokens=self.max_tokens,
-                        top_p=self.top_p,
-                        top_k=self.top_k
-                    )
-                )
-            )
-            
-            # レスポンスのパース
-            response_data = self._parse_response(response.text)
+            # ストリーミングしない場合は他のリクエストとまとめて生成できる（再生成は個別に行う）
+            use_batch = self._batch_enabled and on_chunk is None
             
-            return NutritionAdvice(
-                summary=response_data["summary"],
-                iron_rich_foods=response_data["iron_rich_foods"],
-                meal_suggestions=response_data["meal_suggestions"],
-                lifestyle_tips=response_data["lifestyle_tips"],
-                warnings=warnings
-            )
+            attempt = 0
+            while True:
+                attempt += 1
+                self._generation_stats["generations"] += 1
+                try:
+                    if attempt == 1 and use_batch:
+                        return await self._get_batcher(model_name).submit(
+                            (risk_level, confidence_score, warnings)
+                        )
+                    # Gemini APIの呼び出しとレスポンスの検証
+                    # 再生成はストリーミングしない（最初の試行のチャンクに続けて送ると連結されてしまうため、
+                    # 呼び出し元には検証済みの最終結果だけを返す）
+                    response_text = await self._call_gemini_api(
+                        prompt,
+                        on_chunk=on_chunk if attempt == 1 else None,
+                        model_name=model_name
+                    )
+                    return self._parse_advice(response_text, warnings)
+                except ValueError as e:
+                    self._generation_stats["parse_failures"] += 1
+                    if attempt >= self._max_attempts or not self._retry_budget.try_acquire():
+                        raise
+                    # 小さいモデルで失敗した場合は大きいモデルで再生成
+                    model_name = self._router.escalate(model_name)
+                    logger.warning(f"アドバイスのパースに失敗したため再生成します（{attempt}回目, model={model_name}）: {str(e)}")
             
         except Exception as e:
+            self._generation_stats["failures"] += 1
             logger.error(f"アドバイス生成中にエラー: {str(e)}")
             return ErrorResponse(
                 summary="アドバイス生成中にエラーが発生しました",
@@ -373,79 +802,59 @@ Markdownやその他の形式は使用せず、必ず以下の形式の厳密な
                 error_type="GENERATION_ERROR"
             )
 
-    async def _call_gemini_api(self, prompt: str) -> str:
-        """Gemini APIを非同期で呼び出してレスポンスを取得"""
+    async def _call_gemini_api(
+        self,
+        prompt: str,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        model_name: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        max_output_tokens: Optional[int] = None
+    ) -> str:
+        """
+        Gemini APIを非同期クライアントで呼び出してレスポンスのテキストを取得
+        （ヘッジで負けた呼び出しや期限切れの呼び出しをキャンセルするとRPCもキャンセルされ、
+        リミッターの枠が解放される時点と実際の呼び出しの終了が一致する）
+        on_chunk を指定した場合はストリーミングで受信し、チャンクごとに呼び出します
+        model_name を省略した場合は大きいモデルを使います
+        response_schema を省略した場合はアドバイス1件のスキーマを使います（schemaモード）
+        max_output_tokens を省略した場合はアドバイス1件分（max_tokens）を上限にします
+        """
+        model_name = model_name or self._router.large_model
+        model = self._models[model_name]
         try:
             # 生成パラメータの設定
+            schema_options = {}
+            if self.generation_mode == "schema":
+                schema_options = {
+                    "response_mime_type": "application/json",
+                    "response_schema": response_schema or self._response_schema
+                }
             generation_config = GenerationConfig(
                 temperature=self.temperature,
-                max_output_tokens=self.max_tokens,
+                max_output_tokens=max_output_tokens or self.max_tokens,
                 top_p=self.top_p,
-                top_k=self.top_k
+                top_k=self.top_k,
+                **schema_options
             )
-            
-            # Gemini APIを非同期で呼び出し
-            response = await self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            # レスポンスをパースしてJSONとして返す
-            try:
-                # 生のテキストを取得
-                text = response.text
-                # 余分な空白や改行を削除
-                text = text.strip()
-                # コードブロックを削除（もし存在する場合）
-                if text.startswith("```json"):
-                    text = text[7:]
-                if text.startswith("```"):
-                    text = text[3:]
-                if text.endswith("```"):
-                    text = text[:-3]
-                text = text.strip()
-                
-                # JSONとして解析できることを確認
-                json.loads(text)  # バリデーションのみ
+
+            async with self._limiter.slot():
+                start = time.perf_counter()
+                if on_chunk is not None:
+                    parts = []
+                    responses = await model.generate_content_async(
+                        prompt, generation_config=generation_config, stream=True
+                    )
+                    async for chunk in responses:
+                        parts.append(chunk.text)
+                        on_chunk(chunk.text)
+                    text = "".join(parts)
+                else:
+                    response = await model.generate_content_async(prompt, generation_config=generation_config)
+                    text = response.text
+                elapsed = time.perf_counter() - start
+                self._latency.record(elapsed)
+                self._router.record(model_name, elapsed)
                 return text
                 
-            except json.JSONDecodeError as e:
-                raise ValueError(f"JSONDecodeError: Invalid JSON response from Gemini API. Error: {str(e)}, Response: {text}")
-                
         except Exception as e:
             raise Exception(f"Gemini API call failed: {str(e)}")
-
-    @lru_cache(maxsize=100)
-    def _create_error_response_data(self, error_message: str, error_type: str = "SYSTEM_ERROR") -> ErrorResponse:
-        """エラーレスポンスのデータを生成（同期メソッド）"""
-        return ErrorResponse(
-            summary=error_message,
-            warnings=[f"エラーが発生しました: {error_type}"],
-            iron_rich_foods=[
-                "レバー（豚、鶏、牛）",
-                "赤身の魚（マグロ、カツオ）",
-                "ほうれん草",
-                "大豆製品"
-            ],
-            meal_suggestions=[
-                "バランスの取れた食事を心がけてください",
-                "鉄分を多く含む食材を取り入れましょう"
-            ],
-            lifestyle_tips=[
-                "定期的な運動を心がけましょう",
-                "十分な睡眠を取りましょう",
-                "医師に相談することをお勧めします"
-            ],
-            error_type=error_type
-        )
-
-    async def _create_error_response(self, error_type: str = "SYSTEM_ERROR") -> ErrorResponse:
-        """エラーレスポンスを非同期で生成"""
-        return self._create_error_response_data("システムエラーが発生しました。一時的な問題の可能性があります。", error_type)
-
-    async def _create_timeout_response(self) -> ErrorResponse:
-        """タイムアウト時のエラーレスポンスを生成"""
-        return self._create_error_response_data(
-            "応答時間が制限を超えました",
-            "TIMEOUT_ERROR"
-        ) 
\ No newline at end of file
@@ -0,0 +1,220 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# 全ての月（通年で手に入る食材）
+ALL_MONTHS = frozenset(range(1, 13))
+
+
+@dataclass(frozen=True)
+class FoodItem:
+    """食品表の1行（鉄分は可食部100gあたり）"""
+    name: str
+    iron_mg: float
+    heme: bool = False  # ヘム鉄（吸収率が高い）かどうか
+    vitamin_c: bool = False  # 鉄の吸収を促すビタミンCの供給源かどうか
+    months: FrozenSet[int] = ALL_MONTHS  # 旬・入手しやすい月
+
+
+@dataclass(frozen=True)
+class MealTemplate:
+    """鉄分の多い食材とビタミンC源を組み合わせた和食中心のメニュー"""
+    name: str
+    iron_source: str
+    vitamin_c_source: str
+    cook_minutes: int
+
+
+FOOD_TABLE: Tuple[FoodItem, ...] = (
+    FoodItem("豚レバー", 13.0, heme=True),
+    FoodItem("鶏レバー", 9.0, heme=True),
+    FoodItem("しじみ", 8.3, heme=True, months=frozenset({1, 2, 7, 8})),
+    FoodItem("ひじき", 6.2),
+    FoodItem("あさり", 3.8, heme=True, months=frozenset({3, 4, 5})),
+    FoodItem("納豆", 3.3),
+    FoodItem("切り干し大根", 3.1),
+    FoodItem("菜の花", 2.9, vitamin_c=True, months=frozenset({2, 3, 4})),
+    FoodItem("牛もも赤身肉", 2.8, heme=True),
+    FoodItem("小松菜", 2.8, vitamin_c=True, months=frozenset({12, 1, 2, 3})),
+    FoodItem("枝豆", 2.7, months=frozenset({7, 8, 9})),
+    FoodItem("厚揚げ", 2.6),
+    FoodItem("いわし", 2.1, heme=True, months=frozenset({6, 7, 8, 9, 10})),
+    FoodItem("ほうれん草", 2.0, vitamin_c=True, months=frozenset({11, 12, 1, 2})),
+    FoodItem("かつお", 1.9, heme=True, months=frozenset({4, 5, 9, 10})),
+    FoodItem("ブロッコリー", 1.0, vitamin_c=True, months=frozenset({11, 12, 1, 2, 3})),
+    FoodItem("ピーマン", 0.4, vitamin_c=True, months=frozenset({6, 7, 8, 9})),
+    FoodItem("トマト", 0.2, vitamin_c=True, months=frozenset({6, 7, 8})),
+    FoodItem("いちご", 0.3, vitamin_c=True, months=frozenset({1, 2, 3, 4})),
+    FoodItem("みかん", 0.2, vitamin_c=True, months=frozenset({11, 12, 1, 2})),
+    FoodItem("パプリカ", 0.4, vitamin_c=True),
+    FoodItem("キャベツ", 0.3, vitamin_c=True),
+    FoodItem("キウイフルーツ", 0.3, vitamin_c=True),
+)
+
+MEAL_TEMPLATES: Tuple[MealTemplate, ...] = (
+    MealTemplate("レバーとピーマンの甘辛炒め", "豚レバー", "ピーマン", 20),
+    MealTemplate("鶏レバーの生姜煮とブロッコリーのおひたし", "鶏レバー", "ブロッコリー", 25),
+    MealTemplate("鶏レバーとパプリカのソテー", "鶏レバー", "パプリカ", 20),
+    MealTemplate("しじみの味噌汁とトマトのサラダ", "しじみ", "トマト", 15),
+    MealTemplate("ひじきの煮物とブロッコリーの胡麻和え", "ひじき", "ブロッコリー", 30),
+    MealTemplate("ひじきとパプリカのマリネ", "ひじき", "パプリカ", 15),
+    MealTemplate("あさりとキャベツの酒蒸し", "あさり", "キャベツ", 15),
+    MealTemplate("納豆ご飯とキャベツの味噌汁、食後にキウイフルーツ", "納豆", "キウイフルーツ", 15),
+    MealTemplate("切り干し大根とピーマンの炒め煮", "切り干し大根", "ピーマン", 25),
+    MealTemplate("菜の花のからし和えと食後のいちご", "菜の花", "いちご", 15),
+    MealTemplate("牛もも肉とパプリカのチンジャオロース風", "牛もも赤身肉", "パプリカ", 20),
+    MealTemplate("小松菜と厚揚げの煮浸し、食後にみかん", "小松菜", "みかん", 20),
+    MealTemplate("枝豆とトマトの白和え", "枝豆", "トマト", 20),
+    MealTemplate("厚揚げとキャベツの味噌炒め", "厚揚げ", "キャベツ", 15),
+    MealTemplate("いわしの梅煮とピーマンの焼き浸し", "いわし", "ピーマン", 30),
+    MealTemplate("ほうれん草の胡麻和えとブロッコリーのサラダ", "ほうれん草", "ブロッコリー", 25),
+    MealTemplate("かつおのたたき トマトと玉ねぎ添え", "かつお", "トマト", 15),
+)
+
+SUMMARY_TEMPLATES = {
+    "low": "貧血リスクは低めです。{foods}など鉄分の豊富な食材を{vitamin_c}などビタミンCを含む食材と組み合わせ、今の食習慣を続けましょう。",
+    "medium": "貧血リスクは中程度です。{foods}を毎日の食事に意識して取り入れ、{vitamin_c}などのビタミンCと一緒に摂って鉄の吸収を高めましょう。",
+    "high": "貧血リスクは高めです。{foods}など吸収率の高いヘム鉄を含む食材を積極的に摂り、めまいや疲れやすさが続く場合は医療機関に相談してください。"
+}
+
+LIFESTYLE_TIPS = {
+    "low": [
+        "食事の前後30分は緑茶・紅茶・コーヒーを控えると鉄の吸収を妨げません",
+        "主食・主菜・副菜をそろえた食事を1日3回とりましょう",
+        "定期的に爪の状態を確認し、変化がないかチェックしましょう"
+    ],
+    "medium": [
+        "食事の前後30分はタンニンを含む緑茶・紅茶・コーヒーを控えましょう",
+        "鉄製のフライパンや鍋を使うと料理に含まれる鉄分を増やせます",
+        "2〜3か月後に再度爪の状態を解析し、変化を確認しましょう"
+    ],
+    "high": [
+        "早めに医療機関で血液検査を受け、貧血の有無を確認しましょう",
+        "食事の前後30分はタンニンを含む緑茶・紅茶・コーヒーを控えましょう",
+        "めまいや息切れがある間は無理な運動を避け、十分な睡眠をとりましょう"
+    ]
+}
+
+# 旬の食材の優先度（鉄分量に掛ける係数）
+SEASONAL_WEIGHT = 1.5
+
+# 信頼度が低い場合に追加する撮影のアドバイス
+LOW_CONFIDENCE_TIP = "明るい場所で爪全体が写るように撮影し直すと、より正確に解析できます"
+
+
+class LocalAdviceEngine:
+    """食品表とテンプレートから栄養アドバイスを組み立てるローカルのアドバイス生成器
+
+    食品表を月ごとに鉄分の多い順で索引化しておき、リスクレベル・月・信頼度から
+    食材・メニュー・生活習慣のアドバイスを決定的に選びます（同じ入力には同じ結果）。
+    選択の基準はGeminiへのプロンプトと同じく、ビタミンCとの組み合わせ、旬、
+    30分以内の調理時間、和食中心のメニューです。
+    """
+
+    def __init__(
+        self,
+        foods: Tuple[FoodItem, ...] = FOOD_TABLE,
+        meals: Tuple[MealTemplate, ...] = MEAL_TEMPLATES,
+        max_cook_minutes: int = 30,
+        low_confidence_threshold: float = 0.6
+    ):
+        """
+        Args:
+            foods: 食品表
+            meals: メニューのテンプレート
+            max_cook_minutes (int): 提案するメニューの調理時間の上限（分）
+            low_confidence_threshold (float): この値未満の信頼度では撮影のアドバイスを追加する
+        """
+        self.low_confidence_threshold = low_confidence_threshold
+        self._foods: Dict[str, FoodItem] = {food.name: food for food in foods}
+        for meal in meals:
+            for name in (meal.iron_source, meal.vitamin_c_source):
+                if name not in self._foods:
+                    raise ValueError(f"食品表にない食材を使うメニューです: {meal.name} ({name})")
+
+        # 月 -> 鉄分の多い順（旬を優先）の食材 / ビタミンC源 / メニュー
+        self._iron_index: Dict[int, List[FoodItem]] = {}
+        self._heme_index: Dict[int, List[FoodItem]] = {}
+        self._vitamin_c_index: Dict[int, List[FoodItem]] = {}
+        self._meal_index: Dict[int, List[MealTemplate]] = {}
+        for month in ALL_MONTHS:
+            available = sorted(
+                (food for food in foods if month in food.months),
+                key=lambda food: (-self._score(food), food.name)
+            )
+            self._iron_index[month] = [food for food in available if not food.vitamin_c or food.iron_mg >= 1.0]
+            self._heme_index[month] = [food for food in available if food.heme]
+            self._vitamin_c_index[month] = [food for food in available if food.vitamin_c]
+            self._meal_index[month] = sorted(
+                (
+                    meal for meal in meals
+                    if meal.cook_minutes <= max_cook_minutes
+                    and month in self._foods[meal.iron_source].months
+                    and month in self._foods[meal.vitamin_c_source].months
+                ),
+                key=lambda meal: (-self._score(self._foods[meal.iron_source]), meal.cook_minutes)
+            )
+
+    @staticmethod
+    def _score(food: FoodItem) -> float:
+        # 通年の食材より旬のある食材を優先する
+        return food.iron_mg * (SEASONAL_WEIGHT if food.months != ALL_MONTHS else 1.0)
+
+    def generate(
+        self,
+        risk_level: str,
+        confidence_score: Optional[float] = None,
+        month: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        アドバイスの各フィールドを生成します
+        Args:
+            risk_level (str): リスクレベル（low / medium / high）
+            confidence_score (float): 信頼度スコア
+            month (int): 旬の判定に使う月（省略時は現在の月）
+        Returns:
+            Dict[str, Any]: summary / iron_rich_foods / meal_suggestions / lifestyle_tips
+        """
+        risk_level = risk_level.lower() if risk_level.lower() in SUMMARY_TEMPLATES else "medium"
+        month = month or datetime.now().month
+
+        foods = self._select_foods(risk_level, month)
+        vitamin_c = self._vitamin_c_index[month][0]
+        meals = self._select_meals(month)
+
+        lifestyle_tips = list(LIFESTYLE_TIPS[risk_level])
+        if confidence_score is not None and confidence_score < self.low_confidence_threshold:
+            lifestyle_tips.append(LOW_CONFIDENCE_TIP)
+
+        return {
+            "summary": SUMMARY_TEMPLATES[risk_level].format(
+                foods="・".join(food.name for food in foods[:2]),
+                vitamin_c=vitamin_c.name
+            ),
+            "iron_rich_foods": [f"{food.name}（鉄分 {food.iron_mg:.1f}mg/100g）" for food in foods],
+            "meal_suggestions": [
+                f"{meal.name}（約{meal.cook_minutes}分）" for meal in meals
+            ],
+            "lifestyle_tips": lifestyle_tips
+        }
+
+    def _select_foods(self, risk_level: str, month: int, count: int = 5) -> List[FoodItem]:
+        # 高リスクの場合は吸収率の高いヘム鉄の食材を優先する
+        if risk_level == "high":
+            heme = self._heme_index[month][:3]
+            rest = [food for food in self._iron_index[month] if food not in heme]
+            return (heme + rest)[:count]
+        return self._iron_index[month][:count]
+
+    def _select_meals(self, month: int, count: int = 3) -> List[MealTemplate]:
+        # 同じ食材が重ならないように選ぶ
+        selected: List[MealTemplate] = []
+        used = set()
+        for meal in self._meal_index[month]:
+            if meal.iron_source in used:
+                continue
+            selected.append(meal)
+            used.add(meal.iron_source)
+            if len(selected) == count:
+                break
+        return selected
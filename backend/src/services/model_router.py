@@ -0,0 +1,100 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+import logging
+
+from src.utils.latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    """アドバイス生成に使うモデルをリクエストごとに選ぶルーター
+
+    通常は小さく速いモデル（fast）を使い、高リスクなど詳しいアドバイスが必要な場合と、
+    小さいモデルの出力をパースできなかった場合だけ大きいモデル（large）に切り替えます。
+    モデルごとの直近のレイテンシ分位点がSLOを超えている場合は、SLOを満たす方を選びます。
+    """
+
+    def __init__(
+        self,
+        fast_model: str,
+        large_model: str,
+        escalate_risk_levels: Iterable[str] = ("high",),
+        latency_slo: float = 3.0,
+        quantile: float = 0.9,
+        min_samples: int = 10
+    ):
+        """
+        Args:
+            fast_model (str): 通常使うモデル名
+            large_model (str): 必要な場合に切り替えるモデル名
+            escalate_risk_levels: 大きいモデルを使うリスクレベル
+            latency_slo (float): モデルの直近の分位点レイテンシの目標値（秒）
+            quantile (float): SLOと比較するレイテンシの分位点
+            min_samples (int): SLOの判定に必要な観測数（未満の場合はSLO内とみなす）
+        """
+        self.fast_model = fast_model
+        self.large_model = large_model
+        self.escalate_risk_levels = {level.strip().lower() for level in escalate_risk_levels}
+        self.latency_slo = latency_slo
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latency: Dict[str, LatencyHistogram] = {
+            model: LatencyHistogram() for model in (fast_model, large_model)
+        }
+        self._selections: Dict[str, int] = {model: 0 for model in self._latency}
+        self._decisions: Dict[str, int] = {}
+
+    @property
+    def models(self) -> Tuple[str, ...]:
+        return tuple(self._latency)
+
+    def route(self, risk_level: str) -> str:
+        """リスクレベルと観測レイテンシからモデルを選びます"""
+        if risk_level.lower() in self.escalate_risk_levels:
+            if self._within_slo(self.large_model):
+                return self._decide(self.large_model, "risk_level")
+            # 大きいモデルが遅延している場合は小さいモデルで期限内の応答を優先
+            return self._decide(self.fast_model, "large_over_slo")
+        if not self._within_slo(self.fast_model) and self._within_slo(self.large_model):
+            return self._decide(self.large_model, "fast_over_slo")
+        return self._decide(self.fast_model, "default")
+
+    def escalate(self, model: str) -> str:
+        """再生成に使うモデルを返します（小さいモデルで失敗した場合は大きいモデル）"""
+        if model == self.fast_model and model != self.large_model:
+            return self._decide(self.large_model, "retry")
+        return model
+
+    def record(self, model: str, seconds: float):
+        """モデルの呼び出し1回分のレイテンシを記録します"""
+        histogram = self._latency.get(model)
+        if histogram is not None:
+            histogram.record(seconds)
+
+    def observed_latency(self, model: str) -> Optional[float]:
+        """SLOと比較する直近の分位点レイテンシ（観測数が足りない場合はNone）"""
+        histogram = self._latency[model]
+        if histogram.recent_count < self.min_samples:
+            return None
+        return histogram.quantile(self.quantile)
+
+    def _within_slo(self, model: str) -> bool:
+        latency = self.observed_latency(model)
+        return latency is None or latency <= self.latency_slo
+
+    def _decide(self, model: str, reason: str) -> str:
+        self._selections[model] += 1
+        self._decisions[reason] = self._decisions.get(reason, 0) + 1
+        logger.debug(f"アドバイス生成のモデルを選択: model={model}, reason={reason}")
+        return model
+
+    def get_stats(self) -> Dict[str, Any]:
+        """選択理由ごとの件数とモデルごとの選択回数・レイテンシを返します"""
+        return {
+            "latency_slo_seconds": self.latency_slo,
+            "decisions": dict(self._decisions),
+            "models": {
+                model: {"selected": self._selections[model], "latency": histogram.to_dict()}
+                for model, histogram in self._latency.items()
+            }
+        }
@@ -0,0 +1,159 @@
+from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports.grpc_asyncio import (
+    ImageAnnotatorGrpcAsyncIOTransport
+)
+from google.api_core import exceptions as google_exceptions
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _create_local_channel():
+    """グローバルなサブチャネルプールを使わないgRPCチャネルを生成します
+
+    既定ではgRPCは同じ接続先・同じ引数のチャネル間でサブチャネル（TCP接続）を共有するため、
+    クライアントを複数作っても1本の接続に多重化されます。
+    チャネルを渡すとトランスポートは自身のオプションを使わないため、
+    メッセージサイズの制限解除もここで指定します。
+    """
+    return ImageAnnotatorGrpcAsyncIOTransport.create_channel(
+        options=[
+            ("grpc.max_send_message_length", -1),
+            ("grpc.max_receive_message_length", -1),
+            ("grpc.use_local_subchannel_pool", 1)
+        ]
+    )
+
+
+def create_pooled_client() -> vision.ImageAnnotatorAsyncClient:
+    """専用の接続を持つ ImageAnnotatorAsyncClient を生成します"""
+    return vision.ImageAnnotatorAsyncClient(
+        transport=ImageAnnotatorGrpcAsyncIOTransport(channel=_create_local_channel())
+    )
+
+
+class AsyncVisionClientPool:
+    """ImageAnnotatorAsyncClient をgRPCチャネル単位でプールする非同期クライアント
+
+    クライアント（=チャネル）は初回呼び出し時にイベントループ上で生成し、
+    チャネルごとにローカルのサブチャネルプールを使って別々の接続を張ります。
+    ラウンドロビンで割り当てます。同時実行数はセマフォで制限し、
+    各呼び出しにはデッドラインを設定します。
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        timeout: float = 10.0,
+        max_concurrency: int = 32,
+        client_factory: Optional[Callable[[], Any]] = None
+    ):
+        """
+        Args:
+            pool_size (int): 生成するクライアント（gRPCチャネル）の数
+            timeout (float): 1回の呼び出しのデッドライン（秒）
+            max_concurrency (int): 同時に実行するVision API呼び出しの上限
+            client_factory: クライアントを生成する関数（未指定の場合は create_pooled_client）
+        """
+        if pool_size < 1:
+            raise ValueError("pool_sizeは1以上を指定してください")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._client_factory = client_factory or create_pooled_client
+        self._clients: List[Any] = []
+        self._next = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._stats = {
+            "calls": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "max_in_flight": 0,
+            "queued": 0,
+            "total_wait_seconds": 0.0
+        }
+
+    def _ensure_clients(self):
+        # grpc.aio のチャネルは実行中のイベントループに結びつくため遅延生成する
+        if not self._clients:
+            self._clients = [self._client_factory() for _ in range(self.pool_size)]
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _next_client(self):
+        client = self._clients[self._next]
+        self._next = (self._next + 1) % len(self._clients)
+        return client
+
+    async def annotate(
+        self,
+        image_content: bytes,
+        feature_types: List[vision.Feature.Type],
+        max_results: Optional[Dict[vision.Feature.Type, int]] = None
+    ) -> vision.AnnotateImageResponse:
+        """
+        1枚の画像に対して指定した機能の解析を行います
+        Args:
+            image_content (bytes): 画像のバイトデータ
+            feature_types: 取得する機能の種類
+            max_results: 機能ごとの最大結果数
+        Returns:
+            AnnotateImageResponse: 個別呼び出しのレスポンスと同じ属性を持つ解析結果
+        """
+        self._ensure_clients()
+        max_results = max_results or {}
+        request = {
+            "image": {"content": image_content},
+            "features": [
+                {"type_": feature_type, "max_results": max_results.get(feature_type, 0)}
+                for feature_type in feature_types
+            ]
+        }
+
+        # 上限に達している場合は待ち時間を記録してから実行
+        if self._semaphore.locked():
+            self._stats["queued"] += 1
+        wait_start = time.perf_counter()
+        async with self._semaphore:
+            self._stats["total_wait_seconds"] += time.perf_counter() - wait_start
+            self._stats["calls"] += 1
+            self._in_flight += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+            try:
+                response = await self._next_client().batch_annotate_images(
+                    requests=[request], timeout=self.timeout
+                )
+            except google_exceptions.DeadlineExceeded:
+                self._stats["timeouts"] += 1
+                raise
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+            finally:
+                self._in_flight -= 1
+
+        result = response.responses[0]
+        if result.error.message:
+            self._stats["errors"] += 1
+            raise Exception(f"Vision APIがエラーを返しました: {result.error.message}")
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """呼び出し数・待ち行列・タイムアウトの統計情報を返します"""
+        return {
+            **self._stats,
+            "in_flight": self._in_flight,
+            "channels": len(self._clients)
+        }
+
+    async def close(self):
+        """全クライアントのgRPCチャネルを閉じます"""
+        for client in self._clients:
+            try:
+                await client.transport.close()
+            except Exception as e:
+                logger.warning(f"Visionクライアントのクローズに失敗: {str(e)}")
+        self._clients = []
@@ -5,8 +5,16 @@ import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from dataclasses import dataclass
+from io import BytesIO
+from PIL import Image
 import os
 import logging
+from src.utils.color_extractor import LocalColorExtractor
+from src.utils.image_quality import LocalQualityGate, QualityGateResult
+from src.utils.image_preprocessor import ImagePreprocessor
+from src.utils.stage_runner import StageRunner, StageRunResult
+from src.services.vision_client_pool import AsyncVisionClientPool
+import json
 
 logger = logging.getLogger(__name__)
 
@@ -27,63 +35,446 @@ class NailAnalysisResult:
 class VisionService:
     """Vision AIを使用した画像解析サービス"""
     
-    def __init__(self):
+    COLOR_ENGINES = ("vision", "local")
+
+    # 拡張した爪関連のラベル
+    NAIL_RELATED_LABELS = {
+        'finger', 'hand', 'nail', 'skin', 'thumb', 'fingernail',
+        'body_part', 'joint', 'flesh', 'digit', 'manicure',
+        'cuticle', 'gesture', 'finger_joint', 'palm', 'wrist',
+        'knuckle', 'human_body', 'tissue', 'limb', 'close up',
+        'macro photography', 'detail', 'texture', 'surface',
+        'skin tone', 'body', 'photograph', 'finger tip',
+        'extremity', 'person', 'human', 'anatomy',
+        'part', 'organ', 'muscle', 'bone',
+        # 新たなキーワードを追加
+        'nail bed', 'nail plate', 'finger nail', 'nail art', 'artificial nails',
+        'cosmetics', 'beauty', ' 指の爪', '爪のケア', 'ネイル' # 日本語ラベルも追加
+    }
+    NAIL_HIGH_CONFIDENCE_THRESHOLD = 0.08  # さらに低い閾値
+    NAIL_MEDIUM_CONFIDENCE_THRESHOLD = 0.01  # さらに低い閾値
+    REQUEST_MODES = ("parallel", "batch")
+    CLIENT_MODES = ("threaded", "async")
+    FEATURES = ("face_detection", "image_properties", "object_localization")
+    FEATURE_TYPES = {
+        "face_detection": vision.Feature.Type.FACE_DETECTION,
+        "image_properties": vision.Feature.Type.IMAGE_PROPERTIES,
+        "object_localization": vision.Feature.Type.OBJECT_LOCALIZATION
+    }
+
+    def __init__(
+        self,
+        color_engine: Optional[str] = None,
+        request_mode: Optional[str] = None,
+        client_mode: Optional[str] = None
+    ):
+        """
+        VisionServiceの初期化
+        Args:
+            color_engine (str): 代表色の抽出エンジン（"vision": Vision API, "local": NumPyによるローカル抽出）
+            request_mode (str): Vision APIの呼び出し方式（"parallel": 機能ごとに並列呼び出し, "batch": 1回のannotate呼び出し）
+            client_mode (str): クライアントの種類（"threaded": 同期クライアントをスレッドで実行, "async": gRPCチャネルをプールした非同期クライアント）
+        """
         self.client = vision.ImageAnnotatorClient()
         self._executor = ThreadPoolExecutor(max_workers=3)
-    
-    async def analyze_image(self, image_content: bytes) -> Dict[str, Any]:
-        """画像を解析し、貧血リスクを評価します"""
-        try:
-            # 非同期でVision APIを呼び出すためにループを取得
-            loop = asyncio.get_event_loop()
-            
-            # Vision APIリクエストの準備
-            image = vision.Image(content=image_content)
-            
-            # 複数の解析を並行して実行
-            tasks = [
-                loop.run_in_executor(None, self.client.face_detection, image),
-                loop.run_in_executor(None, self.client.image_properties, image),
-                loop.run_in_executor(None, self.client.object_localization, image)
-            ]
-            
-            # 全ての解析結果を待機
-            face_response, properties_response, object_response = await asyncio.gather(*tasks)
-            
-            # 顔の検出結果を処理
-            faces = face_response.face_annotations
-            face_confidence = faces[0].detection_confidence if faces else 0.0
-            
-            # 色解析
-            colors = []
-            if properties_response.image_properties_annotation.dominant_colors:
-                for color in properties_response.image_properties_annotation.dominant_colors.colors:
-                    colors.append({
-                        'red': color.color.red,
-                        'green': color.color.green,
-                        'blue': color.color.blue,
-                        'score': color.score
-                    })
-            
-            # 画質評価
-            quality_metrics = self._check_image_quality(properties_response.image_properties_annotation)
-            
-            # 爪の検出確認
-            has_nail = self._detect_nail_region(object_response.localized_object_annotations)
-            quality_metrics.has_detected_nail = has_nail
-            
-            # リスクスコアの計算
-            risk_score = self._calculate_risk_score(properties_response.image_properties_annotation)
-            
+
+        self.client_mode = (client_mode or os.getenv("VISION_CLIENT_MODE", "threaded")).lower()
+        if self.client_mode not in self.CLIENT_MODES:
+            raise ValueError(f"不明なクライアントモードです: {self.client_mode}")
+        self._client_pool = None
+        if self.client_mode == "async":
+            self._client_pool = AsyncVisionClientPool(
+                pool_size=int(os.getenv("VISION_CHANNEL_POOL_SIZE", "4")),
+                timeout=float(os.getenv("VISION_CALL_TIMEOUT", "10.0")),
+                max_concurrency=int(os.getenv("VISION_MAX_CONCURRENCY", "32"))
+            )
+
+        self.color_engine = (color_engine or os.getenv("VISION_COLOR_ENGINE", "vision")).lower()
+        if self.color_engine not in self.COLOR_ENGINES:
+            raise ValueError(f"不明な色抽出エンジンです: {self.color_engine}")
+        self._color_extractor = LocalColorExtractor(
+            num_colors=int(os.getenv("LOCAL_COLOR_COUNT", "10")),
+            max_edge=int(os.getenv("LOCAL_COLOR_MAX_EDGE", "128"))
+        )
+
+        self.request_mode = (request_mode or os.getenv("VISION_REQUEST_MODE", "parallel")).lower()
+        if self.request_mode not in self.REQUEST_MODES:
+            raise ValueError(f"不明なリクエストモードです: {self.request_mode}")
+        # batchモードでの機能ごとの最大結果数
+        self.max_results = {
+            vision.Feature.Type.FACE_DETECTION: int(os.getenv("VISION_MAX_FACES", "1")),
+            vision.Feature.Type.IMAGE_PROPERTIES: int(os.getenv("VISION_MAX_COLORS", "10")),
+            vision.Feature.Type.OBJECT_LOCALIZATION: int(os.getenv("VISION_MAX_OBJECTS", "10"))
+        }
+
+        # Vision APIへ送る前の縮小・再エンコード
+        self._preprocessor = None
+        if os.getenv("VISION_PREPROCESS", "true").lower() == "true":
+            self._preprocessor = ImagePreprocessor(
+                max_edge=int(os.getenv("VISION_MAX_EDGE", "1600")),
+                target_bytes=int(os.getenv("VISION_TARGET_BYTES", str(512 * 1024)))
+            )
+
+        # 2段階のROI解析（縮小画像で爪を検出し、爪領域だけの色を解析）
+        self.roi_mode = os.getenv("VISION_ROI_MODE", "false").lower() == "true"
+        self.roi_margin = float(os.getenv("VISION_ROI_MARGIN", "0.02"))
+        self._roi_thumbnailer = ImagePreprocessor(
+            max_edge=int(os.getenv("VISION_ROI_THUMBNAIL_EDGE", "512")),
+            target_bytes=int(os.getenv("VISION_ROI_THUMBNAIL_BYTES", str(64 * 1024)))
+        )
+
+        # リクエストティアごとに必要なVision機能（代表色はリスク算出に必須）
+        self.feature_tiers = {"default": list(self.FEATURES)}
+        self.feature_tiers.update(json.loads(os.getenv("VISION_FEATURE_TIERS", "{}")))
+        for tier, features in self.feature_tiers.items():
+            unknown = set(features) - set(self.FEATURES)
+            if unknown:
+                raise ValueError(f"不明なVision機能です: {tier} -> {sorted(unknown)}")
+            if "image_properties" not in features:
+                raise ValueError(f"ティアに image_properties が含まれていません: {tier}")
+        # 代表色の明るさがこれ未満の場合は残りの呼び出しをキャンセルして除外
+        self.min_properties_brightness = float(os.getenv("VISION_MIN_BRIGHTNESS", "0.2"))
+
+        self._stats = {
+            "images": 0,
+            "original_bytes": 0,
+            "uploaded_bytes": 0,
+            "rejected": {}  # 解析を打ち切ったステージ名 -> 件数
+        }
+
+        # Vision API呼び出し前のローカル画質チェック
+        self._quality_gate = None
+        if os.getenv("VISION_QUALITY_GATE", "true").lower() == "true":
+            self._quality_gate = LocalQualityGate(
+                min_edge=int(os.getenv("QUALITY_GATE_MIN_EDGE", "200")),
+                min_brightness=float(os.getenv("QUALITY_GATE_MIN_BRIGHTNESS", "0.15")),
+                max_brightness=float(os.getenv("QUALITY_GATE_MAX_BRIGHTNESS", "0.95")),
+                min_sharpness=float(os.getenv("QUALITY_GATE_MIN_SHARPNESS", "20.0"))
+            )
+
+    async def _get_image_properties(self, loop, image: vision.Image, image_content: bytes, executor=None):
+        """設定された色抽出エンジンで image_properties_annotation 相当の結果を取得します"""
+        if self.color_engine == "local":
+            return await loop.run_in_executor(self._executor, self._color_extractor.extract, image_content)
+        response = await self._annotate_feature(loop, image, image_content, "image_properties", executor)
+        return response.image_properties_annotation
+
+    async def _annotate_feature(self, loop, image: vision.Image, image_content: bytes, feature: str, executor=None):
+        """1つのVision機能を呼び出します（asyncモードではプールした非同期クライアントを使用）"""
+        self._stats["uploaded_bytes"] += len(image_content)
+        if self._client_pool is not None:
+            return await self._client_pool.annotate(
+                image_content, [self.FEATURE_TYPES[feature]], self.max_results
+            )
+        return await loop.run_in_executor(executor, getattr(self.client, feature), image)
+
+    async def _fetch_annotations(
+        self,
+        image_content: bytes,
+        executor=None,
+        include_properties: bool = True,
+        features: Optional[List[str]] = None
+    ):
+        """
+        顔検出・画像プロパティ・オブジェクト検出の結果を取得します
+        Args:
+            include_properties (bool): 画像全体の代表色を取得するかどうか（Falseの場合はNoneを返す）
+            features (List[str]): 取得する機能（未指定の場合は全機能、含まれない機能の結果はNone）
+        Returns:
+            Tuple: (顔検出レスポンス, image_properties_annotation相当, オブジェクト検出レスポンス)
+        """
+        loop = asyncio.get_event_loop()
+        image = vision.Image(content=image_content)
+        features = features or list(self.FEATURES)
+        if not include_properties:
+            features = [feature for feature in features if feature != "image_properties"]
+
+        if self.request_mode == "batch":
+            return await self._fetch_annotations_batch(
+                loop, image, image_content, executor, include_properties, features
+            )
+
+        async def _call(feature: str):
+            if feature not in features:
+                return None
+            if feature == "image_properties":
+                return await self._get_image_properties(loop, image, image_content, executor=executor)
+            return await self._annotate_feature(loop, image, image_content, feature, executor)
+
+        # 複数の解析を並行して実行
+        return await asyncio.gather(
+            _call("face_detection"),
+            _call("image_properties"),
+            _call("object_localization")
+        )
+
+    async def _fetch_annotations_batch(
+        self,
+        loop,
+        image: vision.Image,
+        image_content: bytes,
+        executor=None,
+        include_properties: bool = True,
+        features: Optional[List[str]] = None
+    ):
+        """必要な機能をまとめた1回のannotate呼び出しで結果を取得します"""
+        features = features or list(self.FEATURES)
+        include_properties = include_properties and "image_properties" in features
+        feature_types = [
+            self.FEATURE_TYPES[feature] for feature in features
+            if feature != "image_properties"
+        ]
+        if include_properties and self.color_engine == "vision":
+            feature_types.append(vision.Feature.Type.IMAGE_PROPERTIES)
+
+        self._stats["uploaded_bytes"] += len(image_content)
+        if self._client_pool is not None:
+            annotate_future = asyncio.ensure_future(
+                self._client_pool.annotate(image_content, feature_types, self.max_results)
+            )
+        else:
+            request = {
+                "image": image,
+                "features": [
+                    {"type_": feature_type, "max_results": self.max_results[feature_type]}
+                    for feature_type in feature_types
+                ]
+            }
+            annotate_future = loop.run_in_executor(executor, self.client.annotate_image, request)
+
+        if not include_properties:
+            response = await annotate_future
+            properties = None
+        elif self.color_engine == "local":
+            response, properties = await asyncio.gather(
+                annotate_future,
+                self._get_image_properties(loop, image, image_content)
+            )
+        else:
+            response = await annotate_future
+            properties = response.image_properties_annotation
+
+        if response.error.message:
+            raise Exception(f"Vision APIがエラーを返しました: {response.error.message}")
+
+        # AnnotateImageResponseは個別呼び出しのレスポンスと同じ属性を持つため、そのまま各結果として扱う
+        return (
+            response if "face_detection" in features else None,
+            properties,
+            response if "object_localization" in features else None
+        )
+
+    def _extract_region_colors(self, image_content: bytes, box: Optional[Tuple[float, float, float, float]]):
+        """正規化座標の領域を元画像から切り出して代表色を抽出します（領域がない場合は画像全体）"""
+        with Image.open(BytesIO(image_content)) as image:
+            if box is None:
+                return self._color_extractor.extract_from_image(image)
+            width, height = image.size
+            left, top, right, bottom = box
+            margin = self.roi_margin
+            region = (
+                max(0, int((left - margin) * width)),
+                max(0, int((top - margin) * height)),
+                min(width, int(round((right + margin) * width))),
+                min(height, int(round((bottom + margin) * height)))
+            )
+            if region[2] - region[0] < 2 or region[3] - region[1] < 2:
+                return self._color_extractor.extract_from_image(image)
+            return self._color_extractor.extract_from_image(image.crop(region))
+
+    def resolve_tier(self, tier: str) -> str:
+        """設定されていないティアは "default" として扱います"""
+        return tier if tier in self.feature_tiers else "default"
+
+    def get_tier_features(self, tier: str) -> List[str]:
+        """リクエストティアで必要なVision機能を返します"""
+        return self.feature_tiers[self.resolve_tier(tier)]
+
+    def add_stages(self, runner: StageRunner, image_content: bytes, tier: str = "default"):
+        """
+        画像解析の各ステージを依存関係つきでStageRunnerに登録します
+        リスクスコアは "risk" ステージ、最終的な解析結果は "vision" ステージの結果として得られます
+        Args:
+            runner (StageRunner): ステージを登録するランナー
+            image_content (bytes): 画像のバイトデータ
+            tier (str): リクエストティア（必要なVision機能の組み合わせ）
+        """
+        loop = asyncio.get_event_loop()
+        features = self.get_tier_features(tier)
+
+        async def preprocess(results):
+            self._stats["images"] += 1
+            self._stats["original_bytes"] += len(image_content)
+            if self._preprocessor is None:
+                return {"content": image_content, "info": None}
+            preprocessed = await loop.run_in_executor(
+                self._executor, self._preprocessor.process, image_content
+            )
+            logger.info(
+                f"画像の前処理: {preprocessed.original_bytes}バイト -> {preprocessed.reduced_bytes}バイト "
+                f"({preprocessed.original_width}x{preprocessed.original_height} -> {preprocessed.width}x{preprocessed.height})"
+            )
+            return {"content": preprocessed.content, "info": preprocessed.to_dict()}
+
+        async def quality_gate(results):
+            if self._quality_gate is None:
+                return None
+            return await loop.run_in_executor(
+                self._executor, self._quality_gate.evaluate, results["preprocess"]["content"]
+            )
+
+        # 解析に使えない画像はVision APIを呼び出さずに除外
+        runner.add_stage("preprocess", preprocess)
+        runner.add_stage("quality_gate", quality_gate, depends_on=["preprocess"], abort_if=self._gate_verdict)
+
+        if self.roi_mode:
+            self._add_roi_stages(runner, loop, features)
+        elif self.request_mode == "batch":
+            self._add_batch_stages(runner, loop, features)
+        else:
+            self._add_parallel_stages(runner, loop, features)
+
+        async def risk(results):
+            properties = results["image_properties"]
             return {
-                "risk_score": risk_score,
-                "confidence_score": max(face_confidence, 0.5),  # 最低0.5の信頼度を保証
-                "detected_colors": colors,
-                "is_blurry": quality_metrics.is_blurry,
-                "brightness_score": quality_metrics.brightness_score,
-                "has_proper_lighting": quality_metrics.has_proper_lighting,
-                "has_detected_nail": quality_metrics.has_detected_nail
+                "risk_score": self._calculate_risk_score(properties),
+                "detected_colors": self._collect_colors(properties)
             }
+
+        async def assemble(results):
+            return self._assemble_result(results)
+
+        detection_stages = [feature for feature in features if feature != "image_properties"]
+        runner.add_stage("risk", risk, depends_on=["image_properties"])
+        runner.add_stage("vision", assemble, depends_on=["quality_gate", "risk", *detection_stages])
+
+    def _add_parallel_stages(self, runner: StageRunner, loop, features: List[str]):
+        """機能ごとに個別のVision API呼び出しを行うステージを登録します"""
+        def _api_stage(feature: str):
+            async def stage(results):
+                content = results["preprocess"]["content"]
+                return await self._annotate_feature(loop, vision.Image(content=content), content, feature)
+            return stage
+
+        async def image_properties(results):
+            content = results["preprocess"]["content"]
+            return await self._get_image_properties(loop, vision.Image(content=content), content)
+
+        for feature in features:
+            if feature != "image_properties":
+                runner.add_stage(feature, _api_stage(feature), depends_on=["quality_gate"])
+        # 代表色だけで解析不能と判断できれば、実行中の他の呼び出しをキャンセル
+        runner.add_stage(
+            "image_properties", image_properties,
+            depends_on=["quality_gate"], abort_if=self._properties_verdict
+        )
+
+    def _add_batch_stages(self, runner: StageRunner, loop, features: List[str]):
+        """1回のannotate呼び出しで全機能を取得するステージを登録します"""
+        async def annotate(results):
+            content = results["preprocess"]["content"]
+            return await self._fetch_annotations_batch(
+                loop, vision.Image(content=content), content, features=features
+            )
+
+        runner.add_stage("annotate", annotate, depends_on=["quality_gate"])
+        self._add_split_stages(runner, "annotate", features)
+
+    def _add_roi_stages(self, runner: StageRunner, loop, features: List[str]):
+        """
+        2段階のROI解析のステージを登録します
+        縮小画像でVision APIの検出を行い、検出した爪領域を元画像に対応づけて
+        その領域だけから代表色を抽出します
+        """
+        async def roi_detection(results):
+            thumbnail = await loop.run_in_executor(
+                self._executor, self._roi_thumbnailer.process, results["preprocess"]["content"]
+            )
+            return await self._fetch_annotations(
+                thumbnail.content, include_properties=False, features=features
+            )
+
+        async def image_properties(results):
+            # 正規化座標のバウンディングボックスは縮小画像と元画像で共通
+            object_response = results["roi_detection"][2]
+            box = None
+            if object_response is not None:
+                box = self._find_nail_bounding_box(object_response.localized_object_annotations)
+            return await loop.run_in_executor(
+                self._executor, self._extract_region_colors, results["preprocess"]["content"], box
+            )
+
+        runner.add_stage("roi_detection", roi_detection, depends_on=["quality_gate"])
+        self._add_split_stages(runner, "roi_detection", [f for f in features if f != "image_properties"])
+        runner.add_stage(
+            "image_properties", image_properties,
+            depends_on=["roi_detection"], abort_if=self._properties_verdict
+        )
+
+    def _add_split_stages(self, runner: StageRunner, source: str, features: List[str]):
+        """まとめて取得した (顔, 代表色, オブジェクト) の結果を機能ごとのステージに分解します"""
+        def _pick(index: int):
+            async def stage(results):
+                return results[source][index]
+            return stage
+
+        indices = {"face_detection": 0, "image_properties": 1, "object_localization": 2}
+        for feature in features:
+            runner.add_stage(
+                feature, _pick(indices[feature]), depends_on=[source],
+                abort_if=self._properties_verdict if feature == "image_properties" else None
+            )
+
+    def _assemble_result(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        """各ステージの結果から解析結果を組み立てます"""
+        properties = results["image_properties"]
+        gate_result = results["quality_gate"]
+
+        # 顔の検出結果を処理（ティアで顔検出を行わない場合は信頼度0）
+        face_confidence = 0.0
+        if results.get("face_detection") is not None:
+            faces = results["face_detection"].face_annotations
+            face_confidence = faces[0].detection_confidence if faces else 0.0
+
+        # 画質評価（ぼやけはローカルの鮮鋭度判定を優先）
+        quality_metrics = self._check_image_quality(properties)
+        if gate_result is not None:
+            quality_metrics.is_blurry = gate_result.is_blurry
+
+        # 爪の検出確認（ティアでオブジェクト検出を行わない場合は未判定）
+        has_nail = None
+        if results.get("object_localization") is not None:
+            has_nail = self._detect_nail_region(results["object_localization"].localized_object_annotations)
+
+        return {
+            "risk_score": results["risk"]["risk_score"],
+            "confidence_score": max(face_confidence, 0.5),  # 最低0.5の信頼度を保証
+            "detected_colors": results["risk"]["detected_colors"],
+            "is_blurry": quality_metrics.is_blurry,
+            "brightness_score": quality_metrics.brightness_score,
+            "has_proper_lighting": quality_metrics.has_proper_lighting,
+            "has_detected_nail": has_nail,
+            "preprocessing": results["preprocess"]["info"]
+        }
+
+    def build_result(self, run_result: StageRunResult) -> Dict[str, Any]:
+        """StageRunnerの実行結果から analyze_image と同じ形式の解析結果を返します"""
+        if not run_result.aborted:
+            return run_result.results["vision"]
+        self._stats["rejected"][run_result.aborted_by] = self._stats["rejected"].get(run_result.aborted_by, 0) + 1
+        preprocess = run_result.results.get("preprocess") or {}
+        return {**run_result.abort_reason, "preprocessing": preprocess.get("info")}
+
+    async def analyze_image(self, image_content: bytes, tier: str = "default") -> Dict[str, Any]:
+        """画像を解析し、貧血リスクを評価します"""
+        try:
+            runner = StageRunner()
+            self.add_stages(runner, image_content, tier)
+            run_result = await runner.run()
+            if run_result.aborted:
+                logger.info(f"画質判定により解析を打ち切り: stage={run_result.aborted_by}")
+            logger.info(f"Vision解析のステージ別実行時間: {run_result.timings_dict()}")
+            return self.build_result(run_result)
             
         except Exception as e:
             logger.error(f"Vision API解析中にエラーが発生: {str(e)}", exc_info=True)
@@ -99,45 +490,17 @@ class VisionService:
         Returns:
             NailAnalysisResult: 解析結果を含むオブジェクト
         """
-        image = vision.Image(content=image_content)
-        
-        async def _run_analysis():
-            # 並列で複数の解析を実行
-            loop = asyncio.get_event_loop()
-            properties_future = loop.run_in_executor(
-                self._executor,
-                self.client.image_properties,
-                image
-            )
-            object_future = loop.run_in_executor(
-                self._executor,
-                self.client.object_localization,
-                image
-            )
-            face_future = loop.run_in_executor(
-                self._executor,
-                self.client.face_detection,
-                image
-            )
-            
-            # 結果を待機
-            properties = await properties_future
-            objects = await object_future
-            faces = await face_future
-            
-            return properties, objects, faces
-        
         # 解析の実行
-        properties, objects, faces = await _run_analysis()
+        faces, properties, objects = await self._fetch_annotations(image_content, executor=self._executor)
         
         # 画質チェック
-        quality_metrics = self._check_image_quality(properties.image_properties_annotation)
+        quality_metrics = self._check_image_quality(properties)
         
         # 爪の検出確認
         quality_metrics.has_detected_nail = self._detect_nail_region(objects.localized_object_annotations)
         
         # 色解析とリスクスコア計算
-        colors, risk_score = self._analyze_colors(properties.image_properties_annotation)
+        colors, risk_score = self._analyze_colors(properties)
         
         # 信頼度スコアの計算
         confidence = self._calculate_confidence_score(quality_metrics, objects.localized_object_annotations)
@@ -149,6 +512,83 @@ class VisionService:
             confidence_score=confidence
         )
 
+    def get_stats(self) -> Dict[str, Any]:
+        """前処理・画質チェック・クライアントプールの統計情報を返します"""
+        stats = {**self._stats, "rejected": dict(self._stats["rejected"])}
+        if self._client_pool is not None:
+            stats["client_pool"] = self._client_pool.get_stats()
+        return stats
+
+    async def close(self):
+        """非同期クライアントのチャネルとスレッドプールを解放します"""
+        if self._client_pool is not None:
+            await self._client_pool.close()
+        self._executor.shutdown(wait=False)
+
+    def _gate_verdict(self, gate_result: Optional[QualityGateResult]) -> Optional[Dict[str, Any]]:
+        """ローカル画質チェックで解析不能と判定された場合は除外結果を返します"""
+        if gate_result is None or gate_result.is_usable:
+            return None
+        logger.info(f"ローカル画質チェックで除外: {gate_result.reasons}")
+        return self._create_rejected_result(
+            warnings=gate_result.reasons,
+            is_blurry=gate_result.is_blurry,
+            brightness_score=gate_result.brightness_score,
+            has_proper_lighting=gate_result.has_proper_lighting
+        )
+
+    def _properties_verdict(self, properties) -> Optional[Dict[str, Any]]:
+        """代表色の結果だけで解析不能と判断できる場合は除外結果を返します"""
+        if not properties.dominant_colors or not properties.dominant_colors.colors:
+            warnings = ["画像から色情報を取得できませんでした"]
+            quality = ImageQualityMetrics(
+                is_blurry=True, brightness_score=0.0, has_proper_lighting=False, has_detected_nail=False
+            )
+        else:
+            quality = self._check_image_quality(properties)
+            if quality.brightness_score >= self.min_properties_brightness:
+                return None
+            warnings = ["画像が暗すぎます"]
+        return self._create_rejected_result(
+            warnings=warnings,
+            is_blurry=quality.is_blurry,
+            brightness_score=quality.brightness_score,
+            has_proper_lighting=quality.has_proper_lighting
+        )
+
+    def _create_rejected_result(
+        self,
+        warnings: List[str],
+        is_blurry: bool,
+        brightness_score: float,
+        has_proper_lighting: bool
+    ) -> Dict[str, Any]:
+        """画質判定で除外された画像の解析結果を生成します"""
+        return {
+            "risk_score": 0.5,
+            "confidence_score": 0.0,
+            "detected_colors": [],
+            "is_blurry": is_blurry,
+            "brightness_score": brightness_score,
+            "has_proper_lighting": has_proper_lighting,
+            "has_detected_nail": False,
+            "quality_gate_rejected": True,
+            "quality_warnings": warnings
+        }
+
+    def _collect_colors(self, properties) -> List[Dict[str, Any]]:
+        """代表色をレスポンス用の形式に変換します"""
+        colors = []
+        if properties.dominant_colors:
+            for color in properties.dominant_colors.colors:
+                colors.append({
+                    'red': color.color.red,
+                    'green': color.color.green,
+                    'blue': color.color.blue,
+                    'score': color.score
+                })
+        return colors
+
     def _check_image_quality(self, properties) -> ImageQualityMetrics:
         """画像の品質を評価します"""
         # 明るさの評価
@@ -179,37 +619,25 @@ class VisionService:
             has_detected_nail=False  # 初期値、後で更新
         )
 
+    def _is_nail_related_label(self, obj_name: str) -> bool:
+        """オブジェクト名が爪関連のラベルに一致するか（部分一致を含む）を判定します"""
+        if obj_name in self.NAIL_RELATED_LABELS:
+            return True
+        return any(label in obj_name or obj_name in label or
+                   any(word in obj_name.split() for word in label.split())
+                   for label in self.NAIL_RELATED_LABELS)
+
     def _detect_nail_region(self, objects) -> bool:
         """爪領域の検出を試みます（改善版）"""
-        # 拡張した爪関連のラベル
-        nail_related_labels = {
-            'finger', 'hand', 'nail', 'skin', 'thumb', 'fingernail',
-            'body_part', 'joint', 'flesh', 'digit', 'manicure',
-            'cuticle', 'gesture', 'finger_joint', 'palm', 'wrist',
-            'knuckle', 'human_body', 'tissue', 'limb', 'close up',
-            'macro photography', 'detail', 'texture', 'surface',
-            'skin tone', 'body', 'photograph', 'finger tip',
-            'extremity', 'person', 'human', 'anatomy',
-            'part', 'organ', 'muscle', 'bone',
-            # 新たなキーワードを追加
-            'nail bed', 'nail plate', 'finger nail', 'nail art', 'artificial nails',
-            'cosmetics', 'beauty', ' 指の爪', '爪のケア', 'ネイル' # 日本語ラベルも追加
-        }
-
         # 信頼度の閾値をさらに緩和
-        high_confidence_threshold = 0.08  # さらに低い閾値
-        medium_confidence_threshold = 0.01  # さらに低い閾値
+        high_confidence_threshold = self.NAIL_HIGH_CONFIDENCE_THRESHOLD
+        medium_confidence_threshold = self.NAIL_MEDIUM_CONFIDENCE_THRESHOLD
 
         # 方法1: 高信頼度の検出（部分一致を含む）
         for obj in objects:
             obj_name = obj.name.lower().replace('_', ' ')
             if obj.score >= high_confidence_threshold:
-                if obj_name in nail_related_labels:
-                    return True
-                # 部分一致チェック
-                if any(label in obj_name or obj_name in label or
-                       any(word in obj_name.split() for word in label.split())
-                       for label in nail_related_labels):
+                if self._is_nail_related_label(obj_name):
                     return True
 
         # 方法2: 中程度の信頼度の検出
@@ -217,36 +645,64 @@ class VisionService:
         for obj in objects:
             obj_name = obj.name.lower().replace('_', ' ')
             if medium_confidence_threshold <= obj.score < high_confidence_threshold:
-                if obj_name in nail_related_labels:
-                    medium_confidence_objects.append(obj)
-                elif any(label in obj_name or obj_name in label or
-                         any(word in obj_name.split() for word in label.split())
-                         for label in nail_related_labels):
+                if self._is_nail_related_label(obj_name):
                     medium_confidence_objects.append(obj)
                 if len(medium_confidence_objects) >= 2:
                     return True
 
         # 方法3: バウンディングボックス分析（細かいオブジェクトに対応）
         for obj in objects:
-            box = obj.bounding_poly.normalized_vertices
-            center_x = (box[0].x + box[2].x) / 2
-            center_y = (box[0].y + box[2].y) / 2
-            width = abs(box[2].x - box[0].x)
-            height = abs(box[2].y - box[0].y)
-            area = width * height
-            aspect_ratio = width / height if height > 0 else 0
-
-            # 小さなオブジェクトも検出するため、面積の閾値を下げ、アスペクト比の範囲を拡大
-            if (0.0 <= center_x <= 1.0 and
-                0.0 <= center_y <= 1.0 and
-                0.0005 <= area <= 0.5 and # 面積の閾値をさらに下げる
-                0.01 <= aspect_ratio <= 30.0): # アスペクト比の範囲をさらに拡大
+            if self._has_nail_like_geometry(obj):
                 return True
 
         # 方法4: さらなる改善策として、Vertex AI SDK を利用した高度なオブジェクト検出に切り替えることも検討できます。
 
         return False
 
+    def _has_nail_like_geometry(self, obj) -> bool:
+        """バウンディングボックスの位置・面積・アスペクト比が爪領域らしいかを判定します"""
+        box = obj.bounding_poly.normalized_vertices
+        center_x = (box[0].x + box[2].x) / 2
+        center_y = (box[0].y + box[2].y) / 2
+        width = abs(box[2].x - box[0].x)
+        height = abs(box[2].y - box[0].y)
+        area = width * height
+        aspect_ratio = width / height if height > 0 else 0
+
+        # 小さなオブジェクトも検出するため、面積の閾値を下げ、アスペクト比の範囲を拡大
+        return (0.0 <= center_x <= 1.0 and
+                0.0 <= center_y <= 1.0 and
+                0.0005 <= area <= 0.5 and # 面積の閾値をさらに下げる
+                0.01 <= aspect_ratio <= 30.0) # アスペクト比の範囲をさらに拡大
+
+    def _find_nail_bounding_box(self, objects) -> Optional[Tuple[float, float, float, float]]:
+        """
+        _detect_nail_region と同じ基準で爪領域のオブジェクトを選び、正規化座標の矩形を返します
+        Returns:
+            Optional[Tuple]: (left, top, right, bottom)。見つからない場合はNone
+        """
+        candidates = [
+            obj for obj in objects
+            if obj.score >= self.NAIL_MEDIUM_CONFIDENCE_THRESHOLD and
+            self._is_nail_related_label(obj.name.lower().replace('_', ' '))
+        ]
+        if candidates:
+            selected = max(candidates, key=lambda obj: obj.score)
+        else:
+            selected = next((obj for obj in objects if self._has_nail_like_geometry(obj)), None)
+        if selected is None:
+            return None
+
+        vertices = selected.bounding_poly.normalized_vertices
+        xs = [vertex.x for vertex in vertices]
+        ys = [vertex.y for vertex in vertices]
+        return (
+            max(0.0, min(xs)),
+            max(0.0, min(ys)),
+            min(1.0, max(xs)),
+            min(1.0, max(ys))
+        )
+
     def _analyze_colors(self, properties) -> Tuple[List[Dict], float]:
         """色解析とリスクスコア計算"""
         colors = []
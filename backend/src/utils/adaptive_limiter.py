@@ -0,0 +1,164 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+import asyncio
+import time
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD（加算増加・乗算減少）で同時実行数の上限を調整するリミッター
+
+    上限まで使われている状態で成功が続くと上限を少しずつ増やし、
+    過負荷エラー（クォータ超過など）や直近のp95レイテンシの悪化を検知すると
+    上限を一定の割合で減らします。上限を超えたリクエストは到着順に待機します。
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        backoff_ratio: float = 0.5,
+        latency_tolerance: float = 2.0,
+        window_size: int = 20,
+        is_overload: Optional[Callable[[BaseException], bool]] = None
+    ):
+        """
+        Args:
+            initial_limit (int): 初期の同時実行数の上限
+            min_limit (int): 上限の下限
+            max_limit (int): 上限の上限
+            backoff_ratio (float): 過負荷時に上限に掛ける割合
+            latency_tolerance (float): 基準p95の何倍を超えたらレイテンシ悪化とみなすか
+            window_size (int): p95を評価する成功リクエスト数
+            is_overload: 例外が過負荷（減速すべきエラー）かどうかを判定する関数
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.window_size = window_size
+        self._is_overload = is_overload or (lambda error: False)
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._latencies: Deque[float] = deque(maxlen=window_size)
+        self._samples_since_check = 0
+        self._baseline_p95: Optional[float] = None
+        self._last_p95: Optional[float] = None
+        # 上限を下げた時点より前に開始したリクエストの結果では再度下げない
+        self._sequence = 0
+        self._last_decrease_sequence = -1
+        self._stats = {
+            "requests": 0,
+            "overloads": 0,
+            "errors": 0,
+            "increases": 0,
+            "decreases": 0,
+            "max_queue_depth": 0
+        }
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self):
+        """上限の範囲で1件を実行するコンテキスト（所要時間と結果で上限を調整）"""
+        sequence = await self._acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self._release()
+            raise
+        except BaseException as error:
+            self._release()
+            self._on_error(error, sequence)
+            raise
+        else:
+            self._release()
+            self._on_success(time.perf_counter() - start)
+
+    async def _acquire(self) -> int:
+        self._stats["requests"] += 1
+        if self._in_flight >= self.limit or self._waiters:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiters))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # 枠を受け取った直後にキャンセルされた場合は次の待機者に譲る
+                    self._in_flight -= 1
+                    self._wake_waiters()
+                raise
+        else:
+            self._in_flight += 1
+        self._sequence += 1
+        return self._sequence
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    def _on_success(self, latency: float):
+        self._latencies.append(latency)
+        self._samples_since_check += 1
+        if self._samples_since_check >= self.window_size:
+            self._samples_since_check = 0
+            p95 = sorted(self._latencies)[int(0.95 * (len(self._latencies) - 1))]
+            self._last_p95 = p95
+            if self._baseline_p95 is None:
+                self._baseline_p95 = p95
+            elif p95 > self._baseline_p95 * self.latency_tolerance:
+                self._decrease(self._sequence)
+                return
+            else:
+                # 基準は最小値を追いつつ、恒常的な変化にはゆっくり追従する
+                self._baseline_p95 = min(p95, self._baseline_p95 * 1.05)
+
+        # 上限近くまで使われているときだけ増やす（約1往復ごとに+1）
+        if self._in_flight + 1 >= self.limit and self._limit < self.max_limit:
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._stats["increases"] += 1
+            self._wake_waiters()
+
+    def _on_error(self, error: BaseException, sequence: int):
+        if not self._is_overload(error):
+            self._stats["errors"] += 1
+            return
+        self._stats["overloads"] += 1
+        if sequence > self._last_decrease_sequence:
+            self._decrease(self._sequence)
+
+    def _decrease(self, sequence: int):
+        self._limit = max(float(self.min_limit), self._limit * self.backoff_ratio)
+        self._last_decrease_sequence = sequence
+        self._stats["decreases"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """現在の上限・実行中・待機中の件数などの統計情報を返します"""
+        return {
+            **self._stats,
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "p95_seconds": self._last_p95,
+            "baseline_p95_seconds": self._baseline_p95
+        }
@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class DominantColor:
+    """RGB値（Vision APIの google.type.Color 互換）"""
+    red: float
+    green: float
+    blue: float
+
+
+@dataclass
+class ColorInfo:
+    """代表色とそのスコア（Vision APIの ColorInfo 互換）"""
+    color: DominantColor
+    score: float
+    pixel_fraction: float
+
+
+@dataclass
+class DominantColorsAnnotation:
+    """代表色のリスト（Vision APIの DominantColorsAnnotation 互換）"""
+    colors: List[ColorInfo] = field(default_factory=list)
+
+
+@dataclass
+class ImagePropertiesAnnotation:
+    """画像プロパティ（Vision APIの ImageProperties 互換）"""
+    dominant_colors: Optional[DominantColorsAnnotation] = None
+
+
+class LocalColorExtractor:
+    """NumPyによるローカルの代表色抽出エンジン
+
+    画素をサブサンプリングし、バッチ化したk-meansで代表色を求めます。
+    戻り値はVision APIの image_properties_annotation と同じ属性構造を持つため、
+    VisionService の既存の色評価ロジックをそのまま利用できます。
+    """
+
+    def __init__(
+        self,
+        num_colors: int = 10,
+        max_edge: int = 128,
+        max_samples: int = 4096,
+        max_iterations: int = 12,
+        tolerance: float = 0.5
+    ):
+        self.num_colors = num_colors
+        self.max_edge = max_edge
+        self.max_samples = max_samples
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+
+    def extract(self, image_content: bytes) -> ImagePropertiesAnnotation:
+        """画像のバイトデータから代表色を抽出します"""
+        with Image.open(BytesIO(image_content)) as image:
+            # JPEGはデコード時点で縮小し、フル解像度の展開を避ける
+            image.draft("RGB", (self.max_edge, self.max_edge))
+            return self.extract_from_image(image)
+
+    def extract_from_image(self, image: Image.Image) -> ImagePropertiesAnnotation:
+        """PIL画像から代表色を抽出します"""
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((self.max_edge, self.max_edge))
+        pixels = np.asarray(thumbnail, dtype=np.float32).reshape(-1, 3)
+        if pixels.size == 0:
+            return ImagePropertiesAnnotation(dominant_colors=None)
+
+        # 等間隔サンプリングで画素数を上限以下に抑える
+        if len(pixels) > self.max_samples:
+            step = len(pixels) / self.max_samples
+            indices = (np.arange(self.max_samples) * step).astype(np.int64)
+            pixels = pixels[indices]
+
+        centers, counts = self._kmeans(pixels)
+
+        total = counts.sum()
+        order = np.argsort(-counts)
+        colors = []
+        for index in order:
+            if counts[index] == 0:
+                continue
+            fraction = float(counts[index] / total)
+            red, green, blue = (float(v) for v in np.round(centers[index]))
+            colors.append(ColorInfo(
+                color=DominantColor(red=red, green=green, blue=blue),
+                score=fraction,
+                pixel_fraction=fraction
+            ))
+
+        return ImagePropertiesAnnotation(
+            dominant_colors=DominantColorsAnnotation(colors=colors)
+        )
+
+    def _kmeans(self, pixels: np.ndarray):
+        """輝度の分位点で初期化したk-means（全画素を行列演算で一括割り当て）"""
+        k = min(self.num_colors, len(pixels))
+
+        # 輝度順に並べた画素から等間隔に初期中心を選ぶ（決定的な初期化）
+        luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        sorted_indices = np.argsort(luminance, kind="stable")
+        seeds = sorted_indices[np.linspace(0, len(pixels) - 1, k).astype(np.int64)]
+        centers = pixels[seeds].copy()
+
+        pixel_norms = (pixels ** 2).sum(axis=1, keepdims=True)
+        labels = np.zeros(len(pixels), dtype=np.int64)
+
+        for _ in range(self.max_iterations):
+            # ||p - c||^2 = ||p||^2 - 2 p・c + ||c||^2
+            distances = pixel_norms - 2.0 * pixels @ centers.T + (centers ** 2).sum(axis=1)
+            labels = distances.argmin(axis=1)
+
+            counts = np.bincount(labels, minlength=k).astype(np.float32)
+            sums = np.stack([
+                np.bincount(labels, weights=pixels[:, channel], minlength=k)
+                for channel in range(3)
+            ], axis=1)
+
+            # 空クラスタは前回の中心を維持する
+            non_empty = counts > 0
+            new_centers = centers.copy()
+            new_centers[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+            shift = np.abs(new_centers - centers).max()
+            centers = new_centers
+            if shift < self.tolerance:
+                break
+
+        counts = np.bincount(labels, minlength=k)
+        return centers, counts
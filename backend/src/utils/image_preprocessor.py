@@ -0,0 +1,105 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# EXIFのOrientationタグ
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class PreprocessedImage:
+    """前処理後の画像とサイズ情報"""
+    content: bytes
+    original_bytes: int
+    reduced_bytes: int
+    original_width: int
+    original_height: int
+    width: int
+    height: int
+    quality: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ログや統計用に画像データ以外の情報を返します"""
+        data = asdict(self)
+        data.pop("content")
+        return data
+
+
+class ImagePreprocessor:
+    """Vision APIへ送る前に画像を縮小・再エンコードする前処理
+
+    JPEGはdraftモードでデコード段階から縮小し、EXIFの向きを適用したうえで
+    目標バイト数に収まるまで品質を下げながらJPEGに再エンコードします。
+    """
+
+    def __init__(
+        self,
+        max_edge: int = 1600,
+        target_bytes: int = 512 * 1024,
+        initial_quality: int = 90,
+        min_quality: int = 60,
+        quality_step: int = 10
+    ):
+        """
+        Args:
+            max_edge (int): 縮小後の長辺の最大ピクセル数
+            target_bytes (int): 再エンコード後の目標バイト数
+            initial_quality (int): 最初に試すJPEG品質
+            min_quality (int): 品質を下げる下限
+            quality_step (int): 目標に収まらない場合に下げる品質の幅
+        """
+        self.max_edge = max_edge
+        self.target_bytes = target_bytes
+        self.initial_quality = initial_quality
+        self.min_quality = min_quality
+        self.quality_step = quality_step
+
+    def process(self, image_content: bytes) -> PreprocessedImage:
+        """画像を縮小・再エンコードします"""
+        with Image.open(BytesIO(image_content)) as image:
+            original_width, original_height = image.size
+            orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+
+            # 既に十分小さく向きの補正も不要な画像はそのまま使う
+            if (
+                len(image_content) <= self.target_bytes and
+                max(original_width, original_height) <= self.max_edge and
+                orientation == 1
+            ):
+                return PreprocessedImage(
+                    content=image_content,
+                    original_bytes=len(image_content),
+                    reduced_bytes=len(image_content),
+                    original_width=original_width,
+                    original_height=original_height,
+                    width=original_width,
+                    height=original_height
+                )
+
+            # JPEGはデコード時点で縮小（1/2, 1/4, 1/8）してフル解像度の展開を避ける
+            image.draft("RGB", (self.max_edge, self.max_edge))
+            transposed = ImageOps.exif_transpose(image)
+            rgb = transposed.convert("RGB")
+
+        rgb.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+
+        quality = self.initial_quality
+        while True:
+            buffer = BytesIO()
+            rgb.save(buffer, format="JPEG", quality=quality, optimize=True)
+            content = buffer.getvalue()
+            if len(content) <= self.target_bytes or quality - self.quality_step < self.min_quality:
+                break
+            quality -= self.quality_step
+
+        return PreprocessedImage(
+            content=content,
+            original_bytes=len(image_content),
+            reduced_bytes=len(content),
+            original_width=original_width,
+            original_height=original_height,
+            width=rgb.width,
+            height=rgb.height,
+            quality=quality
+        )
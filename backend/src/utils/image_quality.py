@@ -0,0 +1,115 @@
+from dataclasses import dataclass, field
+from typing import List
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class QualityGateResult:
+    """ローカル画質チェックの結果"""
+    is_usable: bool
+    width: int
+    height: int
+    brightness_score: float
+    underexposed_ratio: float
+    overexposed_ratio: float
+    sharpness: float
+    is_blurry: bool
+    has_proper_lighting: bool
+    reasons: List[str] = field(default_factory=list)
+
+
+class LocalQualityGate:
+    """有料APIを呼び出す前に画像の品質をローカルで判定するゲート
+
+    縮小デコードした輝度画像から解像度・露出ヒストグラム・ラプラシアン分散（鮮鋭度）を
+    NumPyで計算し、解析に使えない画像を早期に除外します。
+    """
+
+    def __init__(
+        self,
+        min_edge: int = 200,
+        analysis_edge: int = 512,
+        min_brightness: float = 0.15,
+        max_brightness: float = 0.95,
+        max_clipped_ratio: float = 0.6,
+        min_sharpness: float = 20.0,
+        proper_lighting_range: tuple = (0.3, 0.7)
+    ):
+        """
+        Args:
+            min_edge (int): 短辺の最小ピクセル数
+            analysis_edge (int): 判定に使う縮小画像の最大辺
+            min_brightness (float): 平均輝度の下限（0〜1）
+            max_brightness (float): 平均輝度の上限（0〜1）
+            max_clipped_ratio (float): 黒つぶれ・白飛びした画素の割合の上限
+            min_sharpness (float): ラプラシアン分散の下限（これ未満はぼやけと判定）
+            proper_lighting_range (tuple): 適切な照明とみなす平均輝度の範囲
+        """
+        self.min_edge = min_edge
+        self.analysis_edge = analysis_edge
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped_ratio = max_clipped_ratio
+        self.min_sharpness = min_sharpness
+        self.proper_lighting_range = proper_lighting_range
+
+    def evaluate(self, image_content: bytes) -> QualityGateResult:
+        """画像の品質を判定します"""
+        try:
+            with Image.open(BytesIO(image_content)) as image:
+                width, height = image.size
+                image.draft("L", (self.analysis_edge, self.analysis_edge))
+                gray = image.convert("L")
+                gray.thumbnail((self.analysis_edge, self.analysis_edge))
+                luminance = np.asarray(gray, dtype=np.float32)
+        except Exception:
+            return QualityGateResult(
+                is_usable=False, width=0, height=0, brightness_score=0.0,
+                underexposed_ratio=0.0, overexposed_ratio=0.0, sharpness=0.0,
+                is_blurry=True, has_proper_lighting=False,
+                reasons=["画像を読み込めませんでした"]
+            )
+
+        # 露出：256ビンのヒストグラムから平均輝度と黒つぶれ・白飛びの割合を算出
+        histogram = np.bincount(luminance.astype(np.uint8).ravel(), minlength=256)
+        total = histogram.sum()
+        brightness_score = float((histogram * np.arange(256)).sum() / total / 255)
+        underexposed_ratio = float(histogram[:16].sum() / total)
+        overexposed_ratio = float(histogram[240:].sum() / total)
+
+        # 鮮鋭度：4近傍ラプラシアンの分散
+        laplacian = (
+            luminance[:-2, 1:-1] + luminance[2:, 1:-1] +
+            luminance[1:-1, :-2] + luminance[1:-1, 2:] -
+            4 * luminance[1:-1, 1:-1]
+        )
+        sharpness = float(laplacian.var()) if laplacian.size else 0.0
+        is_blurry = sharpness < self.min_sharpness
+
+        reasons = []
+        if min(width, height) < self.min_edge:
+            reasons.append(f"画像の解像度が低すぎます（{width}x{height}）")
+        if brightness_score < self.min_brightness:
+            reasons.append("画像が暗すぎます")
+        elif brightness_score > self.max_brightness:
+            reasons.append("画像が明るすぎます")
+        if max(underexposed_ratio, overexposed_ratio) > self.max_clipped_ratio:
+            reasons.append("黒つぶれまたは白飛びしている部分が多すぎます")
+        if is_blurry:
+            reasons.append("画像がぼやけています")
+
+        low, high = self.proper_lighting_range
+        return QualityGateResult(
+            is_usable=not reasons,
+            width=width,
+            height=height,
+            brightness_score=brightness_score,
+            underexposed_ratio=underexposed_ratio,
+            overexposed_ratio=overexposed_ratio,
+            sharpness=sharpness,
+            is_blurry=is_blurry,
+            has_proper_lighting=low <= brightness_score <= high,
+            reasons=reasons
+        )
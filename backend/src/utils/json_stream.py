@@ -0,0 +1,169 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+
+_WHITESPACE = " \t\n\r"
+# 数値はバッファの末尾で終わっている場合、続きが届く可能性がある
+_NUMBER_CHARS = set("0123456789+-.eE")
+
+
+class IncrementalJSONExtractor:
+    """LLMの出力から最上位のJSONオブジェクトを逐次的に取り出すパーサー
+
+    コードブロックや前置きの文章は読み飛ばし、最初の "{" からオブジェクトを解析します。
+    チャンクを受け取るたびに JSONDecoder.raw_decode で未解析の位置から
+    キーと値を読み進め、閉じたフィールドから順に返します。
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._complete = False
+        self._after_field = False
+        self._fields: Dict[str, Any] = {}
+
+    @property
+    def is_complete(self) -> bool:
+        return self._complete
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        """これまでに閉じたフィールド"""
+        return dict(self._fields)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        チャンクを追加し、新たに閉じたフィールドを返します
+        Returns:
+            List[Tuple[str, Any]]: (フィールド名, 値) のリスト
+        Raises:
+            ValueError: JSONとして解釈できない内容が含まれる場合
+        """
+        if self._complete:
+            return []
+        self._buffer += chunk
+
+        if not self._started:
+            start = self._buffer.find("{", self._pos)
+            if start < 0:
+                self._pos = len(self._buffer)
+                return []
+            self._pos = start + 1
+            self._started = True
+
+        completed = []
+        while True:
+            item = self._next_field()
+            if item is None:
+                break
+            completed.append(item)
+        return completed
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        入力の終わりを通知し、解析したオブジェクトを返します
+        Raises:
+            ValueError: オブジェクトが見つからない、または閉じていない場合
+        """
+        if not self._started:
+            raise ValueError("JSONオブジェクトが見つかりません")
+        if not self._complete:
+            raise ValueError("JSONオブジェクトが閉じていません")
+        return dict(self._fields)
+
+    def _skip(self, pos: int) -> int:
+        buffer = self._buffer
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def _next_field(self) -> Optional[Tuple[str, Any]]:
+        pos = self._skip(self._pos)
+        if pos >= len(self._buffer):
+            return None
+        if self._buffer[pos] == "}":
+            self._pos = pos + 1
+            self._complete = True
+            return None
+        if self._after_field:
+            # フィールドの間には ',' が必要
+            if self._buffer[pos] != ",":
+                raise ValueError(f"JSONの区切り文字 ',' がありません: {self._buffer[pos]!r}")
+            pos = self._skip(pos + 1)
+            if pos >= len(self._buffer):
+                return None
+        if self._buffer[pos] != '"':
+            raise ValueError(f"JSONのキーが必要な位置に不正な文字があります: {self._buffer[pos]!r}")
+
+        key, pos = self._decode(pos)
+        if pos is None:
+            return None
+        pos = self._skip(pos)
+        if pos >= len(self._buffer):
+            return None
+        if self._buffer[pos] != ":":
+            raise ValueError(f"JSONの区切り文字 ':' がありません: {key}")
+
+        pos = self._skip(pos + 1)
+        value, end = self._decode(pos)
+        if end is None:
+            return None
+        # 末尾の数値はまだ桁が続く可能性があるため、区切りが届くまで確定しない
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if end >= len(self._buffer) or self._buffer[end] in _NUMBER_CHARS:
+                return None
+
+        self._pos = end
+        self._after_field = True
+        self._fields[key] = value
+        return key, value
+
+    def _decode(self, pos: int) -> Tuple[Any, Optional[int]]:
+        """pos から1つの値を読み取ります（値が途中までしか届いていない場合は (None, None)）"""
+        if pos >= len(self._buffer):
+            return None, None
+        try:
+            return self._decoder.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError as e:
+            # 入力の末尾で失敗した場合は続きを待つ
+            if self._incomplete_at(e.pos):
+                return None, None
+            raise ValueError(f"JSONの解析に失敗しました: {e.msg}") from e
+
+    def _incomplete_at(self, error_pos: int) -> bool:
+        # 途中で切れた値はエラー位置が入力の末尾になる（文字列・配列・オブジェクトは開始位置）
+        if error_pos >= len(self._buffer):
+            return True
+        tail = self._buffer[error_pos:]
+        if tail[0] in '"[{':
+            return True
+        # true / false / null の途中
+        return any(literal.startswith(tail) for literal in ("true", "false", "null"))
+
+
+def extract_json_object(text: str) -> Dict[str, Any]:
+    """
+    前置きやコードブロックを含むテキストから最初のJSONオブジェクトを取り出します
+    Raises:
+        ValueError: JSONオブジェクトが見つからない、または不正な場合
+    """
+    extractor = IncrementalJSONExtractor()
+    extractor.feed(text)
+    return extractor.finish()
+
+
+def extract_json_array(text: str) -> List[Any]:
+    """
+    前置きやコードブロックを含むテキストから最初のJSON配列を取り出します
+    Raises:
+        ValueError: JSON配列が見つからない、または不正な場合
+    """
+    start = text.find("[")
+    if start < 0:
+        raise ValueError("JSON配列が見つかりません")
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSONの解析に失敗しました: {e.msg}") from e
+    return value
@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import bisect
+
+# 累積ヒストグラムのバケット上限（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+
+class LatencyHistogram:
+    """レイテンシの累積ヒストグラムと直近の分位点
+
+    観測用の累積バケットに加えて直近 window 件の値を保持し、
+    負荷の変化に追従する分位点（p50 / p90 など）を返します。
+    """
+
+    def __init__(self, window: int = 200, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Args:
+            window (int): 分位点の計算に使う直近の件数
+            buckets (tuple): 累積ヒストグラムのバケット上限（秒、昇順）
+        """
+        self.buckets = buckets
+        self._counts: List[int] = [0] * (len(buckets) + 1)
+        self._recent: Deque[float] = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def recent_count(self) -> int:
+        return len(self._recent)
+
+    def record(self, seconds: float):
+        self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self._recent.append(seconds)
+        self._count += 1
+        self._total += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """直近の値の分位点を返します（値がない場合はNone）"""
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """件数・平均・分位点・バケットごとの件数を返します"""
+        labels = [f"le_{bound}" for bound in self.buckets] + ["inf"]
+        return {
+            "count": self._count,
+            "mean_seconds": self._total / self._count if self._count else None,
+            "p50_seconds": self.quantile(0.5),
+            "p90_seconds": self.quantile(0.9),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": dict(zip(labels, self._counts))
+        }
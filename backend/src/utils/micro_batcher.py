@@ -0,0 +1,102 @@
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+import asyncio
+import time
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """短い時間窓に届いたリクエストをまとめて1回で処理するバッチャー
+
+    最初のリクエストから max_wait_seconds 経過するか、max_batch_size 件に達した時点で
+    それまでのリクエストを process_batch に渡し、結果を順番どおりに各呼び出し元へ返します。
+    process_batch は入力と同じ件数の結果を返し、個別に失敗した要素には例外を入れます。
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[T]], Awaitable[List[Any]]],
+        max_batch_size: int = 8,
+        max_wait_seconds: float = 0.01
+    ):
+        """
+        Args:
+            process_batch: リクエストのリストを受け取り、同じ順序の結果（または例外）のリストを返すコルーチン関数
+            max_batch_size (int): 1回にまとめる最大件数
+            max_wait_seconds (float): 最初のリクエストからまとめて処理するまでの待ち時間（秒）
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: List[Tuple[T, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "full_batches": 0,
+            "failed_batches": 0,
+            "max_batch_size_seen": 0,
+            "total_wait_seconds": 0.0
+        }
+
+    async def submit(self, item: T) -> R:
+        """リクエストを追加し、バッチ処理後の結果を返します"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self._stats["requests"] += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._stats["full_batches"] += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # 待機中にキャンセルされた呼び出し元の分は処理しない
+        batch = [entry for entry in self._pending if not entry[1].done()]
+        self._pending = []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future, float]]):
+        now = time.perf_counter()
+        self._stats["batches"] += 1
+        self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+        self._stats["total_wait_seconds"] += sum(now - queued_at for _, _, queued_at in batch)
+        try:
+            results = await self.process_batch([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"バッチの結果の件数が一致しません: {len(results)} != {len(batch)}")
+        except Exception as e:
+            self._stats["failed_batches"] += 1
+            results = [e] * len(batch)
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """バッチ数・平均バッチサイズ・平均待ち時間などの統計情報を返します"""
+        batches = self._stats["batches"]
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait_seconds,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "mean_wait_seconds": self._stats["total_wait_seconds"] / requests if requests else 0.0,
+            "pending": len(self._pending)
+        }
@@ -0,0 +1,38 @@
+from typing import Any, Dict
+
+
+class RetryBudget:
+    """リクエスト数に比例したリトライの予算
+
+    リクエストごとに ratio 分のトークンを積み立て、リトライのたびに1トークンを消費します。
+    障害時にリトライがリクエスト数の一定割合を超えて増幅するのを防ぎます。
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 100.0):
+        """
+        Args:
+            ratio (float): 1リクエストあたりに積み立てるトークン（許容するリトライの割合）
+            min_tokens (float): 起動直後や低負荷時にも許容するリトライ数
+            max_tokens (float): 積み立てるトークンの上限
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._stats = {"requests": 0, "retries": 0, "exhausted": 0}
+
+    def record_request(self):
+        """リクエスト1件分のトークンを積み立てます"""
+        self._stats["requests"] += 1
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """リトライ1回分のトークンを消費します（予算がない場合はFalse）"""
+        if self._tokens < 1.0:
+            self._stats["exhausted"] += 1
+            return False
+        self._tokens -= 1.0
+        self._stats["retries"] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "tokens": round(self._tokens, 2)}
@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+import asyncio
+import time
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+AbortCheck = Callable[[Any], Optional[Any]]
+StageCallback = Callable[[str, Any], None]
+
+
+@dataclass
+class StageTiming:
+    """ステージの実行時間（実行開始からの相対秒）"""
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status: str = "skipped"  # completed / cancelled / failed / skipped
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+@dataclass
+class StageRunResult:
+    """StageRunnerの実行結果"""
+    results: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, StageTiming] = field(default_factory=dict)
+    aborted_by: Optional[str] = None
+    abort_reason: Optional[Any] = None
+
+    @property
+    def aborted(self) -> bool:
+        return self.aborted_by is not None
+
+    def timings_dict(self) -> Dict[str, Dict[str, Any]]:
+        """ログやレスポンス用にミリ秒単位のタイミングを返します"""
+        def _ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            name: {
+                "start_ms": _ms(timing.started_at),
+                "end_ms": _ms(timing.finished_at),
+                "duration_ms": _ms(timing.duration),
+                "status": timing.status
+            }
+            for name, timing in self.timings.items()
+        }
+
+
+@dataclass
+class _Stage:
+    func: StageFunc
+    depends_on: List[str]
+    abort_if: Optional[AbortCheck]
+
+
+class StageRunner:
+    """依存関係を持つ非同期ステージを、依存が揃ったものから並行に実行するランナー
+
+    各ステージは完了済みステージの結果（dict）を受け取るコルーチン関数です。
+    abort_if が結果に対して値を返した場合は、実行中のステージをキャンセルし、
+    未開始のステージを実行せずに終了します。
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, _Stage] = {}
+
+    def add_stage(
+        self,
+        name: str,
+        func: StageFunc,
+        depends_on: Sequence[str] = (),
+        abort_if: Optional[AbortCheck] = None
+    ):
+        """
+        ステージを登録します
+        Args:
+            name (str): ステージ名（結果のキー）
+            func: 完了済みステージの結果を受け取るコルーチン関数
+            depends_on: 先に完了している必要があるステージ名（登録済みであること）
+            abort_if: 結果を受け取り、以降の処理を中止する場合にその理由を返す関数
+        """
+        if name in self._stages:
+            raise ValueError(f"ステージが重複しています: {name}")
+        unknown = [dependency for dependency in depends_on if dependency not in self._stages]
+        if unknown:
+            raise ValueError(f"未登録のステージに依存しています: {name} -> {unknown}")
+        self._stages[name] = _Stage(func=func, depends_on=list(depends_on), abort_if=abort_if)
+
+    def has_stage(self, name: str) -> bool:
+        return name in self._stages
+
+    async def run(self, on_stage_complete: Optional[StageCallback] = None) -> StageRunResult:
+        """
+        全ステージを実行します（ステージの例外は他のステージをキャンセルしてから送出）
+        Args:
+            on_stage_complete: ステージが完了するたびに (ステージ名, 結果) で呼び出される関数
+        """
+        run_result = StageRunResult(timings={name: StageTiming() for name in self._stages})
+        results = run_result.results
+        start = time.perf_counter()
+        pending: Dict[asyncio.Future, str] = {}
+        started = set()
+
+        def _launch_ready():
+            for name, stage in self._stages.items():
+                if name in started or not all(dependency in results for dependency in stage.depends_on):
+                    continue
+                started.add(name)
+                run_result.timings[name].started_at = time.perf_counter() - start
+                pending[asyncio.ensure_future(stage.func(dict(results)))] = name
+
+        async def _cancel_pending():
+            for task, name in pending.items():
+                task.cancel()
+                run_result.timings[name].status = "cancelled"
+                run_result.timings[name].finished_at = time.perf_counter() - start
+            await asyncio.gather(*pending, return_exceptions=True)
+            pending.clear()
+
+        try:
+            _launch_ready()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = pending.pop(task)
+                    timing = run_result.timings[name]
+                    timing.finished_at = time.perf_counter() - start
+                    if task.exception() is not None:
+                        timing.status = "failed"
+                        raise task.exception()
+                    timing.status = "completed"
+                    results[name] = task.result()
+                    if on_stage_complete is not None:
+                        on_stage_complete(name, results[name])
+
+                    abort_if = self._stages[name].abort_if
+                    reason = abort_if(results[name]) if abort_if else None
+                    if reason is not None:
+                        run_result.aborted_by = name
+                        run_result.abort_reason = reason
+                        await _cancel_pending()
+                        return run_result
+                _launch_ready()
+            return run_result
+        except BaseException:
+            await _cancel_pending()
+            raise
@@ -0,0 +1,291 @@
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from src.utils.latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class WriteBehindQueue:
+    """書き込みをメモリ上のキューに積み、バックグラウンドのワーカーがまとめて書き込むキュー
+
+    呼び出し元は書き込みの完了を待たずに戻り、ワーカーはキューから最大 batch_size 件を
+    取り出して write_batch に渡します。失敗した場合は指数バックオフで再試行し、
+    max_attempts 回失敗したバッチも捨てずに max_backoff 待ってからキューの末尾に積み直します。
+    spool_path を指定すると、積んだ要素と書き込み済みの要素をJSON Linesで追記し、
+    プロセスが異常終了しても次回の起動時に未書き込みの要素を積み直します。
+    スプールへの追記は専用のタスクがイベントループの外（スレッドプール）でまとめて行い、
+    たまった行を1回の fsync でコミットします。追記した行が spool_compact_lines を超えると
+    未書き込みの要素だけを残すようにファイルを書き直します。
+    要素は "id" キーを持つJSONに変換できる辞書で、write_batch は冪等である必要があります。
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        max_size: int = 1000,
+        batch_size: int = 20,
+        workers: int = 2,
+        max_attempts: int = 5,
+        base_backoff: float = 0.2,
+        max_backoff: float = 5.0,
+        spool_path: Optional[str] = None,
+        spool_compact_lines: int = 10000
+    ):
+        """
+        Args:
+            write_batch: 要素のリストをまとめて書き込むコルーチン関数
+            max_size (int): キューに積める最大件数（超えた分は受け付けない）
+            batch_size (int): 1回の書き込みにまとめる最大件数
+            workers (int): 書き込みを行うワーカーの数
+            max_attempts (int): 1回のバッチの最大試行回数
+            base_backoff (float): 再試行の待ち時間の初期値（秒、試行ごとに倍）
+            max_backoff (float): 再試行の待ち時間の上限（秒）
+            spool_path (str): 未書き込みの要素を保存するファイル（省略時はメモリのみ）
+            spool_compact_lines (int): スプールを書き直すまでに追記する行数
+        """
+        self.write_batch = write_batch
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.spool_path = spool_path
+        self.spool_compact_lines = spool_compact_lines
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._closed = False
+        # 書き込み中を含む未完了の要素 id -> 積んだ時刻
+        self._inflight: Dict[str, float] = {}
+        # スプールの書き直しに使う未完了の要素 id -> 要素
+        self._pending_items: Dict[str, Dict[str, Any]] = {}
+        # スプールに追記する前の行と、前回の書き直しから追記した行数
+        self._spool_lines: List[str] = []
+        self._spool_ready: Optional[asyncio.Event] = None
+        self._spool_idle: Optional[asyncio.Event] = None
+        self._spool_writer: Optional[asyncio.Task] = None
+        self._spool_appended = 0
+        self._commit_lag = LatencyHistogram()
+        self._stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "replayed": 0,
+            "committed": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed_batches": 0,
+            "requeued": 0,
+            "spool_syncs": 0,
+            "spool_compactions": 0
+        }
+
+    async def start(self):
+        """ワーカーを起動します（スプールに残った未書き込みの要素を先に積み直す）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        if self.spool_path:
+            loop = asyncio.get_running_loop()
+            for item in await loop.run_in_executor(None, self._load_spool):
+                self._put(item, time.monotonic())
+                self._stats["replayed"] += 1
+            if self._stats["replayed"]:
+                logger.info(f"スプールから{self._stats['replayed']}件の未書き込みの要素を積み直しました")
+            self._spool_ready = asyncio.Event()
+            self._spool_idle = asyncio.Event()
+            self._spool_idle.set()
+            self._spool_writer = asyncio.create_task(self._write_spool())
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def offer(self, item: Dict[str, Any]) -> bool:
+        """
+        要素をキューに積みます
+        Returns:
+            bool: 積めた場合はTrue（未起動・停止中・満杯の場合はFalseで、呼び出し元が直接書き込む）
+        """
+        if self._queue is None or self._closed or len(self._inflight) >= self.max_size:
+            self._stats["rejected"] += 1
+            return False
+        self._append_spool({"op": "put", "item": item})
+        self._put(item, time.monotonic())
+        self._stats["enqueued"] += 1
+        return True
+
+    def _put(self, item: Dict[str, Any], enqueued_at: float):
+        self._inflight[item["id"]] = enqueued_at
+        self._pending_items[item["id"]] = item
+        self._queue.put_nowait((item, enqueued_at))
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_with_retry(self, batch: List[Tuple[Dict[str, Any], float]]):
+        items = [item for item, _ in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.write_batch(items)
+                break
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    # 捨てずにキューの末尾に積み直す（他の要素の書き込みは先に進める）
+                    self._stats["failed_batches"] += 1
+                    self._stats["requeued"] += len(items)
+                    logger.error(f"{len(items)}件の書き込みに{attempt}回失敗しました。{self.max_backoff:.2f}秒後に積み直します: {str(e)}")
+                    await asyncio.sleep(self.max_backoff)
+                    for entry in batch:
+                        self._queue.put_nowait(entry)
+                    return
+                self._stats["retries"] += 1
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+                logger.warning(f"書き込みに失敗しました（{attempt}回目）、{delay:.2f}秒後に再試行します: {str(e)}")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        now = time.monotonic()
+        for item, enqueued_at in batch:
+            self._commit_lag.record(now - enqueued_at)
+            self._inflight.pop(item["id"], None)
+            self._pending_items.pop(item["id"], None)
+            self._append_spool({"op": "ack", "id": item["id"]})
+        self._stats["batches"] += 1
+        self._stats["committed"] += len(items)
+
+    async def close(self, timeout: float = 10.0):
+        """
+        新しい要素の受け付けを止め、キューに残った要素を書き込んでからワーカーを停止します
+        時間内に書き込めなかった要素はスプールに残ります（スプールがない場合は失われます）
+        """
+        self._closed = True
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"シャットダウン時に{len(self._inflight)}件の書き込みが完了しませんでした")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._spool_writer is None:
+            if self._inflight:
+                logger.error(f"スプールがないため、書き込めなかった{len(self._inflight)}件を破棄しました")
+            return
+
+        # 追記待ちの行をすべて書き込んでから、未完了の要素だけを残すようにスプールを書き直す
+        try:
+            await asyncio.wait_for(self._spool_idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"シャットダウン時にスプールへの{len(self._spool_lines)}行の追記が完了しませんでした")
+        self._spool_writer.cancel()
+        await asyncio.gather(self._spool_writer, return_exceptions=True)
+        self._spool_writer = None
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._compact_spool, list(self._pending_items.values())
+        )
+
+    def _append_spool(self, entry: Dict[str, Any]):
+        """スプールに追記する行を積みます（追記と fsync は _write_spool がまとめて行う）"""
+        if self._spool_writer is None:
+            return
+        self._spool_lines.append(json.dumps(entry, ensure_ascii=False, default=_json_default) + "\n")
+        self._spool_idle.clear()
+        self._spool_ready.set()
+
+    async def _write_spool(self):
+        """
+        スプールへの追記を行うタスク
+        前回の追記中に積まれた行を1回の書き込みと fsync でまとめてコミットします（グループコミット）
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._spool_ready.wait()
+            self._spool_ready.clear()
+            lines, self._spool_lines = self._spool_lines, []
+            try:
+                await loop.run_in_executor(None, self._sync_spool, lines)
+            except OSError as e:
+                # 追記できなかった行は先頭に戻して再試行する
+                logger.error(f"スプールへの{len(lines)}行の追記に失敗しました: {str(e)}")
+                self._spool_lines = lines + self._spool_lines
+                await asyncio.sleep(self.max_backoff)
+                self._spool_ready.set()
+                continue
+            self._stats["spool_syncs"] += 1
+            self._spool_appended += len(lines)
+            if self._spool_appended >= self.spool_compact_lines:
+                # 書き直しの時点で未書き込みの要素を残す（この後に積まれた行は書き直しの後に追記される）
+                await loop.run_in_executor(None, self._compact_spool, list(self._pending_items.values()))
+                self._stats["spool_compactions"] += 1
+                self._spool_appended = 0
+            if not self._spool_lines:
+                self._spool_idle.set()
+
+    def _sync_spool(self, lines: List[str]):
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact_spool(self, items: List[Dict[str, Any]]):
+        """未書き込みの要素だけを残すようにスプールを書き直します"""
+        tmp_path = f"{self.spool_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps({"op": "put", "item": item}, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spool_path)
+
+    def _load_spool(self) -> List[Dict[str, Any]]:
+        """スプールから未書き込みの要素を読み込み、その要素だけを残すようにファイルを書き直します"""
+        if not os.path.exists(self.spool_path):
+            return []
+        pending: Dict[str, Dict[str, Any]] = {}
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で終了した最後の行は捨てる
+                    continue
+                if entry.get("op") == "put":
+                    pending[entry["item"]["id"]] = entry["item"]
+                elif entry.get("op") == "ack":
+                    pending.pop(entry.get("id"), None)
+
+        self._compact_spool(list(pending.values()))
+        return list(pending.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """キューの深さ・書き込みまでの遅れ（commit lag）などの統計情報を返します"""
+        now = time.monotonic()
+        oldest = min(self._inflight.values(), default=None)
+        return {
+            **self._stats,
+            "depth": len(self._inflight),
+            "max_size": self.max_size,
+            "oldest_pending_seconds": now - oldest if oldest is not None else 0.0,
+            "commit_lag": self._commit_lag.to_dict(),
+            "spool_pending_lines": len(self._spool_lines),
+            "spool_enabled": bool(self.spool_path)
+        }
@@ -1,28 +1,26 @@
 from typing import Dict, Any, Optional
 from datetime import datetime
-from src.models.analysis import AnalysisResult, QualityMetrics
+from src.models.analysis import NailAnalysisResult, ImageQualityMetrics
 
 class MockVisionService:
     """Vision AIサービスのモック"""
-    async def analyze_image_async(self, image_content: bytes) -> AnalysisResult:
+    async def analyze_image_async(self, image_content: bytes) -> NailAnalysisResult:
         """
         VisionServiceのモック.
-        常に固定のAnalysisResultを返す.
+        常に固定のNailAnalysisResultを返す.
         """
-        quality_metrics = QualityMetrics(
+        quality_metrics = ImageQualityMetrics(
             is_blurry=False,
             brightness_score=0.8,
             has_proper_lighting=True,
             has_detected_nail=True
         )
-        return AnalysisResult(
+        return NailAnalysisResult(
             risk_score=0.2,
             risk_level="LOW",
-            advice="モックのアドバイス",
             confidence_score=0.9,
-            warnings=[],
-            quality_metrics=quality_metrics,
-            created_at=datetime.now()
+            detected_colors=[],
+            quality_metrics=quality_metrics
         )
 
 class MockGeminiService:
@@ -38,20 +36,59 @@ class MockFirestoreService:
     def __init__(self):
         self.storage = {}
 
-    async def save_analysis_result(self, user_id: str, analysis_result: Dict[str, Any]):
+    async def save_analysis_result(
+        self,
+        user_id: str,
+        risk_score: float,
+        risk_level: str,
+        advice: str,
+        details: Optional[Dict[str, Any]] = None
+    ):
         if user_id not in self.storage:
             self.storage[user_id] = []
         self.storage[user_id].append({
-            **analysis_result,
+            "risk_score": risk_score,
+            "risk_level": risk_level,
+            "advice": advice,
+            "details": details,
             "created_at": datetime.now()
         })
-        return True
+        return f"mock-{len(self.storage[user_id])}"
 
-    async def get_user_history(self, user_id: str, limit: Optional[int] = 10) -> list:
-        if user_id not in self.storage:
-            return []
-        return sorted(
-            self.storage[user_id],
+    async def enqueue_analysis_result(self, *args, **kwargs):
+        return await self.save_analysis_result(*args, **kwargs)
+
+    async def start(self):
+        pass
+
+    def get_write_stats(self) -> Dict[str, Any]:
+        return {"write_behind_enabled": False}
+
+    async def close(self):
+        pass
+
+    async def get_user_history(self, user_id: str, limit: Optional[int] = 10, cursor: Optional[str] = None) -> Dict[str, Any]:
+        history = sorted(
+            self.storage.get(user_id, []),
             key=lambda x: x["created_at"],
             reverse=True
-        )[:limit] 
\ No newline at end of file
+        )
+        start = int(cursor) if cursor else 0
+        items = [
+            {
+                "id": f"mock-{len(history) - index}",
+                "created_at": entry["created_at"].isoformat(),
+                "risk_level": entry["risk_level"],
+                "risk_score": entry["risk_score"]
+            }
+            for index, entry in enumerate(history[start:start + limit], start)
+        ]
+        has_more = start + limit < len(history)
+        return {"items": items, "next_cursor": str(start + limit) if has_more else None}
+
+    async def get_analysis_detail(self, user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
+        history = self.storage.get(user_id, [])
+        index = int(history_id.split("-")[-1]) - 1 if history_id.startswith("mock-") else -1
+        if not 0 <= index < len(history):
+            return None
+        return {**history[index], "id": history_id} 
\ No newline at end of file
@@ -2,12 +2,17 @@ import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from datetime import datetime
-from ...src.routers.analysis import router
-from ...src.models.analysis import AnalysisResult, AnalysisHistory
-from ...src.models.auth import UserData
+from unittest.mock import AsyncMock, Mock, patch
+from src.models.analysis import AnalysisResult, AnalysisHistoryPage, AnalysisSummary
+from src.models.auth import UserData
+
+# ルーターは読み込み時に FirebaseService を生成するため、インポートの前に差し替える
+with patch("src.services.firebase_service.FirebaseService"):
+    from src.routers import analysis
+    from src.routers.auth import get_current_user
 
 app = FastAPI()
-app.include_router(router)
+app.include_router(analysis.router)
 client = TestClient(app)
 
 # テスト用のモックデータ
@@ -33,24 +38,30 @@ VALID_ANALYSIS_RESULT = {
 }
 
 @pytest.fixture
-def mock_firebase_service(mocker):
+def mock_firebase_service(monkeypatch):
     """FirebaseServiceのモック"""
-    mock_service = mocker.patch("src.services.firebase_service.FirebaseService")
-    mock_service.return_value.save_analysis_result.return_value = "mock_doc_id_123"
-    mock_service.return_value.get_analysis_history.return_value = AnalysisHistory(
+    mock_service = Mock()
+    mock_service.save_analysis_result = AsyncMock(return_value="mock_doc_id_123")
+    mock_service.get_analysis_history = AsyncMock(return_value=AnalysisHistoryPage(
         user_id=MOCK_USER.user_id,
-        results=[AnalysisResult(**VALID_ANALYSIS_RESULT)],
-        last_updated=datetime.utcnow().isoformat()
-    )
+        items=[AnalysisSummary(
+            id="mock_doc_id_123",
+            created_at=VALID_ANALYSIS_RESULT["created_at"],
+            risk_level="MEDIUM",
+            risk_score=0.5
+        )],
+        next_cursor="mock_cursor"
+    ))
+    mock_service.get_analysis_result = AsyncMock(return_value=AnalysisResult(**VALID_ANALYSIS_RESULT))
+    monkeypatch.setattr(analysis, "firebase_service", mock_service)
     return mock_service
 
 @pytest.fixture
-def mock_auth(mocker):
+def mock_auth():
     """認証のモック"""
-    mocker.patch(
-        "src.routers.auth.get_current_user",
-        return_value=MOCK_USER
-    )
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    yield
+    app.dependency_overrides.clear()
 
 def test_save_analysis_result_success(mock_firebase_service, mock_auth):
     """解析結果の保存（正常系）"""
@@ -92,7 +103,9 @@ def test_get_analysis_history_success(mock_firebase_service, mock_auth):
     assert response.status_code == 200
     data = response.json()
     assert data["user_id"] == MOCK_USER.user_id
-    assert len(data["results"]) == 1
+    assert len(data["items"]) == 1
+    assert set(data["items"][0]) == {"id", "created_at", "risk_level", "risk_score"}
+    assert data["next_cursor"] == "mock_cursor"
 
 def test_get_analysis_history_with_limit(mock_firebase_service, mock_auth):
     """解析履歴の取得（正常系：件数制限あり）"""
@@ -100,13 +113,52 @@ def test_get_analysis_history_with_limit(mock_firebase_service, mock_auth):
     assert response.status_code == 200
     
     # FirebaseServiceのget_analysis_historyが正しいlimitで呼ばれたことを確認
-    mock_firebase_service.return_value.get_analysis_history.assert_called_with(
+    mock_firebase_service.get_analysis_history.assert_called_with(
+        user_id=MOCK_USER.user_id,
+        limit=5,
+        cursor=None
+    )
+
+def test_get_analysis_history_with_cursor(mock_firebase_service, mock_auth):
+    """解析履歴の取得（正常系：カーソル指定）"""
+    response = client.get("/analysis/history?cursor=mock_cursor")
+    assert response.status_code == 200
+    mock_firebase_service.get_analysis_history.assert_called_with(
         user_id=MOCK_USER.user_id,
-        limit=5
+        limit=20,
+        cursor="mock_cursor"
     )
 
+@pytest.mark.parametrize("limit", [0, 101, -1])
+def test_get_analysis_history_invalid_limit(mock_firebase_service, mock_auth, limit):
+    """解析履歴の取得（異常系：範囲外の件数）"""
+    response = client.get(f"/analysis/history?limit={limit}")
+    assert response.status_code == 422
+    mock_firebase_service.get_analysis_history.assert_not_called()
+
+def test_get_analysis_history_invalid_cursor(mock_firebase_service, mock_auth):
+    """解析履歴の取得（異常系：不正なカーソル）"""
+    mock_firebase_service.get_analysis_history.side_effect = ValueError("invalid cursor")
+    response = client.get("/analysis/history?cursor=broken")
+    assert response.status_code == 400
+
+def test_get_analysis_result_detail(mock_firebase_service, mock_auth):
+    """解析結果の詳細の取得"""
+    response = client.get("/analysis/history/mock_doc_id_123")
+    assert response.status_code == 200
+    mock_firebase_service.get_analysis_result.assert_called_with(
+        user_id=MOCK_USER.user_id,
+        result_id="mock_doc_id_123"
+    )
+
+def test_get_analysis_result_not_found(mock_firebase_service, mock_auth):
+    """解析結果の詳細の取得（異常系：存在しない）"""
+    mock_firebase_service.get_analysis_result.return_value = None
+    response = client.get("/analysis/history/unknown")
+    assert response.status_code == 404
+
 def test_get_analysis_history_unauthorized():
     """解析履歴の取得（異常系：未認証）"""
     # mock_authを使用しない
     response = client.get("/analysis/history")
-    assert response.status_code == 401 
\ No newline at end of file
+    assert response.status_code == 401 
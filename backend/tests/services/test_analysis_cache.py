@@ -0,0 +1,178 @@
+import pytest
+import asyncio
+import time
+from src.services.analysis_cache import AnalysisResultCache
+
+@pytest.fixture
+def cache():
+    return AnalysisResultCache(ttl_seconds=60)
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    cache = AnalysisResultCache(ttl_seconds=60, db_path=str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def payload():
+    return {
+        "analysis": {"risk_score": 0.4, "risk_level": "medium"},
+        "nutrition_advice": {"summary": "テスト", "iron_rich_foods": ["レバー"]}
+    }
+
+def test_compute_key_is_content_addressed():
+    """同じバイト列は同じキー、異なるバイト列は異なるキーになること"""
+    assert AnalysisResultCache.compute_key(b"abc") == AnalysisResultCache.compute_key(b"abc")
+    assert AnalysisResultCache.compute_key(b"abc") != AnalysisResultCache.compute_key(b"abd")
+
+@pytest.mark.asyncio
+async def test_get_or_compute_hit(cache, payload):
+    """2回目の呼び出しでは計算せずにキャッシュを返すこと"""
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        return payload
+
+    first = await cache.get_or_compute("key", compute, request_bytes=100)
+    second = await cache.get_or_compute("key", compute, request_bytes=100)
+
+    assert calls == 1
+    assert first == second == payload
+    stats = cache.get_stats()
+    assert stats["misses"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["bytes_saved"] == 100
+    assert stats["hit_rate"] == pytest.approx(0.5)
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_computation(cache, payload):
+    """同時リクエストが1回の計算を共有すること"""
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return payload
+
+    results = await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(5)])
+
+    assert calls == 1
+    assert all(result == payload for result in results)
+    assert cache.get_stats()["coalesced"] == 4
+
+@pytest.mark.asyncio
+async def test_failed_computation_is_not_cached(cache, payload):
+    """計算に失敗した場合は待機者にも例外が伝わり、キャッシュされないこと"""
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Vision API error")
+
+    results = await asyncio.gather(
+        cache.get_or_compute("key", failing),
+        cache.get_or_compute("key", failing),
+        return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await cache.get("key") is None
+
+@pytest.mark.asyncio
+async def test_ttl_expiration(payload):
+    """TTLを過ぎたエントリは返さないこと"""
+    cache = AnalysisResultCache(ttl_seconds=0)
+    await cache.set("key", payload)
+    time.sleep(0.01)
+
+    assert await cache.get("key") is None
+
+@pytest.mark.asyncio
+async def test_memory_size_eviction(payload):
+    """メモリ層のサイズ上限を超えると古いエントリから追い出すこと"""
+    cache = AnalysisResultCache(max_memory_bytes=300)
+    for index in range(5):
+        await cache.set(f"key{index}", payload)
+
+    stats = cache.get_stats()
+    assert stats["memory_bytes"] <= 300
+    assert stats["evictions"] > 0
+    assert await cache.get("key4") == payload
+    assert await cache.get("key0") is None
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_memory_eviction(disk_cache, payload):
+    """メモリ層から消えたエントリをディスク層から取得できること"""
+    await disk_cache.set("key", payload)
+    disk_cache._memory.clear()
+    disk_cache._memory_bytes = 0
+
+    assert await disk_cache.get("key") == payload
+    assert disk_cache.get_stats()["disk_hits"] == 1
+    # ディスクヒット後はメモリ層に昇格している
+    assert "key" in disk_cache._memory
+
+@pytest.mark.asyncio
+async def test_disk_size_eviction(tmp_path, payload):
+    """ディスク層のサイズ上限を超えるとアクセスの古い順に追い出すこと"""
+    cache = AnalysisResultCache(db_path=str(tmp_path / "cache.sqlite3"), max_disk_bytes=300)
+    for index in range(5):
+        await cache.set(f"key{index}", payload)
+    cache._memory.clear()
+
+    assert await cache.get("key4") == payload
+    assert await cache.get("key0") is None
+    cache.close()
+
+@pytest.mark.asyncio
+async def test_get_counts_requests(cache, payload):
+    """get() もリクエストとして数え、ヒット率が1を超えないこと"""
+    await cache.set("key", payload)
+    await cache.get("key")
+    await cache.get("key")
+    await cache.get("missing")
+
+    stats = cache.get_stats()
+    assert stats["requests"] == 3
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+@pytest.mark.asyncio
+async def test_disk_bytes_tracked_incrementally(tmp_path, payload):
+    """ディスク層の合計サイズを増減で管理し、再起動時の集計と一致すること"""
+    path = str(tmp_path / "cache.sqlite3")
+    cache = AnalysisResultCache(db_path=path, max_disk_bytes=300)
+    for index in range(5):
+        await cache.set(f"key{index}", payload)
+    await cache.set("key4", {"small": 1})
+
+    tracked = cache.get_stats()["disk_bytes"]
+    assert 0 < tracked <= 300
+    assert tracked == cache._disk_total()
+    cache.close()
+
+    reopened = AnalysisResultCache(db_path=path)
+    assert reopened.get_stats()["disk_bytes"] == tracked
+    reopened.close()
+
+@pytest.mark.asyncio
+async def test_waiter_recomputes_when_leader_is_cancelled(cache, payload):
+    """計算中のリクエストがキャンセルされた場合、待機者が代わりに計算すること"""
+    started = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def fast():
+        return payload
+
+    leader = asyncio.ensure_future(cache.get_or_compute("key", slow))
+    await started.wait()
+    waiter = asyncio.ensure_future(cache.get_or_compute("key", fast))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await asyncio.wait_for(waiter, 1.0) == payload
+    assert await cache.get("key") == payload
@@ -0,0 +1,120 @@
+import pytest
+import time
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from src.services.duplicate_detector import NearDuplicateIndex, compute_dhash
+
+def _encode(array: np.ndarray, quality: int = 90) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(array.astype(np.uint8)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+@pytest.fixture
+def nail_image():
+    """横方向のグラデーションを持つ画像"""
+    gradient = np.linspace(60, 230, 320)
+    array = np.stack([np.tile(gradient, (240, 1))] * 3, axis=-1)
+    array[80:160, 100:220, 0] = 250
+    return array
+
+@pytest.fixture
+def index():
+    return NearDuplicateIndex(max_distance=6, window_seconds=300)
+
+def test_dhash_is_stable_for_near_identical_images(nail_image):
+    """圧縮率や微小なノイズが違っても近いハッシュになること"""
+    rng = np.random.default_rng(0)
+    noisy = np.clip(nail_image + rng.normal(0, 3, nail_image.shape), 0, 255)
+
+    first = compute_dhash(_encode(nail_image, quality=95))
+    second = compute_dhash(_encode(noisy, quality=70))
+
+    assert bin(first ^ second).count("1") <= 6
+
+def test_dhash_differs_for_different_images(nail_image):
+    """異なる画像は大きく異なるハッシュになること"""
+    flipped = nail_image[:, ::-1]
+
+    first = compute_dhash(_encode(nail_image))
+    second = compute_dhash(_encode(flipped))
+
+    assert bin(first ^ second).count("1") > 20
+
+def test_find_within_threshold(index):
+    """しきい値以内のハッシュが見つかること"""
+    index.add("user", 0b1010_1010, "key1")
+    index.add("user", 0xFFFF_0000_FFFF_0000, "key2")
+
+    assert index.find("user", 0b1010_1011) == "key1"
+    assert index.find("user", 0xFFFF_0000_FFFF_0001) == "key2"
+    assert index.find("user", 0x0F0F_0F0F_0F0F_0F0F) is None
+
+def test_find_is_scoped_per_user(index):
+    """他のユーザーのハッシュは再利用しないこと"""
+    index.add("user_a", 12345, "key")
+
+    assert index.find("user_b", 12345) is None
+
+def test_anonymous_requests_are_not_deduplicated(index):
+    """同じIPからの匿名のリクエスト同士でも解析結果を再利用しないこと"""
+    # 匿名のリクエストは owner を None として扱う（IPアドレスでは区別しない）
+    index.add(None, 12345, "first_anonymous_key")
+
+    assert index.find(None, 12345) is None
+    assert index.get_stats()["users"] == 0
+
+def test_find_ignores_entries_outside_window(index):
+    """時間幅の外にあるエントリは再利用しないこと"""
+    now = time.time()
+    index.add("user", 12345, "old", now=now - 600)
+
+    assert index.find("user", 12345, now=now) is None
+
+def test_ring_buffer_keeps_latest_entries():
+    """上限を超えると古いエントリから上書きされること"""
+    index = NearDuplicateIndex(max_distance=0, max_entries_per_user=2)
+    index.add("user", 1, "key1")
+    index.add("user", 2, "key2")
+    index.add("user", 3, "key3")
+
+    assert index.find("user", 1) is None
+    assert index.find("user", 3) == "key3"
+    assert index.get_stats()["entries"] == 2
+
+def test_memory_per_user_grows_with_entries():
+    """ユーザーごとの配列は登録件数に応じて拡張し、上限分を最初から確保しないこと"""
+    index = NearDuplicateIndex(max_entries_per_user=1024)
+    for user in range(100):
+        index.add(f"user{user}", user, f"key{user}")
+
+    ring = index._rings["user0"]
+    assert ring.hashes.nbytes + ring.timestamps.nbytes <= 16 * 8
+    assert len(ring.result_keys) == 8
+
+def test_ring_buffer_grows_then_overwrites_oldest():
+    """拡張中は全件を保持し、上限に達した後は古いエントリから上書きされること"""
+    index = NearDuplicateIndex(max_distance=0, max_entries_per_user=20)
+    for i in range(1, 26):
+        index.add("user", i, f"key{i}")
+
+    assert len(index._rings["user"].hashes) == 20
+    assert index.find("user", 5) is None
+    assert index.find("user", 6) == "key6"
+    assert index.find("user", 25) == "key25"
+    assert index.get_stats()["entries"] == 20
+
+def test_lookup_with_thousands_of_entries():
+    """数千件のエントリでも高速に検索できること"""
+    index = NearDuplicateIndex(max_distance=2, max_entries_per_user=4096)
+    rng = np.random.default_rng(0)
+    for i, value in enumerate(rng.integers(0, 2**63, size=4096, dtype=np.uint64)):
+        index.add("user", int(value), f"key{i}")
+    index.add("user", 2**64 - 1, "target")
+
+    start = time.perf_counter()
+    result = index.find("user", 2**64 - 2)
+    elapsed = time.perf_counter() - start
+
+    assert result == "target"
+    assert elapsed < 0.01
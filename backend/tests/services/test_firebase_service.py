@@ -0,0 +1,95 @@
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+from src.models.analysis import (
+    AnalysisDetails,
+    AnalysisResult,
+    ImageQualityMetrics,
+    NutritionAdvice
+)
+from src.repositories.firestore_repository import FirestoreRepository
+from src.services.firebase_service import FirebaseService
+
+ADVICE = {
+    "summary": "鉄分の摂取をお勧めします。",
+    "iron_rich_foods": ["レバー"],
+    "meal_suggestions": ["レバーの生姜焼き"],
+    "lifestyle_tips": ["規則正しい食事を心がけましょう"]
+}
+
+@pytest.fixture
+def mock_client():
+    """AsyncClientのモック"""
+    return MagicMock()
+
+@pytest.fixture
+def firebase_service(mock_client):
+    """Firebaseサービス（初期化済みのアプリとして扱い、AsyncClientをモックに差し替え）"""
+    with patch("firebase_admin._apps", {"[DEFAULT]": Mock()}):
+        return FirebaseService(repository=FirestoreRepository(client=mock_client, timeout=1.0))
+
+def mock_record(mock_client, details):
+    """解析履歴の1件の読み込み結果を設定"""
+    data = {
+        "user_id": "test_user",
+        "risk_score": 0.6,
+        "risk_level": "MEDIUM",
+        "advice": ADVICE["summary"],
+        "created_at": datetime(2024, 1, 1, 9, 0),
+        "details": details
+    }
+    snapshot = Mock(exists=True, update_time="t0", to_dict=lambda: dict(data))
+    mock_client.document.return_value.get = AsyncMock(return_value=snapshot)
+
+@pytest.mark.asyncio
+async def test_save_analysis_result_stores_details(firebase_service, mock_client):
+    """保存APIの解析結果は AnalysisDetails の形式で details に保存すること"""
+    snapshot = Mock(exists=False)
+    mock_client.document.return_value.get = AsyncMock(return_value=snapshot)
+    mock_client.collection.return_value.document.return_value = Mock(id="doc1")
+    batch = mock_client.batch.return_value
+    batch.commit = AsyncMock(return_value=[Mock(update_time="t1")] * 3)
+
+    result = AnalysisResult(
+        user_id="test_user",
+        risk_level="MEDIUM",
+        risk_score=0.6,
+        confidence_score=0.8,
+        image_quality_score=0.9,
+        nutrition_advice=ADVICE
+    )
+    assert await firebase_service.save_analysis_result(result) == "doc1"
+
+    (_, record), _ = [c.args for c in batch.create.call_args_list]
+    assert record["advice"] == ADVICE["summary"]
+    assert AnalysisDetails(**record["details"]).confidence_score == 0.8
+
+@pytest.mark.asyncio
+async def test_get_analysis_result_reads_analyze_records(firebase_service, mock_client):
+    """/analyze が保存した解析履歴も詳細APIの形式で返すこと"""
+    details = AnalysisDetails(
+        confidence_score=0.7,
+        detected_colors=[{"red": 200}],
+        quality_metrics=ImageQualityMetrics(is_blurry=False),
+        nutrition_advice=NutritionAdvice(**ADVICE)
+    )
+    mock_record(mock_client, details.model_dump())
+
+    result = await firebase_service.get_analysis_result("test_user", "doc1")
+
+    mock_client.document.assert_called_with("users/test_user/analysis_history/doc1")
+    assert result.risk_score == 0.6
+    assert result.confidence_score == 0.7
+    assert result.nutrition_advice["summary"] == ADVICE["summary"]
+    assert result.created_at == "2024-01-01T09:00:00"
+
+@pytest.mark.asyncio
+async def test_get_analysis_result_without_details(firebase_service, mock_client):
+    """details のない旧形式の解析履歴はスコアとレベルだけを返すこと"""
+    mock_record(mock_client, None)
+
+    result = await firebase_service.get_analysis_result("test_user", "doc1")
+
+    assert result.risk_level == "MEDIUM"
+    assert result.confidence_score is None
+    assert result.nutrition_advice == {}
@@ -1,177 +1,349 @@
 import pytest
-from unittest.mock import Mock, patch
-import firebase_admin
-from firebase_admin import credentials
-from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, Mock
+from datetime import datetime, timedelta
+from google.api_core import exceptions as google_exceptions
+from src.repositories.firestore_repository import FirestoreRepository
 from src.services.firestore_service import FirestoreService
 
-@pytest.fixture(scope="session", autouse=True)
-def setup_firebase():
-    """テスト用のFirebase初期化"""
-    try:
-        firebase_admin.get_app()
-    except ValueError:
-        # テスト用のモック認証情報
-        cred = credentials.ApplicationDefault()
-        firebase_admin.initialize_app(cred, {
-            'projectId': 'mock-project-id',
-        })
+@pytest.fixture
+def mock_client():
+    """AsyncClientのモック"""
+    return MagicMock()
 
 @pytest.fixture
-def firestore_service():
-    """Firestoreサービスのモック"""
-    with patch('firebase_admin.firestore.client') as mock_client:
-        service = FirestoreService()
-        service.db = mock_client.return_value
-        return service
-
-def test_save_analysis_result(firestore_service):
-    """解析結果保存のテスト"""
-    # テストデータ
-    user_id = "test_user"
-    risk_score = 0.7
-    risk_level = "HIGH"
-    advice = "テストアドバイス"
-    
-    # モックの設定
-    mock_doc_ref = Mock()
-    firestore_service.db.collection().document().collection().document.return_value = mock_doc_ref
-    
-    # 関数実行
-    doc_id = firestore_service.save_analysis_result(
-        user_id=user_id,
-        risk_score=risk_score,
-        risk_level=risk_level,
-        advice=advice
+def firestore_service(mock_client):
+    """Firestoreサービス（AsyncClientをモックに差し替え）"""
+    return FirestoreService(repository=FirestoreRepository(client=mock_client, timeout=1.5))
+
+def mock_view(mock_client, entries=None, side_effect=None):
+    """履歴ビュー（analysis_histories/{uid}）の読み込み結果を設定"""
+    snapshot = Mock(
+        exists=entries is not None,
+        update_time="t0",
+        to_dict=lambda: {"user_id": "test_user", "results": list(entries or [])}
     )
-    
-    # 検証
-    firestore_service.db.collection.assert_called_with('users')
-    mock_doc_ref.set.assert_called_once()
-
-def test_get_user_history(firestore_service):
-    """履歴取得のテスト"""
-    # テストデータ
-    user_id = "test_user"
-    test_datetime = datetime.now()
-    mock_docs = [
-        Mock(to_dict=lambda: {
+    mock_client.document.return_value.get = AsyncMock(return_value=snapshot, side_effect=side_effect)
+
+def mock_batch(mock_client, doc_ids=("new_doc_id",), side_effect=None):
+    """採番されるドキュメントID、バッチ書き込みとコミット結果を設定"""
+    mock_client.collection.return_value.document.side_effect = [Mock(id=doc_id) for doc_id in doc_ids]
+    batch = mock_client.batch.return_value
+    batch.commit = AsyncMock(
+        return_value=[Mock(update_time=f"t{i}") for i in range(1, 4)],
+        side_effect=side_effect
+    )
+    return batch
+
+@pytest.mark.asyncio
+async def test_save_analysis_result(firestore_service, mock_client):
+    """解析結果・解析回数・履歴ビューを1回のバッチでコミットすること"""
+    mock_view(mock_client)
+    batch = mock_batch(mock_client)
+
+    doc_id = await firestore_service.save_analysis_result(
+        user_id="test_user",
+        risk_score=0.7,
+        risk_level="HIGH",
+        advice="テストアドバイス"
+    )
+
+    assert doc_id == "new_doc_id"
+    mock_client.collection.assert_called_with("users/test_user/analysis_history")
+    batch.commit.assert_awaited_once_with(timeout=1.5)
+
+    # 解析履歴の作成と、履歴ビューの作成（ビューが存在しない場合）
+    (_, record), (_, view) = [c.args for c in batch.create.call_args_list]
+    mock_client.document.assert_any_call("users/test_user/analysis_history/new_doc_id")
+    assert record["risk_level"] == "HIGH"
+    assert record["details"] == {}
+    # 履歴ビューにはサマリーだけを保存する
+    assert view["results"] == [{
+        "id": "new_doc_id",
+        "created_at": record["created_at"],
+        "risk_level": "HIGH",
+        "risk_score": 0.7
+    }]
+    mock_client.document.assert_any_call("analysis_histories/test_user")
+    assert batch.set.call_args.kwargs["merge"] is True
+
+@pytest.mark.asyncio
+async def test_save_analysis_result_updates_existing_view(firestore_service, mock_client):
+    """既存の履歴ビューは更新時刻を条件に更新し、2回目以降は読み直さないこと"""
+    mock_view(mock_client, [{"id": "old", "risk_level": "LOW"}])
+    batch = mock_batch(mock_client, doc_ids=("doc1", "doc2"))
+
+    await firestore_service.save_analysis_result("test_user", 0.7, "HIGH", "テストアドバイス")
+    await firestore_service.save_analysis_result("test_user", 0.5, "MEDIUM", "テストアドバイス")
+
+    mock_client.document.return_value.get.assert_awaited_once()
+    assert batch.update.call_count == 2
+    mock_client.write_option.assert_called_with(last_update_time="t3")
+    view = batch.update.call_args.args[1]
+    assert [entry["risk_level"] for entry in view["results"]] == ["MEDIUM", "HIGH", "LOW"]
+
+@pytest.mark.asyncio
+async def test_save_analysis_result_retries_on_conflict(firestore_service, mock_client):
+    """他のリクエストが先に履歴ビューを更新した場合は読み直して再試行すること"""
+    mock_view(mock_client, [])
+    batch = mock_batch(mock_client, side_effect=[
+        google_exceptions.FailedPrecondition("stale"),
+        [Mock(update_time="t1"), Mock(update_time="t2"), Mock(update_time="t3")]
+    ])
+
+    assert await firestore_service.save_analysis_result("test_user", 0.7, "HIGH", "テストアドバイス") == "new_doc_id"
+    assert batch.commit.await_count == 2
+    assert mock_client.document.return_value.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_save_many_groups_by_user_and_skips_saved(firestore_service, mock_client):
+    """ユーザーごとに1回のバッチでコミットし、履歴ビューにあるIDは書き込まないこと"""
+    mock_view(mock_client, [{"id": "saved", "risk_level": "LOW"}])
+    batch = mock_batch(mock_client, doc_ids=())
+    records = [
+        {"id": "saved", "user_id": "test_user", "risk_level": "LOW"},
+        {"id": "a1", "user_id": "test_user", "risk_level": "MEDIUM"},
+        {"id": "a2", "user_id": "test_user", "risk_level": "HIGH"}
+    ]
+
+    await firestore_service.history_store.save_many(records)
+
+    batch.commit.assert_awaited_once()
+    created = [c.args[1] for c in batch.create.call_args_list]
+    assert [data["risk_level"] for data in created] == ["MEDIUM", "HIGH"]
+    assert all("id" not in data for data in created)
+    view = batch.update.call_args.args[1]
+    assert [entry["id"] for entry in view["results"]] == ["a2", "a1", "saved"]
+    mock_client.document.return_value.get.assert_awaited_once()
+
+    # 同じレコードの再送は書き込まない
+    await firestore_service.history_store.save_many(records)
+    batch.commit.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_enqueue_analysis_result_writes_behind(firestore_service, mock_client):
+    """書き込みを待たずにIDを返し、closeでキューに残った書き込みをコミットすること"""
+    mock_view(mock_client)
+    batch = mock_batch(mock_client, doc_ids=("doc1", "doc2"))
+    await firestore_service.start()
+
+    ids = [
+        await firestore_service.enqueue_analysis_result("test_user", 0.7, "HIGH", "テストアドバイス"),
+        await firestore_service.enqueue_analysis_result("test_user", 0.5, "MEDIUM", "テストアドバイス")
+    ]
+    assert ids == ["doc1", "doc2"]
+    batch.commit.assert_not_awaited()
+    assert firestore_service.get_write_stats()["queue"]["depth"] == 2
+
+    await firestore_service.close()
+
+    # 同じユーザーの2件は1回のバッチでコミットされる
+    batch.commit.assert_awaited_once()
+    assert batch.create.call_count == 3
+    stats = firestore_service.get_write_stats()["queue"]
+    assert stats["depth"] == 0 and stats["committed"] == 2
+    mock_client.close.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_enqueue_analysis_result_without_queue(firestore_service, mock_client):
+    """キューが起動していない場合はその場で保存すること"""
+    mock_view(mock_client)
+    batch = mock_batch(mock_client)
+
+    assert await firestore_service.enqueue_analysis_result("test_user", 0.7, "HIGH", "テストアドバイス") == "new_doc_id"
+    batch.commit.assert_awaited_once()
+
+def mock_page_query(mock_client, docs):
+    """select().order_by().start_after().limit().get() が返すスナップショットを設定"""
+    query = MagicMock()
+    for method in ("select", "order_by", "start_after", "limit"):
+        getattr(query, method).return_value = query
+    query.get = AsyncMock(return_value=[Mock(id=doc_id, to_dict=lambda data=data: dict(data)) for doc_id, data in docs])
+    mock_client.collection.return_value = query
+    return query
+
+def make_summaries(count, start=0):
+    return [
+        {
+            "id": f"test_doc_id_{i}",
             "risk_score": 0.7,
             "risk_level": "HIGH",
-            "advice": "テストアドバイス",
-            "created_at": test_datetime
-        }, id="test_doc_id")
+            "created_at": datetime(2024, 1, 1) - timedelta(minutes=i)
+        }
+        for i in range(start, start + count)
     ]
-    
-    # モックの設定
-    mock_collection_ref = Mock()
-    mock_collection_ref.order_by().limit().stream.return_value = mock_docs
-    firestore_service.db.collection().document().collection.return_value = mock_collection_ref
-    
-    # 関数実行
-    history = firestore_service.get_user_history(user_id, limit=5)
-    
-    # 検証
-    assert len(history) == 1
-    assert history[0]["risk_level"] == "HIGH"
-    assert "created_at" in history[0]
-    assert history[0]["id"] == "test_doc_id"
-
-def test_get_user_history_large_data(firestore_service):
-    """大量データ（50件以上）の履歴取得テスト"""
-    # テストデータ
-    user_id = "test_user"
+
+@pytest.mark.asyncio
+async def test_get_user_history(firestore_service, mock_client):
+    """最初のページは履歴ビューの1回の読み込みでサマリーだけを返すこと"""
     test_datetime = datetime.now()
-    mock_docs = [
-        Mock(to_dict=lambda: {
+    mock_view(mock_client, [
+        {
+            "id": "test_doc_id",
             "risk_score": 0.7,
             "risk_level": "HIGH",
-            "advice": f"テストアドバイス{i}",
-            "created_at": test_datetime
-        }, id=f"test_doc_id_{i}")
-        for i in range(60)  # 60件のテストデータ
-    ]
-    
-    # モックの設定
-    mock_collection_ref = Mock()
-    mock_collection_ref.order_by().limit().stream.return_value = mock_docs[:50]  # 最大50件に制限
-    firestore_service.db.collection().document().collection.return_value = mock_collection_ref
-    
-    # 関数実行
-    history = firestore_service.get_user_history(user_id, limit=100)  # 100件リクエスト
-    
-    # 検証
-    assert len(history) == 50  # 最大50件に制限されていることを確認
-    assert all("test_doc_id" in item["id"] for item in history)
-    assert all(isinstance(item["created_at"], str) for item in history)
-
-def test_get_user_history_invalid_user(firestore_service):
+            "advice": "テストアドバイス",
+            "created_at": test_datetime,
+            "details": {"detected_colors": []}
+        }
+    ])
+
+    page = await firestore_service.get_user_history("test_user", limit=5)
+
+    assert page["items"] == [{
+        "id": "test_doc_id",
+        "created_at": test_datetime.isoformat(),
+        "risk_level": "HIGH",
+        "risk_score": 0.7
+    }]
+    assert page["next_cursor"] is None
+    mock_client.document.assert_called_with("analysis_histories/test_user")
+    mock_client.document.return_value.get.assert_awaited_once_with(timeout=1.5)
+    mock_client.collection.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_legacy_view_entries_are_skipped(firestore_service, mock_client):
+    """IDを持たない旧形式の履歴ビューの要素は一覧に含めず、次の書き込みで取り除くこと"""
+    legacy = {"user_id": "test_user", "risk_level": "LOW", "created_at": "2024-01-01T00:00:00"}
+    mock_view(mock_client, [legacy, *make_summaries(1)])
+
+    page = await firestore_service.get_user_history("test_user", limit=5)
+    assert [item["id"] for item in page["items"]] == ["test_doc_id_0"]
+
+    batch = mock_batch(mock_client)
+    await firestore_service.save_analysis_result("test_user", 0.7, "HIGH", "テストアドバイス")
+    view = batch.update.call_args.args[1]
+    assert [entry["id"] for entry in view["results"]] == ["new_doc_id", "test_doc_id_0"]
+
+@pytest.mark.asyncio
+async def test_get_user_history_pages_with_cursor(firestore_service, mock_client):
+    """カーソルの直後からサマリーのフィールドだけをページの件数分読み込むこと"""
+    mock_view(mock_client, make_summaries(50))
+
+    first = await firestore_service.get_user_history("test_user", limit=10)
+    assert [item["id"] for item in first["items"]] == [f"test_doc_id_{i}" for i in range(10)]
+    assert all(isinstance(item["created_at"], str) for item in first["items"])
+    assert first["next_cursor"]
+
+    query = mock_page_query(mock_client, [(item.pop("id"), item) for item in make_summaries(11, start=10)])
+    second = await firestore_service.get_user_history("test_user", limit=10, cursor=first["next_cursor"])
+
+    assert [item["id"] for item in second["items"]] == [f"test_doc_id_{i}" for i in range(10, 20)]
+    assert second["next_cursor"]
+    query.select.assert_called_once_with(["created_at", "risk_level", "risk_score"])
+    query.start_after.assert_called_once_with({
+        "created_at": datetime(2024, 1, 1) - timedelta(minutes=9),
+        "__name__": "test_doc_id_9"
+    })
+    query.limit.assert_called_once_with(11)
+    mock_client.document.return_value.get.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_get_user_history_last_page(firestore_service, mock_client):
+    """履歴ビューより多い件数は検索で取得し、最後のページではカーソルを返さないこと"""
+    mock_view(mock_client, make_summaries(50))
+    summaries = make_summaries(60)
+    mock_page_query(mock_client, [(item.pop("id"), item) for item in summaries])
+
+    page = await firestore_service.get_user_history("test_user", limit=100)
+
+    assert len(page["items"]) == 60
+    assert page["next_cursor"] is None
+
+@pytest.mark.asyncio
+async def test_get_user_history_invalid_cursor(firestore_service, mock_client):
+    """不正なカーソルはValueErrorになること"""
+    with pytest.raises(ValueError):
+        await firestore_service.get_user_history("test_user", cursor="broken!")
+
+@pytest.mark.asyncio
+async def test_get_user_history_invalid_user(firestore_service, mock_client):
     """無効なユーザーIDでの履歴取得テスト"""
-    # モックの設定
-    mock_collection_ref = Mock()
-    mock_collection_ref.order_by().limit().stream.return_value = []  # 空の結果を返す
-    firestore_service.db.collection().document().collection.return_value = mock_collection_ref
-    
-    # 関数実行
-    history = firestore_service.get_user_history("invalid_user_id")
-    
-    # 検証
-    assert len(history) == 0  # 空のリストが返されることを確認
-
-def test_save_analysis_result_invalid_data(firestore_service):
+    mock_view(mock_client)
+
+    page = await firestore_service.get_user_history("invalid_user_id")
+
+    assert page == {"items": [], "next_cursor": None}  # 空のリストが返されることを確認
+
+@pytest.mark.asyncio
+async def test_get_analysis_detail(firestore_service, mock_client):
+    """IDを指定して details を含む解析履歴の全体を取得すること"""
+    test_datetime = datetime.now()
+    mock_client.document.return_value.get = AsyncMock(return_value=Mock(
+        exists=True,
+        update_time="t1",
+        to_dict=lambda: {"risk_level": "HIGH", "created_at": test_datetime, "details": {"detected_colors": []}}
+    ))
+
+    detail = await firestore_service.get_analysis_detail("test_user", "test_doc_id")
+
+    assert detail["id"] == "test_doc_id"
+    assert detail["created_at"] == test_datetime.isoformat()
+    assert detail["details"] == {"detected_colors": []}
+    mock_client.document.assert_called_with("users/test_user/analysis_history/test_doc_id")
+
+@pytest.mark.asyncio
+async def test_save_analysis_result_invalid_data(firestore_service, mock_client):
     """不正なデータ形式での保存リクエストテスト"""
-    # テストデータ（無効な値を含む）
-    user_id = ""  # 空のユーザーID
-    risk_score = 2.0  # 範囲外のスコア
-    risk_level = "INVALID"  # 無効なリスクレベル
-    advice = None  # 無効なアドバイス
-    
-    # モックの設定
-    mock_doc_ref = Mock()
-    mock_doc_ref.set.side_effect = ValueError("Invalid data")
-    firestore_service.db.collection().document().collection().document.return_value = mock_doc_ref
-    
-    # 関数実行と検証
+    mock_view(mock_client)
+    mock_batch(mock_client, side_effect=ValueError("Invalid data"))
+
     with pytest.raises(ValueError) as exc_info:
-        firestore_service.save_analysis_result(
-            user_id=user_id,
-            risk_score=risk_score,
-            risk_level=risk_level,
-            advice=advice
+        await firestore_service.save_analysis_result(
+            user_id="",  # 空のユーザーID
+            risk_score=2.0,  # 範囲外のスコア
+            risk_level="INVALID",  # 無効なリスクレベル
+            advice=None  # 無効なアドバイス
         )
     assert "Invalid data" in str(exc_info.value)
 
-def test_save_analysis_result_firestore_error(firestore_service):
+@pytest.mark.asyncio
+async def test_save_analysis_result_firestore_error(firestore_service, mock_client):
     """Firestore接続エラー時のテスト"""
-    # テストデータ
-    user_id = "test_user"
-    risk_score = 0.7
-    risk_level = "HIGH"
-    advice = "テストアドバイス"
-    
-    # モックの設定
-    mock_doc_ref = Mock()
-    mock_doc_ref.set.side_effect = Exception("Firestore connection error")
-    firestore_service.db.collection().document().collection().document.return_value = mock_doc_ref
-    
-    # 関数実行と検証
+    mock_view(mock_client)
+    batch = mock_batch(mock_client, side_effect=Exception("Firestore connection error"))
+
     with pytest.raises(Exception) as exc_info:
-        firestore_service.save_analysis_result(
-            user_id=user_id,
-            risk_score=risk_score,
-            risk_level=risk_level,
-            advice=advice
+        await firestore_service.save_analysis_result(
+            user_id="test_user",
+            risk_score=0.7,
+            risk_level="HIGH",
+            advice="テストアドバイス",
+            details={"analysis_result": {"risk_score": 0.7}}
         )
     assert "Firestore connection error" in str(exc_info.value)
+    assert batch.create.call_args_list[0].args[1]["details"] == {"analysis_result": {"risk_score": 0.7}}
 
-def test_get_user_history_with_transaction_error(firestore_service):
+@pytest.mark.asyncio
+async def test_get_user_history_with_transaction_error(firestore_service, mock_client):
     """トランザクション失敗時の履歴取得テスト"""
-    # モックの設定
-    mock_collection_ref = Mock()
-    mock_collection_ref.order_by().limit().stream.side_effect = Exception("Transaction failed")
-    firestore_service.db.collection().document().collection.return_value = mock_collection_ref
-    
-    # 関数実行と検証
+    mock_view(mock_client, side_effect=Exception("Transaction failed"))
+
     with pytest.raises(Exception) as exc_info:
-        firestore_service.get_user_history("test_user")
-    assert "Transaction failed" in str(exc_info.value) 
\ No newline at end of file
+        await firestore_service.get_user_history("test_user")
+    assert "Transaction failed" in str(exc_info.value)
+
+@pytest.mark.asyncio
+async def test_repository_get_and_close(mock_client):
+    """存在しないドキュメントはNoneを返し、closeでクライアントを閉じること"""
+    repository = FirestoreRepository(client=mock_client, timeout=2.0)
+    mock_client.document.return_value.get = AsyncMock(return_value=Mock(exists=False))
+
+    assert await repository.get("users/unknown") is None
+    mock_client.document.assert_called_with("users/unknown")
+
+    await repository.close()
+    mock_client.close.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_repository_commit_returns_update_times(mock_client):
+    """バッチのコミットは1回の呼び出しで行い、書き込みごとの更新時刻を返すこと"""
+    repository = FirestoreRepository(client=mock_client, timeout=2.0)
+    batch = mock_client.batch.return_value
+    batch.commit = AsyncMock(return_value=[Mock(update_time="t1"), Mock(update_time="t2")])
+
+    assert await repository.commit(repository.batch()) == ["t1", "t2"]
+    batch.commit.assert_awaited_once_with(timeout=2.0)
+
+    repository.precondition("t2")
+    mock_client.write_option.assert_called_once_with(last_update_time="t2")
+    assert repository.get_stats() == {"operations": {"commit": 1}, "total": 1}
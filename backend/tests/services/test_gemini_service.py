@@ -1,8 +1,10 @@
+import asyncio
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 import json
 import time
-from src.services.gemini_service import GeminiService, NutritionAdvice, CacheKey, ErrorResponse
+from src.services.gemini_service import GeminiService, NutritionAdvice, CacheKey, ErrorResponse, build_advice_response_schema
+from src.utils.retry_budget import RetryBudget
 
 @pytest.fixture
 def gemini_service():
@@ -117,8 +119,7 @@ def test_create_prompt_risk_levels(gemini_service, risk_level):
 @pytest.mark.asyncio
 async def test_cache_hit(gemini_service, mock_response):
     """キャッシュヒットのテスト"""
-    with patch.object(gemini_service, '_call_gemini_api') as mock_call, \
-         patch.object(gemini_service, '_create_error_response') as mock_error:
+    with patch.object(gemini_service, '_call_gemini_api') as mock_call:
         mock_call.return_value = json.dumps(mock_response)
         
         # 1回目の呼び出し（キャッシュなし）
@@ -178,8 +179,7 @@ async def test_cache_expiration(gemini_service, mock_response):
 @pytest.mark.asyncio
 async def test_cache_cleanup(gemini_service, mock_response):
     """キャッシュクリーンアップのテスト"""
-    with patch.object(gemini_service, '_call_gemini_api') as mock_call, \
-         patch.object(gemini_service, '_create_error_response') as mock_error:
+    with patch.object(gemini_service, '_call_gemini_api') as mock_call:
         mock_call.return_value = json.dumps(mock_response)
         
         # キャッシュTTLとクリーンアップ間隔を一時的に設定
@@ -250,4 +250,359 @@ async def test_cache_key_creation(gemini_service):
     
     # 異なる内容でのキー生成
     key3 = CacheKey.create("MEDIUM", ["警告1"])
-    assert key1 != key3  # リスクレベルが異なる場合は異なるキー 
\ No newline at end of file
+    assert key1 != key3  # リスクレベルが異なる場合は異なるキー 
+@pytest.fixture
+def advice_gemini_service():
+    # Gemini呼び出しの経路を検証するため、ローカル生成で応答するリスクレベルはなしにする
+    with patch('vertexai.init'), \
+         patch('src.services.gemini_service.GenerativeModel'), \
+         patch.dict('os.environ', {"LOCAL_ADVICE_RISK_LEVELS": ""}):
+        yield GeminiService(project_id="test-project", location="us-central1")
+
+@pytest.mark.asyncio
+async def test_advice_cache_quantizes_confidence(advice_gemini_service, mock_response):
+    """同じ信頼度の区間・正規化後に同じ警告のリクエストはキャッシュから返すこと"""
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.return_value = json.dumps(mock_response)
+
+        first = await advice_gemini_service.generate_advice(
+            risk_level="LOW", confidence_score=0.83, warnings=["暗い", "ぼやけ"]
+        )
+        second = await advice_gemini_service.generate_advice(
+            risk_level="low", confidence_score=0.86, warnings=[" ぼやけ", "暗い", "暗い"]
+        )
+        third = await advice_gemini_service.generate_advice(
+            risk_level="low", confidence_score=0.95, warnings=["暗い", "ぼやけ"]
+        )
+
+    assert mock_call.call_count == 2
+    assert not first.cached
+    assert second.cached
+    assert second.summary == first.summary
+    assert not third.cached
+    stats = advice_gemini_service.get_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+@pytest.mark.asyncio
+async def test_advice_cache_single_flight(advice_gemini_service, mock_response):
+    """同時に発生した同一入力のキャッシュミスは1回の呼び出しを共有すること"""
+    async def slow_call(prompt, on_chunk=None, model_name=None):
+        await asyncio.sleep(0.05)
+        return json.dumps(mock_response)
+
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=slow_call) as mock_call:
+        results = await asyncio.gather(*[
+            advice_gemini_service.generate_advice(risk_level="HIGH") for _ in range(5)
+        ])
+
+    assert mock_call.call_count == 1
+    assert all(result.summary == mock_response["summary"] for result in results)
+    assert advice_gemini_service.get_cache_stats()["coalesced"] == 4
+
+@pytest.mark.asyncio
+async def test_advice_cache_ttl_and_lru(advice_gemini_service, mock_response):
+    """期限切れのエントリは再生成し、上限を超えたエントリは古い順に追い出すこと"""
+    advice_gemini_service._cache_max_entries = 2
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.return_value = json.dumps(mock_response)
+        for risk_level in ("low", "medium", "high"):
+            await advice_gemini_service.generate_advice(risk_level=risk_level)
+        assert advice_gemini_service.get_cache_stats()["evictions"] == 1
+
+        # タイムスタンプは生成時刻（インポート時刻ではない）
+        entry = next(iter(advice_gemini_service._advice_cache.values()))
+        assert time.time() - entry.timestamp < 5
+        advice_gemini_service._cache_ttl = 0
+        await asyncio.sleep(0.01)
+        await advice_gemini_service.generate_advice(risk_level="high")
+
+    assert mock_call.call_count == 4
+
+@pytest.mark.asyncio
+async def test_advice_generation_failure_is_not_cached(advice_gemini_service, mock_response):
+    """生成に失敗した場合はローカル生成のアドバイスで代替し、キャッシュしないこと"""
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.return_value = "invalid json"
+        fallback = await advice_gemini_service.generate_advice(risk_level="medium")
+        mock_call.return_value = json.dumps(mock_response)
+        result = await advice_gemini_service.generate_advice(risk_level="medium")
+
+    assert fallback.error_type == "GENERATION_ERROR"
+    assert len(fallback.iron_rich_foods) == 5
+    assert result.summary == mock_response["summary"]
+    assert result.error_type is None
+    assert mock_call.call_count == 3  # 失敗時は1回再生成される
+
+@pytest.mark.asyncio
+async def test_prewarmed_table_serves_without_gemini_call(advice_gemini_service, mock_response):
+    """事前生成したテーブルのアドバイスはGeminiを呼び出さずにパターンを順に返すこと"""
+    advice_gemini_service._prewarm_variants = 2
+    advice_gemini_service._prewarm_confidences = [None]
+    summaries = iter(["パターン1", "パターン2"] * 3)
+
+    async def varied_call(prompt, on_chunk=None, model_name=None):
+        return json.dumps({**mock_response, "summary": next(summaries)})
+
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=varied_call) as mock_call:
+        await advice_gemini_service.prewarm_advice_table()
+        assert mock_call.call_count == 6  # 3リスクレベル × 2パターン
+
+        first = await advice_gemini_service.generate_advice(risk_level="high")
+        second = await advice_gemini_service.generate_advice(risk_level="high")
+        assert mock_call.call_count == 6
+        assert {first.summary, second.summary} == {"パターン1", "パターン2"}
+        assert first.cached
+
+        # 警告を含む入力はテーブルの対象外
+        await advice_gemini_service.generate_advice(risk_level="high", warnings=["画像が暗すぎます"])
+        assert mock_call.call_count == 7
+
+    stats = advice_gemini_service.get_cache_stats()
+    assert stats["prewarmed_hits"] == 2
+    assert stats["prewarm"]["refreshes"] == 1
+
+@pytest.mark.asyncio
+async def test_generate_advice_streams_chunks(advice_gemini_service, mock_response):
+    """on_chunkを指定した場合はストリーミングで受信したテキストを順に渡すこと"""
+    text = json.dumps(mock_response, ensure_ascii=False)
+    chunks = [Mock(text=text[i:i + 20]) for i in range(0, len(text), 20)]
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    advice_gemini_service.model.generate_content_async = AsyncMock(return_value=stream())
+    received = []
+
+    result = await advice_gemini_service.generate_advice(risk_level="medium", on_chunk=received.append)
+
+    assert advice_gemini_service.model.generate_content_async.call_args.kwargs["stream"] is True
+    assert "".join(received) == text
+    assert result.summary == mock_response["summary"]
+
+@pytest.mark.asyncio
+async def test_streamed_parse_failure_is_retried_without_streaming(advice_gemini_service, mock_response):
+    """ストリーミング中にパースに失敗した場合、再生成のチャンクは送らずに最終結果だけを返すこと"""
+    invalid = json.dumps({**mock_response, "iron_rich_foods": []}, ensure_ascii=False)
+    calls = []
+
+    async def call(prompt, on_chunk=None, model_name=None, response_schema=None):
+        calls.append(on_chunk)
+        if on_chunk is not None:
+            on_chunk(invalid)
+            return invalid
+        return json.dumps(mock_response)
+
+    received = []
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=call):
+        result = await advice_gemini_service.generate_advice(risk_level="medium", on_chunk=received.append)
+
+    assert calls[0] is not None and calls[1] is None
+    assert received == [invalid]
+    assert result.summary == mock_response["summary"]
+    assert advice_gemini_service.get_generation_stats()["parse_failures"] == 1
+
+def test_response_schema_is_derived_from_model():
+    """response_schemaはNutritionAdviceのGemini生成対象フィールドから作られること"""
+    schema = build_advice_response_schema()
+    assert schema["required"] == ["summary", "iron_rich_foods", "meal_suggestions", "lifestyle_tips"]
+    assert schema["properties"]["summary"] == {"type": "string"}
+    assert schema["properties"]["iron_rich_foods"] == {"type": "array", "items": {"type": "string"}}
+
+@pytest.mark.asyncio
+async def test_schema_mode_requests_json_and_validates(advice_gemini_service, mock_response):
+    """schemaモードではJSON出力を指定し、レスポンスをモデルで直接検証すること"""
+    advice_gemini_service.model.generate_content_async = AsyncMock(return_value=Mock(text=json.dumps(mock_response)))
+
+    result = await advice_gemini_service.generate_advice(risk_level="high", warnings=["画像が暗すぎます"])
+
+    config = advice_gemini_service.model.generate_content_async.call_args.kwargs["generation_config"]
+    assert config.to_dict()["response_mime_type"] == "application/json"
+    assert "response_schema" in config.to_dict()
+    assert result.iron_rich_foods == mock_response["iron_rich_foods"]
+    assert result.warnings == ["画像が暗すぎます"]
+
+@pytest.mark.asyncio
+async def test_parse_failure_is_retried_within_budget(advice_gemini_service, mock_response):
+    """検証に失敗した出力はリトライ予算の範囲で再生成すること"""
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.side_effect = [
+            json.dumps({**mock_response, "iron_rich_foods": []}),
+            json.dumps(mock_response)
+        ]
+        result = await advice_gemini_service.generate_advice(risk_level="low")
+
+    assert isinstance(result, NutritionAdvice)
+    stats = advice_gemini_service.get_generation_stats()
+    assert stats["parse_failures"] == 1
+    assert stats["retry_budget"]["retries"] == 1
+
+@pytest.mark.asyncio
+async def test_retry_budget_limits_retries(advice_gemini_service):
+    """リトライ予算を使い切った場合は再生成しないこと"""
+    advice_gemini_service._retry_budget = RetryBudget(ratio=0.0, min_tokens=1.0)
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.return_value = "invalid json"
+        for risk_level in ("low", "medium", "high"):
+            advice = await advice_gemini_service.generate_advice(risk_level=risk_level)
+            assert advice.error_type == "GENERATION_ERROR"
+
+    assert mock_call.call_count == 4  # 最初の1件だけ再生成
+    assert advice_gemini_service.get_generation_stats()["retry_budget"]["exhausted"] == 2
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged(advice_gemini_service, mock_response):
+    """直近のp90を超えた呼び出しには2本目を投げ、先に返った方を採用すること"""
+    for _ in range(advice_gemini_service._hedge_min_samples):
+        advice_gemini_service._latency.record(0.01)
+    calls = []
+
+    async def call(prompt, on_chunk=None, model_name=None):
+        calls.append(prompt)
+        if len(calls) == 1:
+            await asyncio.sleep(1.0)
+        return json.dumps(mock_response)
+
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=call):
+        start = asyncio.get_event_loop().time()
+        result = await advice_gemini_service.generate_advice(risk_level="high")
+        elapsed = asyncio.get_event_loop().time() - start
+
+    assert isinstance(result, NutritionAdvice)
+    assert len(calls) == 2
+    assert elapsed < 0.5
+    hedging = advice_gemini_service.get_generation_stats()["hedging"]
+    assert hedging["hedged"] == 1
+    assert hedging["hedge_wins"] == 1
+
+@pytest.mark.asyncio
+async def test_cancelled_call_cancels_rpc_and_releases_slot(advice_gemini_service):
+    """ヘッジや期限切れで呼び出しをキャンセルした場合、RPC自体もキャンセルしてから枠を解放すること"""
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow_rpc(prompt, generation_config=None, stream=False):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    advice_gemini_service.model.generate_content_async = slow_rpc
+    task = asyncio.create_task(advice_gemini_service._call_gemini_api("prompt"))
+    await started.wait()
+    assert advice_gemini_service._limiter.get_stats()["in_flight"] == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert cancelled.is_set()
+    assert advice_gemini_service._limiter.get_stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_deadline_returns_timeout_advice(advice_gemini_service):
+    """期限までに生成できない場合は定型アドバイスを返し、キャッシュしないこと"""
+    async def slow_call(prompt, on_chunk=None, model_name=None):
+        await asyncio.sleep(1.0)
+
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=slow_call):
+        deadline = asyncio.get_event_loop().time() + 0.05
+        result = await advice_gemini_service.generate_advice(
+            risk_level="high", warnings=["暗い"], deadline=deadline
+        )
+
+    assert result.error_type == "TIMEOUT_ERROR"
+    assert result.warnings == ["暗い"]
+    assert len(result.meal_suggestions) == 3
+    assert advice_gemini_service.get_generation_stats()["hedging"]["timeouts"] == 1
+    assert advice_gemini_service.get_cache_stats()["entries"] == 0
+
+@pytest.mark.asyncio
+async def test_parse_failure_escalates_to_large_model(advice_gemini_service, mock_response):
+    """小さいモデルの出力をパースできなかった場合は大きいモデルで再生成すること"""
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        mock_call.side_effect = ["invalid json", json.dumps(mock_response)]
+        result = await advice_gemini_service.generate_advice(risk_level="low")
+
+    assert isinstance(result, NutritionAdvice)
+    models = [call.kwargs["model_name"] for call in mock_call.call_args_list]
+    assert models == ["gemini-1.5-flash", "gemini-1.5-pro"]
+    routing = advice_gemini_service.get_generation_stats()["routing"]
+    assert routing["decisions"] == {"default": 1, "retry": 1}
+
+@pytest.mark.asyncio
+async def test_low_risk_is_served_locally(mock_response):
+    """ローカル生成の対象のリスクレベルはGeminiを呼び出さずに応答すること"""
+    with patch('vertexai.init'), \
+         patch('src.services.gemini_service.GenerativeModel'), \
+         patch.dict('os.environ', {"LOCAL_ADVICE_RISK_LEVELS": "low"}):
+        service = GeminiService(project_id="test-project", location="us-central1")
+
+    with patch.object(service, '_call_gemini_api') as mock_call:
+        mock_call.return_value = json.dumps(mock_response)
+        low = await service.generate_advice(risk_level="LOW", confidence_score=0.4, warnings=["暗い"])
+        high = await service.generate_advice(risk_level="high")
+
+    assert mock_call.call_count == 1
+    assert low.error_type is None
+    assert low.warnings == ["暗い"]
+    assert low.summary.startswith("貧血リスクは低めです")
+    assert high.summary == mock_response["summary"]
+    assert service.get_generation_stats()["local"]["served"] == 1
+
+@pytest.mark.asyncio
+async def test_overload_falls_back_to_local_advice(advice_gemini_service):
+    """Gemini呼び出しの待ち行列が長い場合はローカル生成で応答すること"""
+    advice_gemini_service._local_fallback_queue_depth = 0
+    with patch.object(advice_gemini_service, '_call_gemini_api') as mock_call:
+        advice = await advice_gemini_service.generate_advice(risk_level="high")
+
+    assert mock_call.call_count == 0
+    assert advice.error_type == "OVERLOADED"
+    assert advice_gemini_service.get_generation_stats()["local"]["OVERLOADED"] == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_micro_batched(advice_gemini_service, mock_response):
+    """バッチを有効にした場合は同時のリクエストを1回の呼び出しで生成し、各呼び出し元に返すこと"""
+    advice_gemini_service._batch_enabled = True
+    prompts = []
+
+    async def batch_call(prompt, on_chunk=None, model_name=None, response_schema=None, max_output_tokens=None):
+        prompts.append(prompt)
+        assert response_schema["type"] == "array"
+        return json.dumps([{**mock_response, "summary": f"要約{i}"} for i in range(3)])
+
+    with patch.object(advice_gemini_service, '_call_gemini_api', side_effect=batch_call):
+        results = await asyncio.gather(
+            advice_gemini_service.generate_advice(risk_level="medium", warnings=["暗い"]),
+            advice_gemini_service.generate_advice(risk_level="medium"),
+            advice_gemini_service.generate_advice(risk_level="medium", confidence_score=0.9)
+        )
+
+    assert len(prompts) == 1
+    assert "[3] 貧血リスクは中程度です（信頼度: 90%）" in prompts[0]
+    assert [result.summary for result in results] == ["要約0", "要約1", "要約2"]
+    assert results[0].warnings == ["暗い"]
+    batching = advice_gemini_service.get_generation_stats()["batching"]
+    assert batching["models"]["gemini-1.5-flash"]["max_batch_size_seen"] == 3
+
+@pytest.mark.asyncio
+async def test_batch_output_tokens_scale_with_batch_size(advice_gemini_service, mock_response):
+    """バッチの出力トークンの上限は件数に比例し、件数は出力トークンの上限に収まるよう制限されること"""
+    advice_gemini_service._batch_enabled = True
+    advice_gemini_service._max_output_tokens_limit = 4096
+    model = advice_gemini_service.model
+    model.generate_content_async = AsyncMock(return_value=Mock(
+        text=json.dumps([mock_response] * 3, ensure_ascii=False)
+    ))
+
+    await asyncio.gather(*[
+        advice_gemini_service.generate_advice(risk_level="medium", confidence_score=score)
+        for score in (0.1, 0.5, 0.9)
+    ])
+
+    config = model.generate_content_async.call_args.kwargs["generation_config"]
+    assert config.to_dict()["max_output_tokens"] == advice_gemini_service.max_tokens * 3
+    assert advice_gemini_service._get_batcher("gemini-1.5-flash").max_batch_size == 4
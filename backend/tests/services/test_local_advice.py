@@ -0,0 +1,51 @@
+import pytest
+from src.services.local_advice import (
+    FoodItem, LocalAdviceEngine, MealTemplate, LOW_CONFIDENCE_TIP
+)
+
+
+@pytest.fixture
+def engine():
+    return LocalAdviceEngine()
+
+
+@pytest.mark.parametrize("month", range(1, 13))
+def test_generates_full_advice_every_month(engine, month):
+    advice = engine.generate("medium", month=month)
+
+    assert advice["summary"].startswith("貧血リスクは中程度です")
+    assert len(advice["iron_rich_foods"]) == 5
+    assert len(advice["meal_suggestions"]) == 3
+    assert len(advice["lifestyle_tips"]) == 3
+
+
+def test_is_deterministic_and_seasonal(engine):
+    assert engine.generate("low", 0.8, month=4) == engine.generate("low", 0.8, month=4)
+
+    spring = engine.generate("low", month=4)
+    autumn = engine.generate("low", month=10)
+    assert any(food.startswith("あさり") for food in spring["iron_rich_foods"])
+    assert not any(food.startswith("あさり") for food in autumn["iron_rich_foods"])
+
+
+def test_high_risk_prefers_heme_iron(engine):
+    foods = engine.generate("high", month=10)["iron_rich_foods"]
+
+    assert foods[:3] == [
+        "豚レバー（鉄分 13.0mg/100g）",
+        "鶏レバー（鉄分 9.0mg/100g）",
+        "いわし（鉄分 2.1mg/100g）"
+    ]
+
+
+def test_low_confidence_adds_photo_tip(engine):
+    assert LOW_CONFIDENCE_TIP in engine.generate("low", 0.3, month=1)["lifestyle_tips"]
+    assert LOW_CONFIDENCE_TIP not in engine.generate("low", 0.9, month=1)["lifestyle_tips"]
+
+
+def test_meal_with_unknown_food_is_rejected():
+    with pytest.raises(ValueError):
+        LocalAdviceEngine(
+            foods=(FoodItem("納豆", 3.3),),
+            meals=(MealTemplate("納豆とトマト", "納豆", "トマト", 5),)
+        )
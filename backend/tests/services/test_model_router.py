@@ -0,0 +1,45 @@
+from src.services.model_router import ModelRouter
+
+
+def make_router(**kwargs):
+    return ModelRouter(
+        fast_model="fast", large_model="large", latency_slo=1.0, min_samples=3, **kwargs
+    )
+
+
+def test_routes_by_risk_level():
+    router = make_router()
+
+    assert router.route("LOW") == "fast"
+    assert router.route("high") == "large"
+    stats = router.get_stats()
+    assert stats["decisions"] == {"default": 1, "risk_level": 1}
+    assert stats["models"]["large"]["selected"] == 1
+
+
+def test_large_model_over_slo_falls_back_to_fast():
+    router = make_router()
+    for _ in range(3):
+        router.record("large", 2.5)
+
+    assert router.observed_latency("large") == 2.5
+    assert router.route("high") == "fast"
+    assert router.get_stats()["decisions"] == {"large_over_slo": 1}
+
+
+def test_fast_model_over_slo_uses_large_model():
+    router = make_router()
+    for _ in range(3):
+        router.record("fast", 2.0)
+        router.record("large", 0.5)
+
+    assert router.route("low") == "large"
+    assert router.get_stats()["decisions"] == {"fast_over_slo": 1}
+
+
+def test_escalate_only_from_fast_model():
+    router = make_router()
+
+    assert router.escalate("fast") == "large"
+    assert router.escalate("large") == "large"
+    assert router.get_stats()["decisions"] == {"retry": 1}
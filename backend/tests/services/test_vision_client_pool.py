@@ -0,0 +1,98 @@
+import asyncio
+import grpc
+import pytest
+from unittest.mock import Mock, patch
+from google.api_core import exceptions as google_exceptions
+from google.cloud import vision
+from src.services.vision_client_pool import AsyncVisionClientPool, create_pooled_client
+
+
+class FakeAsyncClient:
+    """batch_annotate_images だけを持つ非同期クライアントの代替"""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def batch_annotate_images(self, requests, timeout):
+        self.calls.append((requests, timeout))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error:
+                raise self.error
+            response = Mock()
+            response.error.message = ""
+            return Mock(responses=[response])
+        finally:
+            self.active -= 1
+
+
+def _factory(clients):
+    iterator = iter(clients)
+    return lambda: next(iterator)
+
+
+@pytest.mark.asyncio
+async def test_round_robin_and_lazy_creation():
+    """クライアントは初回呼び出し時に生成され、ラウンドロビンで使われること"""
+    clients = [FakeAsyncClient(), FakeAsyncClient()]
+    pool = AsyncVisionClientPool(pool_size=2, timeout=3.0, client_factory=_factory(clients))
+    assert pool.get_stats()["channels"] == 0
+
+    for _ in range(4):
+        await pool.annotate(b"image", [vision.Feature.Type.FACE_DETECTION])
+
+    assert [len(client.calls) for client in clients] == [2, 2]
+    requests, timeout = clients[0].calls[0]
+    assert timeout == 3.0
+    assert requests[0]["features"][0]["type_"] == vision.Feature.Type.FACE_DETECTION
+    assert pool.get_stats()["channels"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped():
+    """同時実行数が上限を超えないこと"""
+    client = FakeAsyncClient(delay=0.05)
+    pool = AsyncVisionClientPool(pool_size=1, max_concurrency=2, client_factory=lambda: client)
+
+    await asyncio.gather(*[
+        pool.annotate(b"image", [vision.Feature.Type.IMAGE_PROPERTIES]) for _ in range(6)
+    ])
+
+    stats = pool.get_stats()
+    assert client.max_active == 2
+    assert stats["max_in_flight"] == 2
+    assert stats["queued"] > 0
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_deadline_exceeded_is_counted():
+    """デッドライン超過は統計に記録したうえで送出されること"""
+    client = FakeAsyncClient(error=google_exceptions.DeadlineExceeded("timeout"))
+    pool = AsyncVisionClientPool(pool_size=1, client_factory=lambda: client)
+
+    with pytest.raises(google_exceptions.DeadlineExceeded):
+        await pool.annotate(b"image", [vision.Feature.Type.OBJECT_LOCALIZATION])
+
+    assert pool.get_stats()["timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_channels_use_local_subchannel_pool():
+    """プールのチャネルはグローバルなサブチャネルプールを共有しない（別々の接続を張る）こと"""
+    target = "src.services.vision_client_pool.ImageAnnotatorGrpcAsyncIOTransport.create_channel"
+    channel = grpc.aio.insecure_channel("localhost:0")
+    with patch(target, return_value=channel) as create_channel:
+        client = create_pooled_client()
+
+    options = create_channel.call_args.kwargs["options"]
+    assert ("grpc.use_local_subchannel_pool", 1) in options
+    assert ("grpc.max_send_message_length", -1) in options
+    assert client.transport.grpc_channel is channel
+    await channel.close()
@@ -1,6 +1,10 @@
 import pytest
 from unittest.mock import Mock, patch
 import asyncio
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from google.cloud import vision
 from src.services.vision_service import VisionService, ImageQualityMetrics, NailAnalysisResult
 
 @pytest.fixture
@@ -9,7 +13,19 @@ def vision_service():
 
 @pytest.fixture
 def mock_image_content():
-    return b"fake_image_content"
+    """ローカル画質チェックを通過する程度の明るさと鮮鋭度を持つ画像"""
+    rng = np.random.default_rng(0)
+    array = rng.integers(60, 200, size=(400, 400, 3)).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(array).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def dark_image_content():
+    """暗すぎる画像"""
+    buffer = BytesIO()
+    Image.fromarray(np.full((400, 400, 3), 5, dtype=np.uint8)).save(buffer, format="JPEG")
+    return buffer.getvalue()
 
 @pytest.fixture
 def mock_vision_response():
@@ -98,4 +114,212 @@ async def test_analyze_image_error_handling(vision_service, mock_image_content):
     with patch.object(vision_service.client, 'image_properties', side_effect=Exception("API Error")):
         with pytest.raises(Exception) as exc_info:
             await vision_service.analyze_image(mock_image_content)
-        assert "API Error" in str(exc_info.value) 
\ No newline at end of file
+        assert "API Error" in str(exc_info.value) 
+
+@pytest.fixture
+def batch_vision_service():
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        yield VisionService(color_engine="vision", request_mode="batch")
+
+@pytest.mark.asyncio
+async def test_analyze_image_batch_mode(batch_vision_service, mock_image_content, mock_vision_response):
+    """batchモードでは1回のannotate呼び出しで全機能を取得すること"""
+    mock_properties, mock_objects, mock_faces = mock_vision_response
+    response = Mock()
+    response.error.message = ""
+    response.face_annotations = []
+    response.image_properties_annotation = mock_properties.image_properties_annotation
+    response.localized_object_annotations = mock_objects.localized_object_annotations
+    client = batch_vision_service.client
+    client.annotate_image.return_value = response
+
+    result = await batch_vision_service.analyze_image(mock_image_content)
+
+    client.annotate_image.assert_called_once()
+    client.face_detection.assert_not_called()
+    client.image_properties.assert_not_called()
+    client.object_localization.assert_not_called()
+    request = client.annotate_image.call_args.args[0]
+    assert len(request["features"]) == 3
+    assert all(feature["max_results"] > 0 for feature in request["features"])
+    assert len(result["detected_colors"]) == 1
+    assert result["has_detected_nail"]
+
+@pytest.mark.asyncio
+async def test_analyze_image_batch_mode_error(batch_vision_service, mock_image_content):
+    """annotateレスポンスにエラーが含まれる場合は例外になること"""
+    response = Mock()
+    response.error.message = "quota exceeded"
+    batch_vision_service.client.annotate_image.return_value = response
+
+    with pytest.raises(Exception) as exc_info:
+        await batch_vision_service.analyze_image(mock_image_content)
+    assert "quota exceeded" in str(exc_info.value)
+
+@pytest.mark.asyncio
+async def test_quality_gate_rejects_before_vision_call(batch_vision_service, dark_image_content):
+    """ローカル画質チェックで除外された画像ではVision APIを呼び出さないこと"""
+    result = await batch_vision_service.analyze_image(dark_image_content)
+
+    batch_vision_service.client.annotate_image.assert_not_called()
+    assert result["quality_gate_rejected"]
+    assert "画像が暗すぎます" in result["quality_warnings"]
+    assert result["has_detected_nail"] is False
+
+@pytest.fixture
+def roi_vision_service(monkeypatch):
+    monkeypatch.setenv("VISION_ROI_MODE", "true")
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        yield VisionService(color_engine="vision", request_mode="parallel")
+
+@pytest.fixture
+def nail_on_background_image():
+    """青い背景の中央にピンクの爪領域がある画像"""
+    rng = np.random.default_rng(0)
+    array = np.zeros((1200, 1600, 3), dtype=np.float64)
+    array[:] = (60, 90, 160)
+    array[400:800, 600:1000] = (230, 180, 180)
+    array += rng.normal(0, 12, array.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+def _normalized_box(left, top, right, bottom):
+    return [Mock(x=left, y=top), Mock(x=right, y=top), Mock(x=right, y=bottom), Mock(x=left, y=bottom)]
+
+@pytest.mark.asyncio
+async def test_analyze_image_roi_mode(roi_vision_service, nail_on_background_image):
+    """ROIモードでは縮小画像で検出し、爪領域だけの色を解析すること"""
+    nail = Mock()
+    nail.name = "Fingernail"
+    nail.score = 0.9
+    nail.bounding_poly.normalized_vertices = _normalized_box(0.375, 1 / 3, 0.625, 2 / 3)
+    objects = Mock(localized_object_annotations=[nail])
+    faces = Mock(face_annotations=[])
+    client = roi_vision_service.client
+    client.object_localization.return_value = objects
+    client.face_detection.return_value = faces
+
+    result = await roi_vision_service.analyze_image(nail_on_background_image)
+
+    client.image_properties.assert_not_called()
+    uploaded = client.object_localization.call_args.args[0].content
+    assert len(uploaded) < result["preprocessing"]["reduced_bytes"]
+    assert max(Image.open(BytesIO(uploaded)).size) <= 512
+
+    # 背景の青は色解析の対象に含まれない
+    nail_fraction = sum(
+        color["score"] for color in result["detected_colors"]
+        if color["red"] > color["blue"]
+    )
+    assert nail_fraction > 0.7  # 全体では約8%、マージン込みの切り出しでは約77%
+
+def test_find_nail_bounding_box(vision_service_without_client):
+    """爪関連のラベルのうち最も信頼度の高いオブジェクトの矩形を返すこと"""
+    low = Mock(score=0.3, bounding_poly=Mock(normalized_vertices=_normalized_box(0.0, 0.0, 0.2, 0.2)))
+    low.name = "Hand"
+    high = Mock(score=0.9, bounding_poly=Mock(normalized_vertices=_normalized_box(0.4, 0.5, 0.6, 0.7)))
+    high.name = "Nail"
+
+    box = vision_service_without_client._find_nail_bounding_box([low, high])
+
+    assert box == (0.4, 0.5, 0.6, 0.7)
+    assert vision_service_without_client._find_nail_bounding_box([]) is None
+
+@pytest.fixture
+def vision_service_without_client():
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        yield VisionService()
+
+@pytest.fixture
+def parallel_vision_service(monkeypatch):
+    monkeypatch.setenv("VISION_FEATURE_TIERS", '{"guest": ["image_properties"]}')
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        yield VisionService(color_engine="vision", request_mode="parallel")
+
+@pytest.mark.asyncio
+async def test_dark_properties_cancel_pending_calls(parallel_vision_service, mock_image_content):
+    """代表色が暗すぎる場合は顔・オブジェクト検出の完了を待たずに除外すること"""
+    import time
+    dark_color = Mock(score=1.0)
+    dark_color.color.red = dark_color.color.green = dark_color.color.blue = 10
+    properties = Mock()
+    properties.image_properties_annotation.dominant_colors.colors = [dark_color]
+    client = parallel_vision_service.client
+    client.image_properties.return_value = properties
+    client.face_detection.side_effect = lambda image: time.sleep(1.0)
+    client.object_localization.side_effect = lambda image: time.sleep(1.0)
+
+    start = time.perf_counter()
+    result = await parallel_vision_service.analyze_image(mock_image_content)
+
+    assert time.perf_counter() - start < 0.8
+    assert result["quality_gate_rejected"]
+    assert "画像が暗すぎます" in result["quality_warnings"]
+    assert parallel_vision_service.get_stats()["rejected"] == {"image_properties": 1}
+
+@pytest.mark.asyncio
+async def test_tier_limits_vision_features(parallel_vision_service, mock_image_content, mock_vision_response):
+    """ティアで必要とされない機能はVision APIを呼び出さないこと"""
+    client = parallel_vision_service.client
+    client.image_properties.return_value = mock_vision_response[0]
+
+    result = await parallel_vision_service.analyze_image(mock_image_content, tier="guest")
+
+    client.face_detection.assert_not_called()
+    client.object_localization.assert_not_called()
+    assert result["has_detected_nail"] is None
+    assert len(result["detected_colors"]) == 1
+
+def test_tier_without_image_properties_is_rejected(monkeypatch):
+    """代表色を含まないティアの設定はエラーになること"""
+    monkeypatch.setenv("VISION_FEATURE_TIERS", '{"guest": ["face_detection"]}')
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        with pytest.raises(ValueError):
+            VisionService()
+
+@pytest.mark.asyncio
+async def test_risk_stage_completes_before_detection(parallel_vision_service, mock_image_content, mock_vision_response):
+    """リスクスコアに依存するステージは顔・オブジェクト検出の完了を待たずに開始されること"""
+    import time
+    from src.utils.stage_runner import StageRunner
+    client = parallel_vision_service.client
+    client.image_properties.return_value = mock_vision_response[0]
+    client.face_detection.side_effect = lambda image: time.sleep(0.3) or Mock(face_annotations=[])
+    client.object_localization.side_effect = lambda image: time.sleep(0.3) or mock_vision_response[1]
+
+    async def advice(results):
+        return results["risk"]["risk_score"]
+
+    runner = StageRunner()
+    parallel_vision_service.add_stages(runner, mock_image_content)
+    runner.add_stage("advice", advice, depends_on=["risk"])
+    run_result = await runner.run()
+
+    timings = run_result.timings
+    assert timings["advice"].finished_at < timings["face_detection"].finished_at
+    assert run_result.results["advice"] == run_result.results["vision"]["risk_score"]
+
+@pytest.mark.asyncio
+async def test_async_client_mode_uses_pool(monkeypatch, mock_image_content, mock_vision_response):
+    """asyncモードでは同期クライアントを使わずにプールから呼び出すこと"""
+    monkeypatch.setenv("VISION_CLIENT_MODE", "async")
+    with patch('src.services.vision_service.vision.ImageAnnotatorClient'):
+        service = VisionService(color_engine="vision", request_mode="parallel")
+
+    responses = {
+        vision.Feature.Type.FACE_DETECTION: Mock(face_annotations=[]),
+        vision.Feature.Type.IMAGE_PROPERTIES: mock_vision_response[0],
+        vision.Feature.Type.OBJECT_LOCALIZATION: mock_vision_response[1]
+    }
+
+    async def annotate(content, feature_types, max_results=None):
+        return responses[feature_types[0]]
+
+    service._client_pool.annotate = annotate
+    result = await service.analyze_image(mock_image_content)
+
+    service.client.image_properties.assert_not_called()
+    service.client.face_detection.assert_not_called()
+    assert len(result["detected_colors"]) == 1
+    assert result["has_detected_nail"]
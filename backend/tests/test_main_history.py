@@ -0,0 +1,94 @@
+import io
+import json
+import os
+import tempfile
+import pytest
+from unittest.mock import AsyncMock, Mock
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# main.py は読み込み時に環境変数を検証するため、インポートの前にテスト用の値を設定する
+_credentials_path = os.path.join(tempfile.mkdtemp(), "mock_credentials.json")
+with open(_credentials_path, "w") as f:
+    json.dump({"type": "service_account", "project_id": "test-project",
+               "private_key": "mock_private_key", "client_email": "mock@test-project.iam.gserviceaccount.com"}, f)
+os.environ.update({
+    "TEST_MODE": "True",
+    "FIREBASE_CREDENTIALS_PATH": _credentials_path,
+    "GOOGLE_APPLICATION_CREDENTIALS": _credentials_path,
+    "GOOGLE_CLOUD_PROJECT": "test-project",
+    "VISION_AI_LOCATION": "us-central1",
+    "VERTEX_AI_LOCATION": "us-central1",
+    "GEMINI_MODEL_ID": "gemini-1.5-pro"
+})
+
+import main
+from tests.mocks.mock_services import MockFirestoreService
+
+REJECTED_OUTPUT = {
+    "analysis": {
+        "risk_score": 0.5,
+        "confidence_score": 0.0,
+        "risk_level": "medium",
+        "detected_colors": [],
+        "quality_metrics": {
+            "is_blurry": True,
+            "brightness_score": 0.1,
+            "has_proper_lighting": False,
+            "has_detected_nail": False
+        }
+    },
+    "nutrition_advice": None,
+    "quality_warnings": ["画像が暗すぎます"],
+    "quality_gate_rejected": True,
+    "degraded": False
+}
+
+def make_image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (200, 120, 120)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def firestore_service(monkeypatch):
+    """解析パイプラインを画質チェックで除外された結果に差し替え、保存先をモックにする"""
+    service = MockFirestoreService()
+    monkeypatch.setattr(main, "firestore_service", service)
+    monkeypatch.setattr(main, "vision_service", Mock(resolve_tier=Mock(return_value="member")))
+    monkeypatch.setattr(main.analysis_cache, "get_or_compute", AsyncMock(return_value=REJECTED_OUTPUT))
+    return service
+
+def test_rejected_image_is_not_saved(firestore_service):
+    """画質チェックで除外された画像の解析結果は履歴に保存しないこと"""
+    response = TestClient(main.app).post(
+        "/analyze?user_id=test_user",
+        files={"file": ("nail.png", make_image(), "image/png")}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["quality_warnings"] == ["画像が暗すぎます"]
+    assert firestore_service.storage == {}
+
+def test_rejected_image_stream_has_no_saved_event(firestore_service):
+    """ストリーミングでも除外された画像は保存せず、saved イベントを送信しないこと"""
+    response = TestClient(main.app).post(
+        "/analyze/stream?user_id=test_user",
+        files={"file": ("nail.png", make_image(), "image/png")}
+    )
+
+    events = [json.loads(line)["event"] for line in response.text.splitlines()]
+    assert events == ["analysis", "advice", "done"]
+    assert firestore_service.storage == {}
+
+def test_usable_image_is_saved(firestore_service, monkeypatch):
+    """画質に問題のない解析結果は履歴に保存すること"""
+    usable = {**REJECTED_OUTPUT, "quality_warnings": [], "quality_gate_rejected": False}
+    monkeypatch.setattr(main.analysis_cache, "get_or_compute", AsyncMock(return_value=usable))
+
+    response = TestClient(main.app).post(
+        "/analyze/stream?user_id=test_user",
+        files={"file": ("nail.png", make_image(), "image/png")}
+    )
+
+    assert "saved" in [json.loads(line)["event"] for line in response.text.splitlines()]
+    assert len(firestore_service.storage["test_user"]) == 1
@@ -0,0 +1,162 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, Mock
+from migrate_analysis_history import HistoryMigration, convert_legacy_history, convert_legacy_result
+from src.models.analysis import AnalysisDetails
+from src.repositories.analysis_history_store import build_record
+from src.repositories.firestore_repository import FirestoreRepository
+
+def legacy_result(user_id="test_user"):
+    """旧 FirebaseService が analysis_results に保存していた形式"""
+    return {
+        "user_id": user_id,
+        "risk_score": 0.7,
+        "risk_level": "HIGH",
+        "confidence_score": 0.8,
+        "nutrition_advice": {
+            "summary": "テストアドバイス",
+            "iron_rich_foods": ["レバー"],
+            "meal_suggestions": ["レバーの生姜焼き"],
+            "lifestyle_tips": ["十分な睡眠をとりましょう"]
+        },
+        "created_at": "2024-01-01T09:00:00"
+    }
+
+class AsyncIterator:
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+def test_convert_legacy_result():
+    """旧形式のドキュメントを統一した形式に変換すること"""
+    record = convert_legacy_result(legacy_result())
+
+    assert record["user_id"] == "test_user"
+    assert record["advice"] == "テストアドバイス"
+    assert record["created_at"] == datetime(2024, 1, 1, 9, 0)
+    assert record["details"]["confidence_score"] == 0.8
+    assert record["details"]["nutrition_advice"]["iron_rich_foods"] == ["レバー"]
+
+def test_convert_legacy_history():
+    """旧 FirestoreService の解析履歴は details を追加し、ローカル時刻の created_at をUTCに直すこと"""
+    record = convert_legacy_history("test_user", {
+        "risk_score": 0.3,
+        "risk_level": "LOW",
+        "advice": "テストアドバイス",
+        "created_at": datetime(2024, 1, 1, 18, 0, tzinfo=timezone.utc)
+    }, timedelta(hours=9))
+
+    assert record["user_id"] == "test_user"
+    assert record["created_at"] == datetime(2024, 1, 1, 9, 0)
+    assert record["advice"] == "テストアドバイス"
+    assert record["details"]["nutrition_advice"] is None
+
+def test_records_from_every_path_have_the_same_shape():
+    """/analyze・/analysis/save・移行のどの経路でも同じ形式（リスクレベルは大文字）になること"""
+    created_at = datetime(2024, 1, 1, 9, 0)
+    details = AnalysisDetails().model_dump()
+    analyze = build_record("test_user", 0.3, "low", "テストアドバイス", details, created_at)
+    save = build_record("test_user", 0.3, "LOW", "テストアドバイス", details, created_at)
+    legacy = convert_legacy_history("test_user", {
+        "risk_score": 0.3, "risk_level": "Low", "advice": "テストアドバイス", "created_at": created_at
+    }, timedelta(0))
+
+    assert analyze == save == legacy
+    assert analyze["risk_level"] == "LOW"
+    assert convert_legacy_result({**legacy_result(), "risk_level": "high"})["risk_level"] == "HIGH"
+
+def make_migration(client, **kwargs):
+    return HistoryMigration(FirestoreRepository(client=client, timeout=1.0), **kwargs)
+
+@pytest.mark.asyncio
+async def test_migrate_results_commits_in_batches():
+    """同じIDで書き込み、batch_size件ごとにコミットすること"""
+    client = MagicMock()
+    client.batch.return_value.commit = AsyncMock(return_value=[])
+    migration = make_migration(client, batch_size=2)
+    docs = [(f"doc{i}", legacy_result()) for i in range(5)] + [("orphan", {"risk_score": 0.1})]
+    migration.repository.query = AsyncMock(return_value=docs)
+
+    await migration.migrate_results()
+
+    assert migration.stats == {"migrated": 5, "converted": 0, "skipped": 1, "users": 0, "commits": 3}
+    assert client.batch.return_value.commit.await_count == 3
+    client.document.assert_any_call("users/test_user/analysis_history/doc4")
+
+@pytest.mark.asyncio
+async def test_scan_reads_page_by_page():
+    """全体を1回のストリームで読まず、ページの最後の要素の直後から続きを読むこと"""
+    migration = make_migration(MagicMock(), page_size=2)
+    created = [datetime(2024, 1, 3), datetime(2024, 1, 2), datetime(2024, 1, 1)]
+    migration.repository.query = AsyncMock(side_effect=[
+        [("doc1", {"created_at": created[0]}), ("doc2", {"created_at": created[1]})],
+        [("doc3", {"created_at": created[2]})]
+    ])
+
+    docs = [doc_id async for doc_id, _ in migration._scan(
+        "users/test_user/analysis_history", order_by=["created_at", "__name__"], descending=True
+    )]
+
+    assert docs == ["doc1", "doc2", "doc3"]
+    first, second = migration.repository.query.await_args_list
+    assert first.kwargs["start_after"] is None
+    assert second.kwargs["start_after"] == {"created_at": created[1], "__name__": "doc2"}
+    assert second.kwargs["limit"] == 2
+
+@pytest.mark.asyncio
+async def test_convert_legacy_histories_skips_converted_documents():
+    """details のある（変換済みの）解析履歴は書き直さないこと"""
+    client = MagicMock()
+    client.collection.return_value.list_documents = Mock(return_value=AsyncIterator([Mock(id="test_user")]))
+    client.batch.return_value.commit = AsyncMock(return_value=[])
+    migration = make_migration(client, legacy_utc_offset=timedelta(hours=9))
+    migration.repository.query = AsyncMock(return_value=[
+        ("old", {"risk_score": 0.3, "risk_level": "LOW", "advice": "a", "created_at": datetime(2024, 1, 1, 18)}),
+        ("new", {"risk_score": 0.3, "risk_level": "LOW", "advice": "a", "details": {}})
+    ])
+
+    await migration.convert_legacy_histories()
+
+    assert migration.stats["converted"] == 1
+    client.document.assert_called_once_with("users/test_user/analysis_history/old")
+    (_, record), _ = client.batch.return_value.set.call_args
+    assert record["created_at"] == datetime(2024, 1, 1, 9)
+
+@pytest.mark.asyncio
+async def test_migrate_results_dry_run():
+    """dry-runでは件数だけを数え、コミットしないこと"""
+    client = MagicMock()
+    client.batch.return_value.commit = AsyncMock(return_value=[])
+    migration = make_migration(client, dry_run=True)
+    migration.repository.query = AsyncMock(return_value=[("doc1", legacy_result())])
+
+    await migration.migrate_results()
+
+    assert migration.stats["migrated"] == 1
+    client.batch.return_value.commit.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_convert_legacy_histories_normalizes_risk_level():
+    """変換済みの解析履歴も小文字のリスクレベルだけを大文字に更新すること"""
+    client = MagicMock()
+    client.collection.return_value.list_documents = Mock(return_value=AsyncIterator([Mock(id="test_user")]))
+    client.batch.return_value.commit = AsyncMock(return_value=[])
+    migration = make_migration(client)
+    migration.repository.query = AsyncMock(return_value=[
+        ("analyze", {"risk_level": "medium", "details": {}}),
+        ("save", {"risk_level": "MEDIUM", "details": {}})
+    ])
+
+    await migration.convert_legacy_histories()
+
+    assert migration.stats["converted"] == 1
+    client.batch.return_value.update.assert_called_once_with(client.document.return_value, {"risk_level": "MEDIUM"})
+    client.batch.return_value.set.assert_not_called()
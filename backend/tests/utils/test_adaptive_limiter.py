@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from src.utils.adaptive_limiter import AdaptiveConcurrencyLimiter
+
+
+class OverloadError(Exception):
+    pass
+
+
+def _limiter(**kwargs):
+    return AdaptiveConcurrencyLimiter(is_overload=lambda error: isinstance(error, OverloadError), **kwargs)
+
+
+async def _run(limiter, delay=0.01, error=None):
+    async with limiter.slot():
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+
+
+@pytest.mark.asyncio
+async def test_requests_beyond_limit_wait():
+    """上限を超えたリクエストは待機し、同時実行数が上限を超えないこと"""
+    limiter = _limiter(initial_limit=2, max_limit=2)
+    active = 0
+    max_active = 0
+
+    async def task():
+        nonlocal active, max_active
+        async with limiter.slot():
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.02)
+            active -= 1
+
+    await asyncio.gather(*[task() for _ in range(6)])
+
+    stats = limiter.get_stats()
+    assert max_active == 2
+    assert stats["max_queue_depth"] > 0
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_while_saturated():
+    """上限まで使われた状態で成功が続くと上限が増えること"""
+    limiter = _limiter(initial_limit=2, max_limit=16, window_size=1000)
+    for _ in range(5):
+        await asyncio.gather(*[_run(limiter) for _ in range(limiter.limit)])
+    assert limiter.limit > 2
+
+
+@pytest.mark.asyncio
+async def test_overload_halves_limit_once_per_window():
+    """過負荷エラーでは上限を半減し、同時に失敗した分で重ねて下げないこと"""
+    limiter = _limiter(initial_limit=8, max_limit=8)
+
+    await asyncio.gather(
+        *[_run(limiter, error=OverloadError()) for _ in range(8)],
+        return_exceptions=True
+    )
+
+    stats = limiter.get_stats()
+    assert limiter.limit == 4
+    assert stats["overloads"] == 8
+    assert stats["decreases"] == 1
+
+
+@pytest.mark.asyncio
+async def test_other_errors_do_not_reduce_limit():
+    limiter = _limiter(initial_limit=4, max_limit=4)
+    with pytest.raises(ValueError):
+        await _run(limiter, error=ValueError())
+    assert limiter.limit == 4
+    assert limiter.get_stats()["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rising_p95_reduces_limit():
+    """直近のp95が基準より大きく悪化した場合は上限を下げること"""
+    limiter = _limiter(initial_limit=8, max_limit=8, window_size=5, latency_tolerance=2.0)
+    for _ in range(5):
+        await _run(limiter, delay=0.005)
+    for _ in range(5):
+        await _run(limiter, delay=0.05)
+
+    assert limiter.limit == 4
+    assert limiter.get_stats()["decreases"] == 1
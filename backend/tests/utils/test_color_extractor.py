@@ -0,0 +1,60 @@
+import pytest
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from src.utils.color_extractor import LocalColorExtractor, ImagePropertiesAnnotation
+
+def _encode(array: np.ndarray, format: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(array.astype(np.uint8)).save(buffer, format=format)
+    return buffer.getvalue()
+
+@pytest.fixture
+def extractor():
+    return LocalColorExtractor(num_colors=4)
+
+@pytest.fixture
+def two_color_image():
+    """左3/4がピンク、右1/4が白の画像"""
+    array = np.zeros((64, 64, 3), dtype=np.uint8)
+    array[:, :48] = (230, 190, 190)
+    array[:, 48:] = (255, 255, 255)
+    return _encode(array)
+
+def test_extract_returns_vision_compatible_structure(extractor, two_color_image):
+    """Vision APIと同じ属性構造で代表色が返ること"""
+    properties = extractor.extract(two_color_image)
+
+    assert isinstance(properties, ImagePropertiesAnnotation)
+    assert properties.dominant_colors
+    for color in properties.dominant_colors.colors:
+        assert 0 <= color.color.red <= 255
+        assert 0 <= color.score <= 1
+
+def test_extract_orders_by_score(extractor, two_color_image):
+    """スコアの降順に並び、最大の色が支配的な色になること"""
+    colors = extractor.extract(two_color_image).dominant_colors.colors
+
+    scores = [color.score for color in colors]
+    assert scores == sorted(scores, reverse=True)
+    assert sum(scores) == pytest.approx(1.0)
+
+    top = colors[0]
+    assert (top.color.red, top.color.green, top.color.blue) == (230, 190, 190)
+    assert top.score == pytest.approx(0.75, abs=0.02)
+
+def test_extract_single_color(extractor):
+    """単色画像では1色のみが返ること"""
+    array = np.full((32, 32, 3), (120, 60, 60), dtype=np.uint8)
+    colors = extractor.extract(_encode(array)).dominant_colors.colors
+
+    assert len(colors) == 1
+    assert colors[0].score == pytest.approx(1.0)
+
+def test_extract_jpeg_uses_draft_decoding(extractor):
+    """大きなJPEGでもサブサンプリングされて解析できること"""
+    rng = np.random.default_rng(0)
+    array = rng.integers(0, 255, size=(1200, 1600, 3))
+    properties = extractor.extract(_encode(array, format="JPEG"))
+
+    assert 0 < len(properties.dominant_colors.colors) <= 4
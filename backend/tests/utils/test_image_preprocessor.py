@@ -0,0 +1,59 @@
+import pytest
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from src.utils.image_preprocessor import ImagePreprocessor
+
+def _encode(array: np.ndarray, exif: Image.Exif = None) -> bytes:
+    buffer = BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    Image.fromarray(array.astype(np.uint8)).save(buffer, format="JPEG", quality=95, **kwargs)
+    return buffer.getvalue()
+
+@pytest.fixture
+def preprocessor():
+    return ImagePreprocessor(max_edge=800, target_bytes=150 * 1024)
+
+@pytest.fixture
+def large_photo():
+    """スマートフォン写真相当の大きな画像"""
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, size=(3000, 4000, 3))
+
+def test_large_image_is_downscaled(preprocessor, large_photo):
+    """長辺が上限以下に縮小され、目標バイト数に近づくこと"""
+    content = _encode(large_photo)
+    result = preprocessor.process(content)
+
+    assert (result.original_width, result.original_height) == (4000, 3000)
+    assert max(result.width, result.height) <= 800
+    assert result.original_bytes == len(content)
+    assert result.reduced_bytes == len(result.content)
+    assert result.reduced_bytes < result.original_bytes
+    assert Image.open(BytesIO(result.content)).format == "JPEG"
+
+def test_quality_is_lowered_to_fit_budget(large_photo):
+    """目標バイト数に収まるまで品質を下げること"""
+    preprocessor = ImagePreprocessor(max_edge=800, target_bytes=100 * 1024, min_quality=30)
+    result = preprocessor.process(_encode(large_photo))
+
+    assert result.quality < preprocessor.initial_quality
+
+def test_exif_orientation_is_applied(preprocessor):
+    """EXIFの向きが適用されること"""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 90度回転
+    content = _encode(np.full((200, 400, 3), 128), exif=exif)
+
+    result = preprocessor.process(content)
+
+    assert (result.width, result.height) == (200, 400)
+
+def test_small_image_passes_through(preprocessor):
+    """十分小さい画像は再エンコードせずそのまま使うこと"""
+    content = _encode(np.full((300, 400, 3), 128))
+    result = preprocessor.process(content)
+
+    assert result.content is content
+    assert result.quality is None
+    assert "content" not in result.to_dict()
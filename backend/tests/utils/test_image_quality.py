@@ -0,0 +1,64 @@
+import pytest
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageFilter
+from src.utils.image_quality import LocalQualityGate
+
+def _encode(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+@pytest.fixture
+def gate():
+    return LocalQualityGate()
+
+@pytest.fixture
+def sharp_image():
+    """明るさが適切で細部を含む画像"""
+    rng = np.random.default_rng(0)
+    array = rng.integers(60, 200, size=(600, 800, 3)).astype(np.uint8)
+    return Image.fromarray(array)
+
+def test_usable_image_passes(gate, sharp_image):
+    """適切な画像は通過すること"""
+    result = gate.evaluate(_encode(sharp_image))
+
+    assert result.is_usable
+    assert result.reasons == []
+    assert (result.width, result.height) == (800, 600)
+    assert result.has_proper_lighting
+    assert not result.is_blurry
+
+def test_blurry_image_rejected(gate, sharp_image):
+    """ぼやけた画像は除外されること"""
+    blurred = sharp_image.filter(ImageFilter.GaussianBlur(radius=8))
+    result = gate.evaluate(_encode(blurred))
+
+    assert not result.is_usable
+    assert result.is_blurry
+    assert "画像がぼやけています" in result.reasons
+
+def test_dark_image_rejected(gate):
+    """暗すぎる画像は除外されること"""
+    dark = Image.fromarray(np.full((600, 800, 3), 10, dtype=np.uint8))
+    result = gate.evaluate(_encode(dark))
+
+    assert not result.is_usable
+    assert "画像が暗すぎます" in result.reasons
+    assert result.underexposed_ratio > 0.9
+
+def test_small_image_rejected(gate, sharp_image):
+    """解像度が低すぎる画像は除外されること"""
+    small = sharp_image.resize((120, 90))
+    result = gate.evaluate(_encode(small))
+
+    assert not result.is_usable
+    assert any("解像度" in reason for reason in result.reasons)
+
+def test_unreadable_image_rejected(gate):
+    """読み込めないデータは除外されること"""
+    result = gate.evaluate(b"not an image")
+
+    assert not result.is_usable
+    assert result.reasons == ["画像を読み込めませんでした"]
@@ -0,0 +1,56 @@
+import pytest
+from src.utils.json_stream import IncrementalJSONExtractor, extract_json_object
+
+RESPONSE = """Here is the advice:
+```json
+{
+    "summary": "鉄分を意識しましょう {括弧} を含む",
+    "iron_rich_foods": ["レバー", "ひじき"],
+    "score": 12.5,
+    "ok": true
+}
+```"""
+
+
+def test_extract_skips_fences_and_preamble():
+    """前置きとコードブロックを読み飛ばして最初のオブジェクトを取り出すこと"""
+    data = extract_json_object(RESPONSE)
+    assert data == {
+        "summary": "鉄分を意識しましょう {括弧} を含む",
+        "iron_rich_foods": ["レバー", "ひじき"],
+        "score": 12.5,
+        "ok": True
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_fields_are_emitted_as_soon_as_they_close(chunk_size):
+    """チャンクの区切り位置によらず、閉じたフィールドから順に返すこと"""
+    extractor = IncrementalJSONExtractor()
+    emitted = []
+    consumed_at = {}
+    for offset in range(0, len(RESPONSE), chunk_size):
+        for name, value in extractor.feed(RESPONSE[offset:offset + chunk_size]):
+            emitted.append((name, value))
+            consumed_at[name] = offset + chunk_size
+
+    assert [name for name, _ in emitted] == ["summary", "iron_rich_foods", "score", "ok"]
+    assert extractor.is_complete
+    # summaryはオブジェクト全体が届く前に確定する
+    assert consumed_at["summary"] < RESPONSE.index('"iron_rich_foods"') + chunk_size
+    # 数値は区切りが届くまで確定しない
+    assert dict(emitted)["score"] == 12.5
+
+
+def test_incomplete_object_is_rejected_on_finish():
+    extractor = IncrementalJSONExtractor()
+    extractor.feed('{"summary": "途中')
+    with pytest.raises(ValueError):
+        extractor.finish()
+
+
+def test_malformed_json_raises():
+    with pytest.raises(ValueError):
+        extract_json_object('{"summary": "a" "iron_rich_foods": []}')
+    with pytest.raises(ValueError):
+        extract_json_object("JSONではありません")
@@ -0,0 +1,28 @@
+import pytest
+from src.utils.latency_histogram import LatencyHistogram
+
+
+def test_quantile_uses_recent_window():
+    histogram = LatencyHistogram(window=10)
+    for _ in range(10):
+        histogram.record(5.0)
+    for i in range(10):
+        histogram.record(0.1 * (i + 1))
+
+    assert histogram.count == 20
+    assert histogram.recent_count == 10
+    assert histogram.quantile(0.5) == pytest.approx(0.6)
+    assert histogram.quantile(0.9) == pytest.approx(1.0)
+
+
+def test_to_dict_counts_buckets():
+    histogram = LatencyHistogram(buckets=(0.1, 1.0))
+    assert histogram.to_dict()["p90_seconds"] is None
+
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        histogram.record(seconds)
+
+    stats = histogram.to_dict()
+    assert stats["count"] == 4
+    assert stats["buckets"] == {"le_0.1": 2, "le_1.0": 1, "inf": 1}
+    assert stats["mean_seconds"] == pytest.approx(0.9125)
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from src.utils.micro_batcher import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_requests_within_window_are_batched():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(process, max_batch_size=8, max_wait_seconds=0.02)
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(5)])
+
+    assert results == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2, 3, 4]]
+    stats = batcher.get_stats()
+    assert stats["batches"] == 1
+    assert stats["mean_batch_size"] == 5
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_flushed_without_waiting():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return list(items)
+
+    batcher = MicroBatcher(process, max_batch_size=2, max_wait_seconds=10.0)
+    results = await asyncio.wait_for(asyncio.gather(*[batcher.submit(i) for i in range(4)]), 1.0)
+
+    assert results == [0, 1, 2, 3]
+    assert batches == [[0, 1], [2, 3]]
+    assert batcher.get_stats()["full_batches"] == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_are_fanned_out():
+    async def process(items):
+        return [ValueError("bad") if item == 1 else item for item in items]
+
+    batcher = MicroBatcher(process, max_wait_seconds=0.01)
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_result_count_mismatch_fails_whole_batch():
+    async def process(items):
+        return items[:1]
+
+    batcher = MicroBatcher(process, max_wait_seconds=0.01)
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(2)], return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert batcher.get_stats()["failed_batches"] == 1
@@ -0,0 +1,120 @@
+import asyncio
+import pytest
+from src.utils.stage_runner import StageRunner
+
+
+@pytest.mark.asyncio
+async def test_runs_stages_in_dependency_order():
+    """依存するステージの結果を受け取り、独立したステージは並行に実行されること"""
+    runner = StageRunner()
+
+    async def source(results):
+        return 2
+
+    async def double(results):
+        await asyncio.sleep(0.05)
+        return results["source"] * 2
+
+    async def square(results):
+        await asyncio.sleep(0.05)
+        return results["source"] ** 2
+
+    async def total(results):
+        return results["double"] + results["square"]
+
+    runner.add_stage("source", source)
+    runner.add_stage("double", double, depends_on=["source"])
+    runner.add_stage("square", square, depends_on=["source"])
+    runner.add_stage("total", total, depends_on=["double", "square"])
+
+    run_result = await runner.run()
+
+    assert not run_result.aborted
+    assert run_result.results["total"] == 8
+    timings = run_result.timings
+    # doubleとsquareは同時に開始される
+    assert timings["square"].started_at < timings["double"].finished_at
+    assert all(timing.status == "completed" for timing in timings.values())
+
+
+@pytest.mark.asyncio
+async def test_abort_cancels_pending_stages():
+    """abort_ifが理由を返した場合は実行中のステージをキャンセルして終了すること"""
+    runner = StageRunner()
+    slow_finished = False
+
+    async def fast(results):
+        return "bad"
+
+    async def slow(results):
+        nonlocal slow_finished
+        await asyncio.sleep(1.0)
+        slow_finished = True
+
+    async def after(results):
+        return "never"
+
+    runner.add_stage("fast", fast, abort_if=lambda value: "rejected" if value == "bad" else None)
+    runner.add_stage("slow", slow)
+    runner.add_stage("after", after, depends_on=["fast", "slow"])
+
+    run_result = await runner.run()
+
+    assert run_result.aborted_by == "fast"
+    assert run_result.abort_reason == "rejected"
+    assert not slow_finished
+    assert run_result.timings["slow"].status == "cancelled"
+    assert run_result.timings["after"].status == "skipped"
+    assert "after" not in run_result.results
+
+
+@pytest.mark.asyncio
+async def test_stage_error_cancels_others_and_raises():
+    """ステージの例外は他のステージをキャンセルしてから送出されること"""
+    runner = StageRunner()
+
+    async def failing(results):
+        raise RuntimeError("boom")
+
+    async def slow(results):
+        await asyncio.sleep(1.0)
+
+    runner.add_stage("failing", failing)
+    runner.add_stage("slow", slow)
+
+    with pytest.raises(RuntimeError):
+        await runner.run()
+
+
+def test_rejects_unknown_dependency_and_duplicates():
+    runner = StageRunner()
+
+    async def stage(results):
+        return None
+
+    runner.add_stage("a", stage)
+    with pytest.raises(ValueError):
+        runner.add_stage("a", stage)
+    with pytest.raises(ValueError):
+        runner.add_stage("b", stage, depends_on=["missing"])
+
+
+@pytest.mark.asyncio
+async def test_on_stage_complete_is_called_in_completion_order():
+    """ステージの完了ごとにコールバックが呼び出されること"""
+    runner = StageRunner()
+    completed = []
+
+    async def fast(results):
+        return "fast"
+
+    async def slow(results):
+        await asyncio.sleep(0.05)
+        return "slow"
+
+    runner.add_stage("slow", slow)
+    runner.add_stage("fast", fast)
+
+    await runner.run(lambda name, value: completed.append((name, value)))
+
+    assert completed == [("fast", "fast"), ("slow", "slow")]
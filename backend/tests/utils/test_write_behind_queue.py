@@ -0,0 +1,164 @@
+import asyncio
+import json
+import pytest
+from datetime import datetime
+from src.utils.write_behind_queue import WriteBehindQueue
+
+
+def make_item(i):
+    return {"id": f"doc{i}", "user_id": "test_user", "created_at": datetime(2024, 1, 1, 9, i)}
+
+
+@pytest.mark.asyncio
+async def test_items_are_written_in_batches_after_offer():
+    batches = []
+
+    async def write(items):
+        batches.append([item["id"] for item in items])
+
+    queue = WriteBehindQueue(write, batch_size=3, workers=1)
+    await queue.start()
+    assert all(queue.offer(make_item(i)) for i in range(5))
+    assert queue.get_stats()["depth"] == 5
+
+    await queue.close(timeout=1.0)
+
+    assert sum(batches, []) == [f"doc{i}" for i in range(5)]
+    assert max(len(batch) for batch in batches) <= 3
+    stats = queue.get_stats()
+    assert stats["committed"] == 5
+    assert stats["depth"] == 0
+    assert stats["commit_lag"]["count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_failed_writes_are_retried_with_backoff():
+    calls = []
+
+    async def write(items):
+        calls.append(len(items))
+        if len(calls) < 3:
+            raise RuntimeError("unavailable")
+
+    queue = WriteBehindQueue(write, workers=1, base_backoff=0.001)
+    await queue.start()
+    queue.offer(make_item(0))
+    await queue.close(timeout=1.0)
+
+    assert calls == [1, 1, 1]
+    stats = queue.get_stats()
+    assert stats["retries"] == 2
+    assert stats["committed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_offer_is_rejected_when_full_or_not_started():
+    gate = asyncio.Event()
+
+    async def write(items):
+        await gate.wait()
+
+    queue = WriteBehindQueue(write, max_size=2, workers=1)
+    assert not queue.offer(make_item(0))
+
+    await queue.start()
+    assert queue.offer(make_item(1))
+    assert queue.offer(make_item(2))
+    assert not queue.offer(make_item(3))
+    assert queue.get_stats()["rejected"] == 2
+
+    gate.set()
+    await queue.close(timeout=1.0)
+    assert not queue.offer(make_item(4))
+
+
+@pytest.mark.asyncio
+async def test_spool_replays_unwritten_items_after_crash(tmp_path):
+    spool = tmp_path / "spool.jsonl"
+
+    async def fail(items):
+        raise RuntimeError("unavailable")
+
+    # 1回目のプロセス: 書き込めないまま終了（doc0は書き込み済みとして記録されている）
+    crashed = WriteBehindQueue(fail, workers=1, max_attempts=1, spool_path=str(spool))
+    await crashed.start()
+    crashed.offer(make_item(0))
+    crashed.offer(make_item(1))
+    await crashed.close(timeout=1.0)
+    with open(spool, "a") as f:
+        f.write(json.dumps({"op": "ack", "id": "doc0"}) + "\n")
+        f.write('{"op": "put", "item": ')  # 書き込み途中の行
+
+    # 2回目のプロセス: 未書き込みのdoc1だけを再送する
+    written = []
+
+    async def write(items):
+        written.extend(items)
+
+    queue = WriteBehindQueue(write, workers=1, spool_path=str(spool))
+    await queue.start()
+    await queue.close(timeout=1.0)
+
+    assert [item["id"] for item in written] == ["doc1"]
+    assert written[0]["created_at"] == "2024-01-01T09:01:00"
+    assert queue.get_stats()["replayed"] == 1
+    assert spool.read_text() == ""
+
+
+@pytest.mark.asyncio
+async def test_exhausted_retries_requeue_instead_of_dropping():
+    calls = []
+
+    async def write(items):
+        calls.append([item["id"] for item in items])
+        if len(calls) <= 2:
+            raise RuntimeError("unavailable")
+
+    queue = WriteBehindQueue(write, workers=1, max_attempts=2, base_backoff=0.001, max_backoff=0.001)
+    await queue.start()
+    queue.offer(make_item(0))
+    await queue.close(timeout=1.0)
+
+    # 2回失敗したバッチは捨てずに積み直され、3回目で書き込まれる
+    assert calls == [["doc0"], ["doc0"], ["doc0"]]
+    stats = queue.get_stats()
+    assert stats["failed_batches"] == 1
+    assert stats["requeued"] == 1
+    assert stats["committed"] == 1
+    assert stats["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_spool_is_group_committed_and_compacted(tmp_path):
+    spool = tmp_path / "spool.jsonl"
+    gate = asyncio.Event()
+    written = []
+
+    async def write(items):
+        await gate.wait()
+        written.extend(item["id"] for item in items)
+
+    queue = WriteBehindQueue(write, workers=1, batch_size=10, spool_path=str(spool), spool_compact_lines=10)
+    await queue.start()
+    for i in range(6):
+        queue.offer(make_item(i))
+    await asyncio.sleep(0.05)
+
+    # 同じループの間に積んだ行は1回の fsync でまとめて追記される
+    assert queue.get_stats()["spool_syncs"] == 1
+    assert len(spool.read_text().splitlines()) == 6
+
+    gate.set()
+    await asyncio.sleep(0.05)
+    queue.offer(make_item(6))
+    await asyncio.sleep(0.05)
+
+    # 追記した行数が上限を超えたら、未書き込みの要素だけを残すように書き直す
+    stats = queue.get_stats()
+    assert stats["spool_compactions"] == 1
+    lines = [json.loads(line) for line in spool.read_text().splitlines()]
+    assert [(line["op"], line.get("id") or line["item"]["id"]) for line in lines] == [("put", "doc6"), ("ack", "doc6")]
+
+    await queue.close(timeout=1.0)
+    assert spool.read_text() == ""
+    assert len(written) == 7